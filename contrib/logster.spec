@@ -13,7 +13,7 @@ BuildRoot:      %{_tmppath}/%{name}-%{version}-%{release}-root-%(%{__id_u} -n)
 
 BuildArch:      noarch
 BuildRequires:  python-devel
-Requires:       logcheck,python
+Requires:       python
 
 %description
 Logster is a utility for reading log files and generating metrics in Graphite
@@ -40,6 +40,8 @@ rm -rf $RPM_BUILD_ROOT
 %files
 %defattr(-,root,root,-)
 %{_bindir}/logster
+%{_bindir}/logster-aggregate
+%{_bindir}/logster-listen
 %{python_sitelib}/*
 
 
@@ -0,0 +1,202 @@
+###
+###  logster-aggregate
+###
+###  Receives the partial state of parsers run with '--output aggregate' on many hosts, merges the
+###  states of the same parser and options per interval and finalises each merged state once, so that
+###  fleet-wide rates and percentiles are computed from all the data rather than averaged from per-host
+###  results, and only one stream of metrics is written.
+###
+###  Usage:
+###
+###    $ logster-aggregate [options]
+###
+###  and on each host:
+###
+###    $ logster --output aggregate --aggregate-host aggregate.example.com:5140 MetricLogster /var/log/app.log
+###
+###
+###  Copyright 2011, Etsy, Inc.
+###
+###  This file is part of Logster.
+###
+###  Logster is free software: you can redistribute it and/or modify
+###  it under the terms of the GNU General Public License as published by
+###  the Free Software Foundation, either version 3 of the License, or
+###  (at your option) any later version.
+###
+###  Logster is distributed in the hope that it will be useful,
+###  but WITHOUT ANY WARRANTY; without even the implied warranty of
+###  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+###  GNU General Public License for more details.
+###
+###  You should have received a copy of the GNU General Public License
+###  along with Logster. If not, see <http://www.gnu.org/licenses/>.
+###
+
+from __future__ import with_statement
+
+import sys
+import optparse
+import signal
+import threading
+
+from time import time, sleep
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver # Python 2
+
+from logster import partial_state
+from logster.run import (logger, setup_logging, add_common_options, check_common_options,
+    parser_class, submit_metrics, parse_address, terminate, close_graphite_clients)
+from logster.logster_helper import LogsterParser
+
+
+def get_args():
+    "Parse command-line options"
+
+    # defaults
+    listen = '0.0.0.0:5140'
+    interval = 60
+    grace = 15
+
+    cmdline = optparse.OptionParser(usage="usage: %prog [options]",
+        description="Merge the parser state sent by logster on many hosts and send the combined metrics to common monitoring packages.")
+    cmdline.add_option('--listen', '-l', action='store', default=listen,
+                        help='Address and port to receive parser state on.  Default %default')
+    cmdline.add_option('--interval', '-i', action='store', type='int', default=interval,
+                        help='Seconds of parser state to merge into each set of metrics; should match how often logster runs.  Default %default')
+    cmdline.add_option('--grace', action='store', type='int', default=grace,
+                        help='Seconds to wait past the end of an interval for late hosts.  Default %default')
+    cmdline.add_option('--parser', action='append', dest='parsers', default=[],
+                        help='Allow parser state of this parser, given as for logster, to be received (can specify multiple times). The bundled parsers are always allowed.')
+    add_common_options(cmdline)
+    options, arguments = cmdline.parse_args()
+
+    if arguments:
+        cmdline.print_help()
+        cmdline.error("logster-aggregate takes no arguments.")
+    check_common_options(cmdline, options)
+
+    return options
+
+
+class Aggregator(object):
+    """
+    Merges partial states by parser, parser options and the interval they
+    were sent in, and passes the metrics of each interval to submit once the
+    interval is over, along with a name for the parser and its options.
+    """
+
+    def __init__(self, interval, grace, submit, parsers=()):
+        self.interval = interval
+        self.grace = grace
+        self.submit = submit
+        self.parsers = parsers
+        self.groups = {}
+        self.lock = threading.Lock()
+
+    def allowed(self, parser_name):
+        """Only parsers logster ships, named as 'logster.parsers.<Name>:<Name>',
+        or that were named on the command line, may be loaded on behalf of a
+        client."""
+        module, sep, class_name = parser_name.rpartition(':')
+        return module == 'logster.parsers.' + class_name or parser_name in self.parsers
+
+    def load(self, parser_name, parser_options):
+        cls = parser_class(parser_name)
+        if not (isinstance(cls, type) and issubclass(cls, LogsterParser)):
+            raise ValueError("%s is not a parser" % parser_name)
+        try:
+            return cls(option_string=parser_options)
+        except SystemExit:
+            # optparse exits on -h or an invalid option.
+            raise ValueError("Invalid parser options %r for %s" % (parser_options, parser_name))
+
+    def add(self, message):
+        parser_name = message['parser']
+        if not self.allowed(parser_name):
+            raise ValueError("Parser %s is not allowed, see --parser" % parser_name)
+        key = (parser_name, message['parser_options'], int(message['timestamp'] // self.interval))
+
+        with self.lock:
+            group = self.groups.get(key)
+            if group is None:
+                parser = self.load(parser_name, message['parser_options'])
+                group = self.groups[key] = {'parser': parser, 'duration': 0, 'hosts': set()}
+            group['parser'].merge_partial_state(message['state'])
+            group['duration'] = max(group['duration'], message['duration'])
+            group['hosts'].add(message.get('host'))
+
+    def flush(self, now=None):
+        """Submit the metrics of every interval that ended more than grace
+        seconds before now."""
+        if now is None:
+            now = time()
+        with self.lock:
+            due = [key for key in self.groups
+                if (key[2] + 1) * self.interval + self.grace <= now]
+            groups = [(key, self.groups.pop(key)) for key in sorted(due)]
+
+        for (parser_name, parser_options, interval), group in groups:
+            logger.info("Merged %s from %d hosts" % (parser_name, len(group['hosts'])))
+            job = parser_name
+            if parser_options:
+                job += ' ' + parser_options
+            try:
+                metrics = group['parser'].get_state(group['duration'])
+                for metric in metrics:
+                    metric.timestamp = interval * self.interval
+                self.submit(metrics, job)
+            except Exception:
+                e = sys.exc_info()[1]
+                logger.error("Failed to submit merged %s: %s" % (parser_name, e))
+
+
+class PartialStateHandler(socketserver.StreamRequestHandler):
+    """Reads one JSON encoded partial state per line."""
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                self.server.aggregator.add(partial_state.loads(line.decode('utf-8')))
+            except Exception:
+                e = sys.exc_info()[1]
+                logger.warning("Dropping partial state from %s: %s" % (self.client_address[0], e))
+
+
+class AggregateServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address, aggregator):
+        socketserver.TCPServer.__init__(self, address, PartialStateHandler)
+        self.aggregator = aggregator
+
+
+def main():
+    options = get_args()
+    setup_logging(options)
+
+    aggregator = Aggregator(options.interval, options.grace,
+        lambda metrics, job: submit_metrics(metrics, options, job), options.parsers)
+    server = AggregateServer(parse_address(options.listen), aggregator)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    logger.info("Listening for parser state on %s" % options.listen)
+    signal.signal(signal.SIGTERM, terminate)
+
+    try:
+        while True:
+            sleep(1)
+            aggregator.flush()
+    except (KeyboardInterrupt, SystemExit):
+        server.shutdown()
+        aggregator.flush(float('inf'))
+        close_graphite_clients()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+###
+###  Sends metrics to one or more Graphite destinations over the plaintext protocol. With several,
+###  given as a comma-separated list of host:port or host:port:instance, each metric name is routed
+###  with the same consistent-hash ring as carbon-relay's consistent-hashing relay method, so the
+###  destinations can be the carbon-caches themselves, or relays, and each name always lands on the
+###  same one. One connection is kept per destination; a metric whose destination can't be reached
+###  goes to the next destination on the ring, as carbon-relay does.
+###
+###  List the destinations as in carbon-relay's DESTINATIONS, instances included, so that logster and
+###  carbon agree on where each name lives.
+###
+###
+###  Copyright 2011, Etsy, Inc.
+###
+###  This file is part of Logster.
+###
+###  Logster is free software: you can redistribute it and/or modify
+###  it under the terms of the GNU General Public License as published by
+###  the Free Software Foundation, either version 3 of the License, or
+###  (at your option) any later version.
+###
+###  Logster is distributed in the hope that it will be useful,
+###  but WITHOUT ANY WARRANTY; without even the implied warranty of
+###  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+###  GNU General Public License for more details.
+###
+###  You should have received a copy of the GNU General Public License
+###  along with Logster. If not, see <http://www.gnu.org/licenses/>.
+###
+
+import re
+import sys
+import bisect
+import socket
+import logging
+
+from hashlib import md5
+
+logger = logging.getLogger('logster')
+
+destination_pattern = re.compile(r'^([\w\.\-]+):(\d+)(?::([\w\.\-]+))?$')
+
+
+def parse_destinations(value):
+    """
+    Split a comma-separated list of host:port[:instance] into a list of
+    (host, port, instance) tuples, instance being None where not given.
+    """
+    destinations = []
+    nodes = set()
+    for destination in value.split(','):
+        match = destination_pattern.match(destination.strip())
+        if not match:
+            raise ValueError("Invalid host:port found for Graphite: '%s'" % destination)
+        host, port, instance = match.groups()
+        # The ring tells destinations apart by host and instance only.
+        if (host, instance) in nodes:
+            raise ValueError("Graphite destinations on the same host need different instances: '%s'" % value)
+        nodes.add((host, instance))
+        destinations.append((host, int(port), instance))
+    return destinations
+
+
+class ConsistentHashRing(object):
+    """
+    The ring of carbon's ConsistentHashRing: each node is placed at 100
+    positions, the first 16 bits of the md5 of "<node>:<replica>", where a
+    node is a (host, instance) tuple; a key belongs to the first node at or
+    after its own position.
+    """
+
+    def __init__(self, nodes, replica_count=100):
+        self.ring = []
+        self.nodes = []
+        self.replica_count = replica_count
+        for node in nodes:
+            self.add_node(node)
+
+    def compute_ring_position(self, key):
+        return int(md5(key.encode('utf-8')).hexdigest()[:4], 16)
+
+    def add_node(self, node):
+        self.nodes.append(node)
+        positions = set([position for position, entry in self.ring])
+        for i in range(self.replica_count):
+            position = self.compute_ring_position("%s:%d" % (node, i))
+            while position in positions:
+                position += 1
+            positions.add(position)
+            bisect.insort(self.ring, (position, node))
+
+    def get_node(self, key):
+        position = self.compute_ring_position(key)
+        index = bisect.bisect_left(self.ring, (position, ())) % len(self.ring)
+        return self.ring[index][1]
+
+    def get_nodes(self, key):
+        """Yield every node, in the order they follow the key round the ring."""
+        if len(self.nodes) == 1:
+            yield self.nodes[0]
+            return
+        position = self.compute_ring_position(key)
+        index = bisect.bisect_left(self.ring, (position, ())) % len(self.ring)
+        seen = set()
+        for i in range(len(self.ring)):
+            node = self.ring[(index + i) % len(self.ring)][1]
+            if node not in seen:
+                seen.add(node)
+                yield node
+                if len(seen) == len(self.nodes):
+                    return
+
+
+class GraphiteClient(object):
+    """
+    Sends metric lines to the destinations of a --graphite-host list, each
+    over a connection kept open between calls to send.
+    """
+
+    def __init__(self, destinations, timeout=10):
+        self.addresses = dict(((host, instance), (host, port))
+            for host, port, instance in destinations)
+        self.ring = ConsistentHashRing([(host, instance) for host, port, instance in destinations])
+        self.timeout = timeout
+        self.connections = {}
+
+    def route(self, metrics, down=()):
+        """Group (name, line) pairs by the first node on the ring for each
+        name that isn't down, returning a dict of lists of lines by node."""
+        batches = {}
+        for name, line in metrics:
+            for node in self.ring.get_nodes(name):
+                if node not in down:
+                    batches.setdefault(node, []).append((name, line))
+                    break
+        return batches
+
+    def send(self, metrics):
+        """
+        Send (name, line) pairs, moving on to the next destination on the
+        ring for the metrics of a destination that fails. Raises IOError if
+        some metrics could not be sent anywhere.
+        """
+        down = set()
+        pending = metrics
+        while pending:
+            batches = self.route(pending, down)
+            lost = len(pending) - sum([len(batch) for batch in batches.values()])
+            if lost:
+                raise IOError("Failed to send %d metrics to any Graphite destination" % lost)
+            pending = []
+            for node, batch in batches.items():
+                data = ''.join([line for name, line in batch]).encode('utf-8')
+                try:
+                    self.connection(node).sendall(data)
+                except (socket.error, EnvironmentError):
+                    e = sys.exc_info()[1]
+                    logger.warning("Failed to send metrics to Graphite at %s:%d: %s"
+                        % (self.addresses[node] + (e,)))
+                    self.close_connection(node)
+                    down.add(node)
+                    pending.extend(batch)
+
+    def connection(self, node):
+        connection = self.connections.get(node)
+        if connection is None:
+            connection = socket.create_connection(self.addresses[node], self.timeout)
+            self.connections[node] = connection
+        return connection
+
+    def close_connection(self, node):
+        connection = self.connections.pop(node, None)
+        if connection is not None:
+            connection.close()
+
+    def close(self):
+        for node in list(self.connections):
+            self.close_connection(node)
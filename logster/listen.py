@@ -0,0 +1,378 @@
+###
+###  logster-listen
+###
+###  Receives syslog messages over UDP, TCP or a unix datagram socket and feeds them to a logster
+###  parser as they arrive, sending its metrics every --interval seconds. For services that log to
+###  syslog and never write a file, this saves writing each message to a file only for logster to
+###  read it back.
+###
+###  Usage:
+###
+###    $ logster-listen [options] parser
+###
+###  For example, to receive on UDP port 5514 and on a unix socket that rsyslog or a local service
+###  can send to:
+###
+###    $ logster-listen --listen udp://0.0.0.0:5514 --listen unix:///run/logster.sock --output stdout Log4jLogster
+###
+###  The syslog priority, e.g. "<13>", is removed from each message, leaving the line as the syslog
+###  daemon would have written it to a file. Over TCP, messages are framed as in RFC 6587, by octet
+###  counting or one per line. On SIGTERM or an interrupt, the metrics of the interval so far are
+###  sent before exiting.
+###
+###
+###  Copyright 2011, Etsy, Inc.
+###
+###  This file is part of Logster.
+###
+###  Logster is free software: you can redistribute it and/or modify
+###  it under the terms of the GNU General Public License as published by
+###  the Free Software Foundation, either version 3 of the License, or
+###  (at your option) any later version.
+###
+###  Logster is distributed in the hope that it will be useful,
+###  but WITHOUT ANY WARRANTY; without even the implied warranty of
+###  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+###  GNU General Public License for more details.
+###
+###  You should have received a copy of the GNU General Public License
+###  along with Logster. If not, see <http://www.gnu.org/licenses/>.
+###
+
+import os
+import re
+import sys
+import stat
+import errno
+import signal
+import select
+import socket
+import optparse
+
+from time import time
+
+from logster.logster_helper import PARSE_ERROR
+from logster.run import (logger, setup_logging, add_common_options, check_common_options,
+    load_parser, submit_stats, parse_address, job_name, terminate, close_graphite_clients,
+    ParseStats)
+from logster.tailer import decode
+
+priority = re.compile(br'<\d{1,3}>')
+
+# Errors from a non-blocking socket that has nothing more to read for now.
+would_block = (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR)
+
+
+def get_args():
+    "Parse command-line options"
+
+    # defaults
+    interval = 60
+    batch_size = 64
+    buffer_size = 65536
+    receive_buffer = 4 * 1024 * 1024
+    log_failures = 10
+
+    cmdline = optparse.OptionParser(usage="usage: %prog [options] parser",
+        description="Receive syslog messages and filter each one to generate metrics that can be sent to common monitoring packages.")
+    cmdline.add_option('--listen', '-l', action='append', default=[],
+                        help='Where to receive syslog messages: udp://HOST:PORT, tcp://HOST:PORT, or unix:///PATH for a unix datagram socket (can specify multiple times).')
+    cmdline.add_option('--interval', '-i', action='store', type='int', default=interval,
+                        help='Send the metrics of the messages received every this many seconds.  Default %default')
+    cmdline.add_option('--parser-help', action='store_true',
+                        help='Print usage and options for the selected parser')
+    cmdline.add_option('--parser-options', action='store',
+                        help='Options to pass to the logster parser such as "-o VALUE --option2 VALUE". These are parser-specific and passed directly to the parser.')
+    cmdline.add_option('--batch-size', action='store', type='int', default=batch_size,
+                        help='Receive at most this many messages from a socket before moving on to the next.  Default %default')
+    cmdline.add_option('--buffer-size', action='store', type='int', default=buffer_size,
+                        help='Bytes of the buffer each socket receives into; longer datagrams are truncated.  Default %default')
+    cmdline.add_option('--receive-buffer', action='store', type='int', default=receive_buffer,
+                        help='Bytes the kernel may queue on a UDP or unix socket while messages are being parsed, beyond which messages are dropped; capped by net.core.rmem_max.  Default %default')
+    cmdline.add_option('--log-failures', action='store', type='int', default=log_failures,
+                        help='Log the first this many messages per interval that the parser did not match or failed on, with --debug.  Default %default')
+    add_common_options(cmdline)
+    options, arguments = cmdline.parse_args()
+
+    if options.parser_help:
+        options.parser_options = '-h'
+
+    if len(arguments) != 1:
+        cmdline.print_help()
+        cmdline.error("Supply one argument: the parser.")
+    if not options.listen:
+        cmdline.print_help()
+        cmdline.error("Supply where to receive messages with --listen.")
+    for url in options.listen:
+        try:
+            parse_listen(url)
+        except Exception:
+            cmdline.error(str(sys.exc_info()[1]))
+    check_common_options(cmdline, options)
+
+    return arguments[0], options
+
+
+def parse_listen(url):
+    """Split a --listen URL into the family, type and address of the socket."""
+    scheme, separator, address = url.partition('://')
+    if scheme == 'udp':
+        return socket.AF_INET, socket.SOCK_DGRAM, parse_address(address)
+    if scheme == 'tcp':
+        return socket.AF_INET, socket.SOCK_STREAM, parse_address(address)
+    if scheme == 'unix' and address:
+        return socket.AF_UNIX, socket.SOCK_DGRAM, address
+    raise ValueError("Invalid --listen %r, expected udp://HOST:PORT, tcp://HOST:PORT or unix:///PATH" % url)
+
+
+def syslog_line(message):
+    """Turn a syslog message into a line as the syslog daemon would write it:
+    without the priority and ending in a newline."""
+    match = priority.match(message)
+    if match:
+        message = message[match.end():]
+    if not message.endswith(b'\n'):
+        message += b'\n'
+    return message
+
+
+class DatagramSource(object):
+    """
+    A bound UDP or unix datagram socket. Each message is received into the
+    same buffer and copied out once, so receiving allocates nothing but the
+    messages themselves.
+    """
+
+    def __init__(self, sock, buffer_size):
+        self.sock = sock
+        self.buffer = bytearray(buffer_size)
+        self.view = memoryview(self.buffer)
+        self.closed = False
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def receive(self, batch_size):
+        """Return up to batch_size messages waiting on the socket."""
+        messages = []
+        recv_into = self.sock.recv_into
+        buffer, view = self.buffer, self.view
+        while len(messages) < batch_size:
+            try:
+                size = recv_into(buffer)
+            except socket.error:
+                e = sys.exc_info()[1]
+                if e.args[0] in would_block:
+                    break
+                raise
+            messages.append(view[:size].tobytes())
+        return messages
+
+    def close(self):
+        self.sock.close()
+
+
+class StreamSource(object):
+    """
+    A TCP connection from a syslog client. Messages are framed as in RFC
+    6587: by octet counting, "<length> <message>", or else one per line.
+    """
+
+    def __init__(self, sock, buffer_size):
+        self.sock = sock
+        self.buffer = bytearray(buffer_size)
+        self.view = memoryview(self.buffer)
+        self.pending = bytearray()
+        self.closed = False
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def receive(self, batch_size):
+        """Read up to batch_size buffers of data and return the messages
+        completed by them."""
+        recv_into = self.sock.recv_into
+        buffer, view = self.buffer, self.view
+        for i in range(batch_size):
+            try:
+                size = recv_into(buffer)
+            except socket.error:
+                e = sys.exc_info()[1]
+                if e.args[0] in would_block:
+                    break
+                logger.warning("Connection from %s failed: %s" % (self.sock.getpeername()[0], e))
+                size = 0
+            if not size:
+                self.closed = True
+                break
+            self.pending += view[:size]
+        return self.frames()
+
+    def frames(self):
+        """Take the complete messages out of the data received so far."""
+        pending = self.pending
+        messages = []
+        start = 0
+        while start < len(pending):
+            space = pending.find(b' ', start)
+            if space > start and pending[start:space].isdigit():
+                end = space + 1 + int(pending[start:space])
+                if end > len(pending):
+                    break
+                message = pending[space + 1:end]
+            else:
+                end = pending.find(b'\n', start)
+                if end == -1:
+                    break
+                message = pending[start:end]
+                end += 1
+            if message.strip():
+                messages.append(bytes(message))
+            start = end
+        del pending[:start]
+        # Don't let a client that never ends a message use up memory.
+        if pending and (self.closed or len(pending) > len(self.buffer)):
+            messages.append(bytes(pending))
+            del pending[:]
+        return messages
+
+    def close(self):
+        self.sock.close()
+
+
+class Listener(object):
+    """
+    Receives syslog messages on the sockets of the --listen URLs, and on the
+    connections accepted on its TCP sockets.
+    """
+
+    def __init__(self, urls, buffer_size=65536, batch_size=64, receive_buffer=None):
+        self.buffer_size = buffer_size
+        self.batch_size = batch_size
+        self.servers = []
+        self.sources = []
+        for url in urls:
+            family, type, address = parse_listen(url)
+            sock = socket.socket(family, type)
+            if family == socket.AF_UNIX:
+                # A socket left behind by an earlier run would stop bind. Any
+                # other file is left alone, for bind to fail on.
+                try:
+                    if stat.S_ISSOCK(os.stat(address).st_mode):
+                        os.unlink(address)
+                except OSError:
+                    pass
+            else:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind(address)
+            if family == socket.AF_UNIX:
+                # Any local service may log to it, as to /dev/log.
+                os.chmod(address, 438) # 0666
+            sock.setblocking(0)
+            if type == socket.SOCK_STREAM:
+                sock.listen(socket.SOMAXCONN)
+                self.servers.append(sock)
+            else:
+                # Datagrams that arrive while the queue is full are lost.
+                if receive_buffer:
+                    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, receive_buffer)
+                self.sources.append(DatagramSource(sock, buffer_size))
+
+    def receive(self, timeout):
+        """Wait up to timeout seconds for messages, and return the messages
+        received, at most batch_size from each socket ready to read."""
+        readable = select.select(self.servers + self.sources, [], [], timeout)[0]
+        messages = []
+        for source in readable:
+            if source in self.servers:
+                self.accept(source)
+                continue
+            messages.extend(source.receive(self.batch_size))
+            if source.closed:
+                source.close()
+                self.sources.remove(source)
+        return messages
+
+    def accept(self, server):
+        while True:
+            try:
+                sock, address = server.accept()
+            except socket.error:
+                e = sys.exc_info()[1]
+                if e.args[0] in would_block or e.args[0] == errno.ECONNABORTED:
+                    return
+                raise
+            sock.setblocking(0)
+            self.sources.append(StreamSource(sock, self.buffer_size))
+
+    def close(self):
+        for sock in self.servers + self.sources:
+            sock.close()
+        self.servers = []
+        self.sources = []
+
+
+def flush(class_name, parser, parse_stats, duration, options, job):
+    """Send the metrics of the messages parsed since the last flush, and
+    return a new parser for the next interval, with the state the parser
+    carries over from one run to the next."""
+    parse_stats.parsed = parse_stats.lines
+    try:
+        submit_stats(parser, duration, options, parse_stats, job)
+    except Exception:
+        e = sys.exc_info()[1]
+        logger.error("Failed to submit metrics: %s" % e)
+
+    new_parser = load_parser(class_name, option_string=options.parser_options)
+    state = parser.get_persistent_state()
+    if state is not None:
+        new_parser.set_persistent_state(state)
+    return new_parser
+
+
+def main():
+    class_name, options = get_args()
+    setup_logging(options)
+    signal.signal(signal.SIGTERM, terminate)
+
+    job = job_name(class_name, ','.join(options.listen))
+    parser = load_parser(class_name, option_string=options.parser_options)
+    listener = Listener(options.listen, options.buffer_size, options.batch_size,
+        options.receive_buffer)
+    logger.info("Listening for syslog messages on %s" % ', '.join(options.listen))
+
+    last_flush = time()
+    parse_stats = ParseStats(options.log_failures)
+    try:
+        while True:
+            messages = listener.receive(max(0, last_flush + options.interval - time()))
+            parse_line = parser.parse_line
+            for message in messages:
+                line = syslog_line(message)
+                if not parser.binary:
+                    line = decode(line)
+                parse_stats.lines += 1
+                try:
+                    result = parse_line(line)
+                    if result is not None:
+                        parse_stats.record(result, line)
+                except Exception:
+                    # A message a parser can't cope with mustn't stop the
+                    # daemon, whatever the parser raises.
+                    parse_stats.record(PARSE_ERROR, line, sys.exc_info()[1])
+
+            now = time()
+            if now >= last_flush + options.interval:
+                parser = flush(class_name, parser, parse_stats, now - last_flush, options, job)
+                parse_stats = ParseStats(options.log_failures)
+                last_flush = now
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        # However it stops, the metrics of the interval so far are sent.
+        listener.close()
+        flush(class_name, parser, parse_stats, time() - last_flush, options, job)
+        close_graphite_clients()
+
+if __name__ == '__main__':
+    main()
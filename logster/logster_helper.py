@@ -19,34 +19,166 @@
 ###  along with Logster. If not, see <http://www.gnu.org/licenses/>.
 ###
 
+import numbers
+
 from time import time
 
+# The results parse_line returns. A parser that returns nothing has matched
+# the line. Returning UNMATCHED for a line of no interest, or PARSE_ERROR for
+# one that should have matched but couldn't be understood, is much cheaper
+# than raising LogsterParsingException on every such line.
+MATCHED = None
+UNMATCHED = 1
+PARSE_ERROR = 2
+
 class MetricObject(object):
     """General representation of a metric that can be used in many contexts"""
-    def __init__(self, name, value, units='', type='float', timestamp=int(time())):
+    def __init__(self, name, value, units='', type='float', timestamp=None):
         self.name = name
         self.value = value
         self.units = units
         self.type = type
+        if timestamp is None:
+            timestamp = int(time())
         self.timestamp = timestamp
 
+
+def merge_values(value, other):
+    """Combine two pieces of partial state: numbers are added, lists
+    concatenated, dicts merged key by key and objects such as histograms
+    merged with their merge method. Anything else, e.g. a unit, keeps the
+    first value."""
+    if value is None:
+        return other
+    if other is None:
+        return value
+    if isinstance(value, numbers.Number) and not isinstance(value, bool):
+        return value + other
+    if isinstance(value, list):
+        return value + other
+    if isinstance(value, dict):
+        for key, item in other.items():
+            value[key] = merge_values(value.get(key), item)
+        return value
+    if hasattr(value, 'merge'):
+        value.merge(other)
+    return value
+
+def scale_values(value, factor):
+    """Multiply the counts in a piece of partial state by factor: numbers
+    are multiplied, dicts scaled key by key, and objects such as histograms
+    scaled with their scale method. Anything else, e.g. the values kept for
+    percentiles, is left as it is."""
+    if isinstance(value, numbers.Number) and not isinstance(value, bool):
+        return value * factor
+    if isinstance(value, dict):
+        for key, item in value.items():
+            value[key] = scale_values(item, factor)
+        return value
+    if hasattr(value, 'scale'):
+        value.scale(factor)
+    return value
+
 class LogsterParser(object):
     """Base class for logster parsers"""
+
+    # Parsers that set this receive each line as the bytes read from the log
+    # rather than as decoded text, and match it with bytes patterns. Only the
+    # captured groups they use then need decoding.
+    binary = False
+
+    # The attributes holding what has been parsed so far, as opposed to the
+    # parser's configuration. Declaring them lets the parser's partial state
+    # be sent to logster-aggregate and merged with that of other hosts.
+    partial_state_attributes = None
+
+    # The attributes carried over from one run to the next, such as requests
+    # that were still in progress at the end of the log. They are saved with
+    # the job once the metrics are sent and restored before the next run, and
+    # are left out of the state sent to logster-aggregate.
+    persistent_state_attributes = ()
+
+    # Parsers of logs whose lines repeat but for a prefix such as a
+    # timestamp can be run with --parse-cache. They split parse_line into
+    # classify_line and count_line, and set this to a pattern (bytes for
+    # binary parsers, '' for none) matching the prefix that doesn't change
+    # how a line is classified. The classification of the rest of the line
+    # is then cached, and repeated lines skip classify_line.
+    cache_prefix = None
+
     def parse_line(self, line):
-        """Take a line and do any parsing we need to do. Required for parsers"""
+        """Take a line and do any parsing we need to do, returning MATCHED,
+        UNMATCHED or PARSE_ERROR. Required for parsers"""
         raise RuntimeError("Implement me!")
 
+    def classify_line(self, line):
+        """Work out what a line means without changing the parser's state,
+        returning a value for count_line. The value may be cached and given
+        to count_line again, so count_line must not change it."""
+        raise NotImplementedError("%s does not support --parse-cache"
+            % self.__class__.__name__)
+
+    def count_line(self, classification):
+        """Record a line classified by classify_line, returning MATCHED,
+        UNMATCHED or PARSE_ERROR as parse_line does."""
+        raise NotImplementedError("%s does not support --parse-cache"
+            % self.__class__.__name__)
+
     def get_state(self, duration):
         """Run any calculations needed and return list of metric objects"""
         raise RuntimeError("Implement me!")
 
+    def get_partial_state(self):
+        """Return a picklable snapshot of what has been parsed so far, so a
+        long run can be checkpointed. This is partial_state_attributes if
+        declared, else all attributes. Override if the parser holds anything
+        that can't be pickled."""
+        if self.partial_state_attributes is None:
+            return self.__dict__.copy()
+        return dict((name, getattr(self, name)) for name in self.partial_state_attributes)
+
+    def set_partial_state(self, state):
+        """Restore a snapshot taken by get_partial_state."""
+        self.__dict__.update(state)
+
+    def scale_partial_state(self, factor):
+        """Scale the counts parsed from a sample of the lines up to estimate
+        those of all lines, factor being lines read per line parsed."""
+        if self.partial_state_attributes is None:
+            raise NotImplementedError("%s does not declare partial_state_attributes"
+                % self.__class__.__name__)
+        for name in self.partial_state_attributes:
+            setattr(self, name, scale_values(getattr(self, name), factor))
+
+    def get_persistent_state(self):
+        """Return a picklable copy of persistent_state_attributes, or None if
+        the parser doesn't carry anything over."""
+        if not self.persistent_state_attributes:
+            return None
+        return dict((name, getattr(self, name)) for name in self.persistent_state_attributes)
+
+    def set_persistent_state(self, state):
+        """Restore the state saved by get_persistent_state at the end of the
+        last run."""
+        self.__dict__.update(state)
+
+    def merge_partial_state(self, state):
+        """Add the partial state of the same parser, with the same options,
+        from another host or shard to this one."""
+        if self.partial_state_attributes is None:
+            raise NotImplementedError("%s does not declare partial_state_attributes"
+                % self.__class__.__name__)
+        for name in self.partial_state_attributes:
+            setattr(self, name, merge_values(getattr(self, name), state.get(name)))
+
 
 class LogsterParsingException(Exception):
     """Raise this exception if the parse_line function wants to
         throw a 'recoverable' exception - i.e. you want parsing
-        to continue but want to skip this line and log a failure."""
+        to continue but want to skip this line and log a failure.
+        The line is counted as a PARSE_ERROR; returning that is cheaper."""
     pass
 
 class LockingError(Exception):
-    """ Exception raised for errors creating or destroying lockfiles. """
+    """ Exception raised for errors acquiring or releasing job locks. """
     pass
@@ -7,13 +7,20 @@
 ###
 
 import re
-import sys
 
 from logster.logster_helper import MetricObject, LogsterParser
-from logster.logster_helper import LogsterParsingException
+from logster.logster_helper import UNMATCHED
 
 class ErrorLogLogster(LogsterParser):
 
+    # Lines are matched as bytes, so the log level is the only text decoded.
+    binary = True
+
+    partial_state_attributes = ('notice', 'warn', 'error', 'crit', 'other')
+
+    # The timestamp that starts each line; the level follows it.
+    cache_prefix = br'\[[^]]+\] '
+
     def __init__(self, option_string=None):
         '''Initialize any data structures or variables needed for keeping track
         of the tasty bits we find in the log we are parsing.'''
@@ -25,37 +32,36 @@ class ErrorLogLogster(LogsterParser):
 
         # Regular expression for matching lines we are interested in, and capturing
         # fields from the line
-        self.reg = re.compile('^\[[^]]+\] \[(?P<loglevel>\w+)\] .*')
+        self.reg = re.compile(br'^\[[^]]+\] \[(?P<loglevel>\w+)\] ')
 
     def parse_line(self, line):
         '''This function should digest the contents of one line at a time, updating
         object's state variables. Takes a single argument, the line to be parsed.'''
+        return self.count_line(self.classify_line(line))
 
-        try:
-            # Apply regular expression to each line and extract interesting bits.
-            regMatch = self.reg.match(line)
-
-            if regMatch:
-                linebits = regMatch.groupdict()
-                level = linebits['loglevel']
+    def classify_line(self, line):
+        '''Return the log level of a line, or None if it isn't an error_log line.'''
 
-                if (level == 'notice'):
-                    self.notice += 1
-                elif (level == 'warn'):
-                    self.warn += 1
-                elif (level == 'error'):
-                    self.error += 1
-                elif (level == 'crit'):
-                    self.crit += 1
-                else:
-                    self.other += 1
+        # Apply regular expression to each line and extract interesting bits.
+        regMatch = self.reg.match(line)
+        if not regMatch:
+            return None
+        return regMatch.group('loglevel').decode('ascii', 'replace')
 
-            else:
-                raise LogsterParsingException("regmatch failed to match")
+    def count_line(self, level):
+        if level is None:
+            return UNMATCHED
 
-        except Exception:
-            e = sys.exc_info()[1]
-            raise LogsterParsingException("regmatch or contents failed with %s" % e)
+        if (level == 'notice'):
+            self.notice += 1
+        elif (level == 'warn'):
+            self.warn += 1
+        elif (level == 'error'):
+            self.error += 1
+        elif (level == 'crit'):
+            self.crit += 1
+        else:
+            self.other += 1
 
     def get_state(self, duration):
         '''Run any necessary calculations on the data collected from the logs
@@ -0,0 +1,204 @@
+###  A parser for logs of one JSON object per line, such as those of API gateways and of services
+###  that log structured events. Counters, times and the dimensions to break them down by are
+###  picked out of each object by dotted paths to its fields, e.g. upstream.latency for
+###    {"status": 200, "upstream": {"latency": 12.5}}
+###  An integer in a path indexes a list, e.g. backends.0.latency.
+###
+###  The options are:
+###    --counter PATH     sum the values of a field, reported per second like MetricLogster's counts
+###    --timer PATH[:UNIT]  report the mean, median and --percentiles of the values of a field
+###    --dimension PATH   also report each counter and time per value of a field, as
+###                         <counter>.<dimension>.<value>
+###    --skip TEXT        ignore lines containing TEXT, before they are decoded
+###    --require TEXT     ignore lines not containing TEXT, before they are decoded
+###  --counter, --timer and --dimension take comma-separated paths and can be given more than once.
+###  Lines matched are counted as "lines" (see --lines-name), broken down by the dimensions too.
+###  Counters and times are kept as in MetricLogster, so its --percentiles, --histogram, --windows
+###  and --max-metrics apply; --max-metrics guards against dimensions with unbounded values.
+###
+###  For example:
+###  sudo ./logster --output=stdout JsonLogster /var/log/gateway/access.json --parser-options \
+###      '--counter bytes --timer upstream.latency:ms --dimension status --skip "\"path\":\"/health\""'
+###
+###  gives, with the dimension values made safe for metric names:
+###    lines, lines.status.200, lines.status.503, bytes, bytes.status.200, ...
+###    upstream.latency.mean, upstream.latency.median, upstream.latency.90th_percentile,
+###    upstream.latency.status.200.mean, ...
+###
+###  Text before the first "{" of a line, such as a syslog prefix, is ignored. Lines are decoded with
+###  orjson or ujson when installed, otherwise with the json module.
+###
+###
+###  Copyright 2011, Etsy, Inc.
+###
+###  This file is part of Logster.
+###
+###  Logster is free software: you can redistribute it and/or modify
+###  it under the terms of the GNU General Public License as published by
+###  the Free Software Foundation, either version 3 of the License, or
+###  (at your option) any later version.
+###
+###  Logster is distributed in the hope that it will be useful,
+###  but WITHOUT ANY WARRANTY; without even the implied warranty of
+###  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+###  GNU General Public License for more details.
+###
+###  You should have received a copy of the GNU General Public License
+###  along with Logster. If not, see <http://www.gnu.org/licenses/>.
+###
+
+import math
+import shlex
+import optparse
+
+try:
+    from orjson import loads
+except ImportError:
+    try:
+        from ujson import loads
+    except ImportError:
+        from json import loads
+
+from logster.parsers.MetricLogster import MetricLogster, add_options
+from logster.parsers.access_log_helper import metric_safe
+from logster.logster_helper import MATCHED, UNMATCHED, PARSE_ERROR
+
+
+def field_getter(path):
+    """Return a function taking the value at a dotted path out of a decoded
+    object, or None if the object has no such field."""
+    keys = path.split('.')
+    if len(keys) == 1:
+        key = keys[0]
+        return lambda record: record.get(key)
+    steps = [(key, int(key) if key.isdigit() else None) for key in keys]
+    def get(record):
+        for key, index in steps:
+            if isinstance(record, dict):
+                record = record.get(key)
+            elif isinstance(record, list) and index is not None and index < len(record):
+                record = record[index]
+            else:
+                return None
+        return record
+    return get
+
+
+def split_paths(values):
+    return [path for value in values for path in value.split(',') if path]
+
+
+def finite_number(value):
+    """Return a field value as a float, or None if it isn't a finite number:
+    NaN and infinities can't be summed or kept in histograms."""
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    if math.isnan(value) or math.isinf(value):
+        return None
+    return value
+
+
+def encode(text):
+    if not isinstance(text, bytes):
+        text = text.encode('utf-8')
+    return text
+
+
+class JsonLogster(MetricLogster):
+
+    # Lines are decoded as JSON straight from the bytes read.
+    binary = True
+
+    def __init__(self, option_string=None):
+        if option_string:
+            options = shlex.split(option_string)
+        else:
+            options = []
+
+        optparser = optparse.OptionParser()
+        optparser.add_option('--counter', '-c', dest='counters', action='append', default=[],
+                            help='Comma-separated paths of fields to sum (can specify multiple times)')
+        optparser.add_option('--timer', '-t', dest='timers', action='append', default=[],
+                            help='Comma-separated paths of fields to report the percentiles of, each optionally followed by :UNIT (can specify multiple times)')
+        optparser.add_option('--dimension', '-d', dest='dimensions', action='append', default=[],
+                            help='Comma-separated paths of fields to break the counters and timers down by the values of (can specify multiple times)')
+        optparser.add_option('--skip', dest='skip', action='append', default=[],
+                            help='Ignore lines containing this text, checked before decoding (can specify multiple times)')
+        optparser.add_option('--require', dest='require', action='append', default=[],
+                            help='Ignore lines not containing this text, checked before decoding (can specify multiple times)')
+        optparser.add_option('--lines-name', dest='lines_name', default='lines',
+                            help='Name of the count of lines matched, or "" for none (default: "lines")')
+        add_options(optparser)
+        opts, args = optparser.parse_args(args=options)
+        self.set_options(opts, optparser)
+
+        self.counters = [(path, field_getter(path)) for path in split_paths(opts.counters)]
+        self.timers = []
+        for timer in split_paths(opts.timers):
+            path, separator, unit = timer.partition(':')
+            self.timers.append((path, field_getter(path), unit))
+        # The suffixes of the metric names for the values of each dimension
+        # seen recently; a dimension such as a request id may have no end of them.
+        self.dimensions = [(path, field_getter(path), {}) for path in split_paths(opts.dimensions)]
+        self.skip = [encode(text) for text in opts.skip]
+        self.require = [encode(text) for text in opts.require]
+        self.lines_name = opts.lines_name
+
+    def parse_line(self, line):
+        for text in self.skip:
+            if text in line:
+                return UNMATCHED
+        for text in self.require:
+            if text not in line:
+                return UNMATCHED
+        start = line.find(b'{')
+        if start < 0:
+            return UNMATCHED
+        try:
+            record = loads(start and line[start:] or line)
+        except ValueError:
+            return PARSE_ERROR
+        if not isinstance(record, dict):
+            return PARSE_ERROR
+
+        suffixes = ['']
+        for path, get, cache in self.dimensions:
+            value = get(record)
+            if value is None or isinstance(value, (dict, list)):
+                continue
+            # Keyed by type too, as true, 1 and 1.0 are equal keys.
+            key = (type(value), value)
+            suffix = cache.get(key)
+            if suffix is None:
+                if len(cache) >= 10000:
+                    cache.clear()
+                suffix = cache[key] = '.%s.%s' % (path, metric_safe('%s' % value))
+            suffixes.append(suffix)
+
+        result = MATCHED
+        if self.lines_name:
+            for suffix in suffixes:
+                self.add_count(self.lines_name + suffix, 1.0)
+        for path, get in self.counters:
+            value = get(record)
+            if value is None:
+                continue
+            value = finite_number(value)
+            if value is None:
+                result = PARSE_ERROR
+                continue
+            for suffix in suffixes:
+                self.add_count(path + suffix, value)
+        for path, get, unit in self.timers:
+            value = get(record)
+            if value is None:
+                continue
+            value = finite_number(value)
+            if value is None:
+                result = PARSE_ERROR
+                continue
+            for suffix in suffixes:
+                self.add_time(path + suffix, value, unit)
+        return result
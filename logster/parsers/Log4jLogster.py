@@ -6,6 +6,17 @@
 ###  Example (note WARN,ERROR,FATAL is default):
 ###  sudo ./logster --output=stdout Log4jLogster /var/log/example_app/app.log --parser-options '-l WARN,ERROR,FATAL'
 ###
+###  With --exceptions N the classes of the exceptions in stack traces are counted too: the exception
+###  line that starts a trace, e.g. "java.lang.IllegalStateException: ..." as
+###    exceptions.<class> <occurrences per sec>
+###  and each "Caused by: <class>: ..." line of the trace as
+###    causes.<class> <occurrences per sec>
+###  Only classes ending in Exception, Error or Throwable are recognised. The counts of the N classes
+###  seen most recently are kept; the number of classes dropped to make room is reported as
+###  logster.exception_classes_dropped.
+###
+###  sudo ./logster --output=stdout Log4jLogster /var/log/example_app/app.log --parser-options '--exceptions 100'
+###
 ###
 ###  Logster copyright 2011, Etsy, Inc.
 ###
@@ -25,68 +36,103 @@
 ###  along with Logster. If not, see <http://www.gnu.org/licenses/>.
 ###
 
-import time
 import re
 import optparse
 
+from logster.parsers import stats_helper
+from logster.parsers.access_log_helper import metric_safe
 from logster.logster_helper import MetricObject, LogsterParser
-from logster.logster_helper import LogsterParsingException
+from logster.logster_helper import UNMATCHED
 
 class Log4jLogster(LogsterParser):
-    
+
+    partial_state_attributes = ('counts', 'exceptions')
+
+    # The timestamp that starts each line; the level follows it.
+    cache_prefix = r'[0-9-_:\.]+ '
+
     def __init__(self, option_string=None):
         '''Initialize any data structures or variables needed for keeping track
         of the tasty bits we find in the log we are parsing.'''
-        
+
         if option_string:
             options = option_string.split(' ')
         else:
             options = []
-        
+
         optparser = optparse.OptionParser()
         optparser.add_option('--log-levels', '-l', dest='levels', default='WARN,ERROR,FATAL',
                             help='Comma-separated list of log levels to track: (default: "WARN,ERROR,FATAL")')
-        
+        optparser.add_option('--exceptions', '-e', dest='exceptions', type='int', default=0,
+                            help='Count the exception classes in stack traces, keeping the N most recently seen (default: 0, off)')
+
         opts, args = optparser.parse_args(args=options)
-            
+
         self.levels = opts.levels.split(',')
-        
-        for level in self.levels:
-            # Track counts from 0 for each log level
-            setattr(self, level, 0)
-        
+
+        # Track counts from 0 for each log level
+        self.counts = dict((level, 0) for level in self.levels)
+
+        if opts.exceptions > 0:
+            self.exceptions = stats_helper.LRUCounter(opts.exceptions)
+        else:
+            self.exceptions = None
+
         # Regular expression for matching lines we are interested in, and capturing
         # fields from the line (in this case, a log level such as WARN, ERROR, or FATAL).
-        self.reg = re.compile('[0-9-_:\.]+ (?P<log_level>%s)' % ('|'.join(self.levels)) )
-        
-        
+        self.reg = re.compile(r'[0-9-_:\.]+ (?P<log_level>%s)' % ('|'.join(self.levels)) )
+
+        # The line starting a stack trace, or one of its "Caused by:" lines.
+        self.exception_reg = re.compile(r'(?P<cause>Caused by: )?'
+            r'(?P<exception>(?:[A-Za-z_$][\w$]*\.)+[\w$]*(?:Exception|Error|Throwable))(?::|\s*$)')
+
     def parse_line(self, line):
         '''This function should digest the contents of one line at a time, updating
         object's state variables. Takes a single argument, the line to be parsed.'''
-        
-        try:
-            # Apply regular expression to each line and extract interesting bits.
-            regMatch = self.reg.match(line)
-            
-            if regMatch:
-                linebits = regMatch.groupdict()
-                log_level = linebits['log_level']
-                
-                if log_level in self.levels:
-                    current_val = getattr(self, log_level)
-                    setattr(self, log_level, current_val+1)
-                    
-            else:
-                raise LogsterParsingException, "regmatch failed to match"
-                
-        except Exception, e:
-            raise LogsterParsingException, "regmatch or contents failed with %s" % e
-            
-            
+        return self.count_line(self.classify_line(line))
+
+    def classify_line(self, line):
+        '''Return the log level of a line, or the counter key of the exception
+        class it starts a stack trace with, or None.'''
+
+        # The frames of a stack trace, which make up most of a Java log, are
+        # indented; skip them before trying any regular expression.
+        if line[:1] in ' \t':
+            return None
+
+        regMatch = self.reg.match(line)
+        if regMatch:
+            return ('level', regMatch.group('log_level'))
+
+        if self.exceptions is None:
+            return None
+        exception_match = self.exception_reg.match(line)
+        if not exception_match:
+            return None
+        if exception_match.group('cause'):
+            return ('exception', 'causes.' + exception_match.group('exception'))
+        return ('exception', 'exceptions.' + exception_match.group('exception'))
+
+    def count_line(self, classification):
+        if classification is None:
+            return UNMATCHED
+        kind, key = classification
+        if kind == 'level':
+            self.counts[key] += 1
+        else:
+            self.exceptions.add(key)
+
     def get_state(self, duration):
         '''Run any necessary calculations on the data collected from the logs
         and return a list of metric objects.'''
-        self.duration = duration
-        
-        metrics = [MetricObject(level, (getattr(self, level) / self.duration)) for level in self.levels]
-        return metrics
\ No newline at end of file
+        self.duration = float(duration)
+
+        metrics = [MetricObject(level, (self.counts[level] / self.duration)) for level in self.levels]
+        if self.exceptions is not None:
+            for key, count in sorted(self.exceptions.items()):
+                kind, exception = key.split('.', 1)
+                metrics.append(MetricObject('%s.%s' % (kind, metric_safe(exception, 128)),
+                    count / self.duration, 'Exceptions per sec'))
+            metrics.append(MetricObject('logster.exception_classes_dropped', self.exceptions.dropped,
+                'Exception classes'))
+        return metrics
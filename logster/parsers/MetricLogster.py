@@ -30,43 +30,89 @@
 ###  For example:
 ###  sudo ./logster --output=stdout MetricLogster /var/log/example_app/app.log --parser-options '--percentiles 25,75,90'
 ###
+###  A buggy logger that puts ids in metric names can create an unbounded number of metrics. To guard
+###  against that, --max-metrics caps the number of distinct names kept per run. The most frequent names
+###  are kept exactly (space-saving algorithm); the values of the others are folded into an 'other'
+###  counter or timer, and the number of names folded away is reported as logster.metric_names_dropped.
+###
+###  sudo ./logster --output=stdout MetricLogster /var/log/example_app/app.log --parser-options '--max-metrics 1000'
+###
+###  By default every value of a time is kept to compute exact percentiles. With --histogram the values are
+###  counted in a log-linear histogram instead (see stats_helper.LogLinearHistogram), which uses constant
+###  memory per metric at the cost of percentiles being accurate to about 3%.
+###
+###  Percentiles cover the values of one run. With --windows, e.g. '5m,1h,24h', the values of each time
+###  are also kept between runs in sliding windows of histograms (see stats_helper.SlidingWindow), saved
+###  in the state store, and the mean, median and percentiles over each window are reported as
+###    some.metric.time.1h.mean, some.metric.time.1h.median, some.metric.time.1h.90th_percentile
+###  Each window holds at most 60 slots per metric, so a 24h window is kept in 24 minute slots.
+###
+###  sudo ./logster --output=stdout MetricLogster /var/log/example_app/app.log --parser-options '--windows 5m,1h,24h'
+###
 ###  Based on SampleLogster which is Copyright 2011, Etsy, Inc.
 
 import re
 import optparse
 
+from time import time
+
 from logster.parsers import stats_helper
 
-from logster.logster_helper import MetricObject, LogsterParser
-from logster.logster_helper import LogsterParsingException
+from logster.logster_helper import MetricObject, LogsterParser, scale_values
+from logster.logster_helper import UNMATCHED
 
 class MetricLogster(LogsterParser):
 
+    partial_state_attributes = ('counts', 'times', 'dropped_names', 'names')
+
     def __init__(self, option_string=None):
         '''Initialize any data structures or variables needed for keeping track
         of the tasty bits we find in the log we are parsing.'''
 
-        self.counts = {}
-        self.times = {}
-
         if option_string:
             options = option_string.split(' ')
         else:
             options = []
 
         optparser = optparse.OptionParser()
-        optparser.add_option('--percentiles', '-p', dest='percentiles', default='90',
-                            help='Comma-separated list of integer percentiles to track: (default: "90")')
-
+        add_options(optparser)
         opts, args = optparser.parse_args(args=options)
-
-        self.percentiles = opts.percentiles.split(',')
+        self.set_options(opts, optparser)
 
         # General regular expressions, expecting the metric name to be included in the log file.
 
         self.count_reg = re.compile('.*METRIC_COUNT\smetric=(?P<count_name>[^\s]+)\s+value=(?P<count_value>[0-9.]+)[^0-9.].*')
         self.time_reg = re.compile('.*METRIC_TIME\smetric=(?P<time_name>[^\s]+)\s+value=(?P<time_value>[0-9.]+)\s*(?P<time_unit>[^\s$]*).*')
 
+    def set_options(self, opts, optparser):
+        '''Set up the counters and timers as chosen by the options added with add_options.'''
+        self.counts = {}
+        self.times = {}
+
+        self.percentiles = opts.percentiles.split(',')
+
+        if opts.histogram:
+            self.new_values = stats_helper.LogLinearHistogram
+        else:
+            self.new_values = stats_helper.ExactValues
+
+        try:
+            self.window_spans = [parse_span(span) for span in opts.windows.split(',') if span]
+        except ValueError:
+            optparser.error('invalid --windows %r, use spans such as 5m,1h,24h' % opts.windows)
+        self.windows = {}
+        # Only the windows are carried over between runs, so without them
+        # there is no state to save.
+        if self.window_spans:
+            self.persistent_state_attributes = ('windows',)
+
+        self.other_name = opts.other_name
+        self.dropped_names = 0
+        if opts.max_metrics > 0:
+            self.names = stats_helper.SpaceSaving(opts.max_metrics)
+        else:
+            self.names = None
+
     def parse_line(self, line):
         '''This function should digest the contents of one line at a time, updating
         object's state variables. Takes a single argument, the line to be parsed.'''
@@ -74,18 +120,105 @@ class MetricLogster(LogsterParser):
         count_match = self.count_reg.match(line)
         if count_match:
             countbits = count_match.groupdict()
-            count_name = countbits['count_name']
-            if not self.counts.has_key(count_name):
-                self.counts[count_name] = 0.0
-            self.counts[count_name] += float(countbits['count_value']);
+            self.add_count(countbits['count_name'], float(countbits['count_value']))
 
         time_match = self.time_reg.match(line)
         if time_match:
-            time_name = time_match.groupdict()['time_name']
-            if not self.times.has_key(time_name):
-                unit = time_match.groupdict()['time_unit']
-                self.times[time_name] = {'unit': unit, 'values': []};
-            self.times[time_name]['values'].append(float(time_match.groupdict()['time_value']))
+            timebits = time_match.groupdict()
+            self.add_time(timebits['time_name'], float(timebits['time_value']), timebits['time_unit'])
+        elif not count_match:
+            return UNMATCHED
+
+    def add_count(self, name, value):
+        '''Add a value to a counter.'''
+        if self.names is not None:
+            self.track_name(self.counts, name)
+        self.counts[name] = self.counts.get(name, 0.0) + value
+
+    def add_time(self, name, value, unit):
+        '''Record a value of a time, whose unit is that of its first value in the run.'''
+        if self.names is not None:
+            self.track_name(self.times, name)
+        timer = self.times.get(name)
+        if timer is None:
+            timer = self.times[name] = {'unit': unit, 'values': self.new_values()}
+        timer['values'].record(value)
+
+    def track_name(self, table, name):
+        '''Count an occurrence of a metric name against --max-metrics, folding the
+        values of the name it displaces into the 'other' entry of its table.'''
+        if name == self.other_name:
+            return
+        evicted = self.names.offer((table is self.times, name))
+        if evicted is not None:
+            self.fold_name(evicted)
+
+    def fold_name(self, key):
+        '''Move the values of a name dropped from the --max-metrics table into 'other'.'''
+        self.dropped_names += 1
+        is_time, evicted_name = key
+        if is_time:
+            timer = self.times.pop(evicted_name)
+            other = self.times.setdefault(self.other_name, {'unit': timer['unit'], 'values': self.new_values()})
+            other['values'].merge(timer['values'])
+        else:
+            other = self.counts.get(self.other_name, 0.0)
+            self.counts[self.other_name] = other + self.counts.pop(evicted_name)
+
+    def merge_partial_state(self, state):
+        '''Merge as usual, then fold away the names that no longer fit within --max-metrics.'''
+        state = dict(state)
+        names = state.pop('names', None)
+        LogsterParser.merge_partial_state(self, state)
+        if self.names is not None and names is not None:
+            for key in self.names.merge(names):
+                self.fold_name(key)
+
+    def scale_partial_state(self, factor):
+        '''Scale the counters and timers; the names tracked for --max-metrics are left alone.'''
+        scale_values(self.counts, factor)
+        scale_values(self.times, factor)
+
+    def timer_metrics(self, name, values, unit):
+        '''Return the mean, median and --percentiles of the values of a time.'''
+        percentiles = values.percentiles([50] + [int(percentile) for percentile in self.percentiles])
+        metrics = [MetricObject(name+'.mean', values.mean(), unit),
+            MetricObject(name+'.median', percentiles[0], unit)]
+        metrics += [MetricObject('%s.%sth_percentile' % (name, percentile), value, unit)
+            for percentile, value in zip(self.percentiles, percentiles[1:])]
+        return metrics
+
+    def window_metrics(self, now):
+        '''Add the times of this run to the --windows kept across runs, and
+        return the metrics over each window.'''
+        for time_name, timer in self.times.items():
+            values = timer['values']
+            if isinstance(values, stats_helper.ExactValues):
+                histogram = stats_helper.LogLinearHistogram()
+                for value in values.values:
+                    histogram.record(value)
+            else:
+                histogram = values
+            windows = self.windows.get(time_name)
+            if windows is None:
+                windows = self.windows[time_name] = {'unit': timer['unit'],
+                    'windows': [stats_helper.SlidingWindow(span) for span in self.window_spans]}
+            for window in windows['windows']:
+                window.add(histogram, now)
+
+        metrics = []
+        for time_name, windows in sorted(self.windows.items()):
+            unit = windows['unit']
+            for span, window in zip(self.window_spans, windows['windows']):
+                values = window.histogram(now)
+                if not values.count:
+                    continue
+                name = '%s.%s' % (time_name, format_span(span))
+                metrics += self.timer_metrics(name, values, unit)
+            # Forget the times that have slid out of every window.
+            if not any([len(window) for window in windows['windows']]):
+                del self.windows[time_name]
+        return metrics
 
     def get_state(self, duration):
         '''Run any necessary calculations on the data collected from the logs
@@ -96,8 +229,46 @@ class MetricLogster(LogsterParser):
         for time_name in self.times:
             values = self.times[time_name]['values']
             unit = self.times[time_name]['unit']
-            metrics.append(MetricObject(time_name+'.mean', stats_helper.find_mean(values), unit))
-            metrics.append(MetricObject(time_name+'.median', stats_helper.find_median(values), unit))
-            metrics += [MetricObject('%s.%sth_percentile' % (time_name,percentile), stats_helper.find_percentile(values,int(percentile)), unit) for percentile in self.percentiles]
+            metrics += self.timer_metrics(time_name, values, unit)
+        if self.window_spans:
+            metrics += self.window_metrics(time())
+        if self.names is not None:
+            metrics.append(MetricObject('logster.metric_names_dropped', self.dropped_names, 'Metric names'))
 
         return metrics
+
+
+def add_options(optparser):
+    '''Add the options of the counters and timers to a parser's option parser.'''
+    optparser.add_option('--percentiles', '-p', dest='percentiles', default='90',
+                        help='Comma-separated list of integer percentiles to track: (default: "90")')
+    optparser.add_option('--max-metrics', '-m', dest='max_metrics', type='int', default=0,
+                        help='Maximum number of distinct metric names to keep; the least frequent are folded into "other" (default: 0, unlimited)')
+    optparser.add_option('--other-name', dest='other_name', default='other',
+                        help='Name of the metric that names beyond --max-metrics are folded into (default: "other")')
+    optparser.add_option('--histogram', dest='histogram', action='store_true', default=False,
+                        help='Keep times in fixed-size histograms rather than keeping every value')
+    optparser.add_option('--windows', dest='windows', default='',
+                        help='Comma-separated spans such as 5m,1h,24h to also report the percentiles of times over, across runs (default: none)')
+
+
+SPAN_UNITS = (('d', 86400), ('h', 3600), ('m', 60), ('s', 1))
+
+def parse_span(span):
+    '''Turn a span such as 5m or 24h into seconds.'''
+    seconds = 1
+    for suffix, unit in SPAN_UNITS:
+        if span.endswith(suffix):
+            span, seconds = span[:-1], unit
+            break
+    seconds *= int(span)
+    if seconds <= 0:
+        raise ValueError("Span must be positive")
+    return seconds
+
+def format_span(seconds):
+    '''Turn seconds into a span for a metric name, e.g. 3600 into 1h.'''
+    for suffix, unit in SPAN_UNITS:
+        if not seconds % unit:
+            return '%d%s' % (seconds // unit, suffix)
+
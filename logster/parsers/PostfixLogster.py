@@ -1,13 +1,28 @@
 ###  A logster parser file that can be used to count the number
 ###  of sent/deferred/bounced emails from a Postfix log, along with
 ### some other associated statistics.
-###         
+###
 ###  For example:
-###  sudo ./logster --dry-run --output=ganglia PostfixParser /var/log/maillog
-###            
-###            
+###  sudo ./logster --dry-run --output=ganglia PostfixLogster /var/log/maillog
+###
+###  With --track-messages each message is followed through the log by its queue ID, from the cleanup
+###  and qmgr lines giving its size and number of recipients, through the delivery attempts of the
+###  smtp/lmtp/local agents, to qmgr removing it from the queue. Messages still queued at the end of
+###  the log are carried over to the next run. The parser then also reports
+###    deliveryDelay.mean, deliveryDelay.<p>th_percentile   delay= of each successful delivery
+###    messageDelay.*        the delay of the last delivery of each message removed from the queue
+###    messageSize.*         the size of each message removed from the queue
+###    messageRecipients.*   the recipients of each message removed from the queue
+###    messagesCompleted, messagesInFlight, messagesExpired
+###  for each of --percentiles, from log-linear histograms (see stats_helper.LogLinearHistogram).
+###  At most --max-messages messages are tracked, and a message not removed within --message-ttl
+###  seconds is forgotten; both count towards messagesExpired.
+###
+###  sudo ./logster --output=stdout PostfixLogster /var/log/maillog --parser-options '--track-messages'
+###
+###
 ###  Copyright 2011, Bronto Software, Inc.
-###               
+###
 ###  This parser is free software: you can redistribute it and/or modify
 ###  it under the terms of the GNU General Public License as published by
 ###  the Free Software Foundation, either version 3 of the License, or
@@ -17,16 +32,28 @@
 ###  but WITHOUT ANY WARRANTY; without even the implied warranty of
 ###  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
 ###  GNU General Public License for more details.
-### 
-        
-import time
+###
+
 import re
-        
+import optparse
+
+from time import time
+from collections import OrderedDict
+
+from logster.parsers import stats_helper
+from logster.parsers.access_log_helper import number_name
 from logster.logster_helper import MetricObject, LogsterParser
-from logster.logster_helper import LogsterParsingException
-        
+from logster.logster_helper import UNMATCHED, PARSE_ERROR
+
+# The fields of a tracked message: when it was first seen, its size and
+# number of recipients, and the longest delay= of its deliveries so far.
+SEEN, SIZE, RECIPIENTS, DELAY = range(4)
+
 class PostfixLogster(LogsterParser):
-        
+
+    partial_state_attributes = ('numSent', 'numDeferred', 'numBounced', 'totalDelay', 'numRbl',
+        'histograms', 'completed', 'expired')
+
     def __init__(self, option_string=None):
         '''Initialize any data structures or variables needed for keeping track
         of the tasty bits we find in the log we are parsing.'''
@@ -35,32 +62,151 @@ class PostfixLogster(LogsterParser):
         self.numBounced = 0
         self.totalDelay = 0
         self.numRbl = 0
-        
+
+        if option_string:
+            options = option_string.split(' ')
+        else:
+            options = []
+
+        optparser = optparse.OptionParser()
+        optparser.add_option('--track-messages', dest='track_messages', action='store_true', default=False,
+                            help='Follow each message by its queue ID to report per-message delays, sizes and recipients')
+        optparser.add_option('--max-messages', dest='max_messages', type='int', default=100000,
+                            help='Maximum number of queued messages to track; the oldest are forgotten (default: 100000)')
+        optparser.add_option('--message-ttl', dest='message_ttl', type='int', default=5 * 86400,
+                            help='Seconds after which a message still queued is forgotten (default: 432000, the Postfix maximal_queue_lifetime)')
+        optparser.add_option('--percentiles', dest='percentiles', default='50,90,99',
+                            help='Comma-separated percentiles of the --track-messages histograms to report (default: "50,90,99")')
+
+        opts, args = optparser.parse_args(args=options)
+
+        self.track_messages = opts.track_messages
+        # The messages still queued at the end of a run are carried over to
+        # the next, when there are any to track.
+        if self.track_messages:
+            self.persistent_state_attributes = ('messages',)
+        self.max_messages = opts.max_messages
+        self.message_ttl = opts.message_ttl
+        self.percentiles = [float(p) for p in opts.percentiles.split(',') if p]
+
+        # Messages in the queue by queue ID, oldest first.
+        self.messages = OrderedDict()
+        self.histograms = {}
+        for name in ('deliveryDelay', 'messageDelay', 'messageSize', 'messageRecipients'):
+            self.histograms[name] = stats_helper.LogLinearHistogram()
+        self.completed = 0
+        self.expired = 0
+        # Messages are timed by the run that saw them, rather than by the
+        # syslog timestamp, which has no year and no time zone.
+        self.now = time()
+
         # Regular expression for matching lines we are interested in, and capturing
         # fields from the line (in this case, http_status_code).
-        self.reg = re.compile('.*delay=(?P<send_delay>[^,]+),.*status=(?P<status>(sent|deferred|bounced))')
-           
+        self.reg = re.compile(r'.*delay=(?P<send_delay>[^,]+),.*status=(?P<status>(sent|deferred|bounced))')
+
+        # A line about a queued message. Long queue IDs have no vowels, which
+        # keeps out "warning:" and "NOQUEUE:".
+        self.queue_reg = re.compile(r'postfix[^/\s]*/[\w-]+\[\d+\]: '
+            r'(?P<queue_id>[0-9A-F]{6,}|[0-9B-DF-HJ-NP-TV-Zb-df-hj-np-tv-z]{10,}): (?P<text>.*)')
+        self.size_reg = re.compile(r'from=<[^>]*>, size=(?P<size>\d+), nrcpt=(?P<recipients>\d+)')
+        self.delivery_reg = re.compile(r'to=<.*, delay=(?P<delay>[0-9.]+),.*status=(?P<status>sent|deferred|bounced)')
+
     def parse_line(self, line):
         '''This function should digest the contents of one line at a time, updating
         object's state variables. Takes a single argument, the line to be parsed.'''
-        
+
+        if self.track_messages:
+            return self.track_line(line)
+
+        # Apply regular expression to each line and extract interesting bits.
+        regMatch = self.reg.match(line)
+        if not regMatch:
+            return UNMATCHED
         try:
-            # Apply regular expression to each line and extract interesting bits.
-            regMatch = self.reg.match(line)
+            delay = float(regMatch.group('send_delay'))
+        except ValueError:
+            return PARSE_ERROR
+        self.count_delivery(regMatch.group('status'), delay)
 
-            if regMatch:
-               linebits = regMatch.groupdict()
-               if (linebits['status'] == 'sent'):
-                  self.totalDelay += float(linebits['send_delay'])
-                  self.numSent += 1
-               elif (linebits['status'] == 'deferred'):
-                  self.numDeferred += 1
-               elif (linebits['status'] == 'bounced'):
-                  self.numBounced += 1
+    def count_delivery(self, status, delay):
+        if (status == 'sent'):
+            self.totalDelay += delay
+            self.numSent += 1
+        elif (status == 'deferred'):
+            self.numDeferred += 1
+        elif (status == 'bounced'):
+            self.numBounced += 1
 
-        except Exception, e:
-            raise LogsterParsingException, "regmatch or contents failed with %s" % e
+    def track_line(self, line):
+        '''Follow a message through the cleanup, qmgr and delivery agent lines
+        logged with its queue ID.'''
+        queueMatch = self.queue_reg.search(line)
+        if not queueMatch:
+            return UNMATCHED
+        queue_id, text = queueMatch.group('queue_id', 'text')
 
+        if text.startswith('to='):
+            deliveryMatch = self.delivery_reg.match(text)
+            if not deliveryMatch:
+                return UNMATCHED
+            status = deliveryMatch.group('status')
+            try:
+                delay = float(deliveryMatch.group('delay'))
+            except ValueError:
+                return PARSE_ERROR
+            self.count_delivery(status, delay)
+            if status == 'sent':
+                self.histograms['deliveryDelay'].record(delay)
+            message = self.message(queue_id)
+            if message[DELAY] is None or delay > message[DELAY]:
+                message[DELAY] = delay
+
+        elif text.startswith('from='):
+            sizeMatch = self.size_reg.match(text)
+            if not sizeMatch:
+                return UNMATCHED
+            message = self.message(queue_id)
+            message[SIZE] = int(sizeMatch.group('size'))
+            message[RECIPIENTS] = int(sizeMatch.group('recipients'))
+
+        elif text.startswith('message-id='):
+            self.message(queue_id)
+
+        elif text == 'removed':
+            message = self.messages.pop(queue_id, None)
+            if message is None:
+                return UNMATCHED
+            self.completed += 1
+            if message[DELAY] is not None:
+                self.histograms['messageDelay'].record(message[DELAY])
+            if message[SIZE] is not None:
+                self.histograms['messageSize'].record(message[SIZE])
+                self.histograms['messageRecipients'].record(message[RECIPIENTS])
+
+        else:
+            return UNMATCHED
+
+    def message(self, queue_id):
+        '''Return the tracked message with a queue ID, starting to track it if
+        it's new and forgetting the oldest message if there are too many.'''
+        message = self.messages.get(queue_id)
+        if message is None:
+            message = self.messages[queue_id] = [self.now, None, None, None]
+            if len(self.messages) > self.max_messages:
+                self.messages.popitem(last=False)
+                self.expired += 1
+        return message
+
+    def expire_messages(self):
+        '''Forget the messages first seen more than --message-ttl seconds ago.'''
+        oldest = self.now - self.message_ttl
+        messages = self.messages
+        while messages:
+            queue_id = next(iter(messages))
+            if messages[queue_id][SEEN] >= oldest:
+                break
+            del messages[queue_id]
+            self.expired += 1
 
     def get_state(self, duration):
         '''Run any necessary calculations on the data collected from the logs
@@ -74,21 +220,21 @@ class PostfixLogster(LogsterParser):
         mailTxnsSec = 0
         mailSentSec = 0
 
-        #mind divide by zero situations 
+        #mind divide by zero situations
         if (totalTxns > 0):
-           pctDeferred = (self.numDeferred / totalTxns) * 100
-           pctSent = (self.numSent / totalTxns) * 100
-           pctBounced = (self.numBounced / totalTxns ) * 100
+           pctDeferred = (float(self.numDeferred) / totalTxns) * 100
+           pctSent = (float(self.numSent) / totalTxns) * 100
+           pctBounced = (float(self.numBounced) / totalTxns ) * 100
 
         if (self.numSent > 0):
            avgDelay = self.totalDelay / self.numSent
 
         if (self.duration > 0):
-           mailTxnsSec = totalTxns / self.duration
-           mailSentSec = self.numSent / self.duration
+           mailTxnsSec = float(totalTxns) / self.duration
+           mailSentSec = float(self.numSent) / self.duration
 
         # Return a list of metrics objects
-        return [
+        metrics = [
             MetricObject("numSent", self.numSent, "Total Sent"),
             MetricObject("pctSent", pctSent, "Percentage Sent"),
             MetricObject("numDeferred", self.numDeferred, "Total Deferred"),
@@ -98,4 +244,20 @@ class PostfixLogster(LogsterParser):
             MetricObject("mailTxnsSec", mailTxnsSec, "Transactions per sec"),
             MetricObject("mailSentSec", mailSentSec, "Sends per sec"),
             MetricObject("avgDelay", avgDelay, "Average Sending Delay"),
-        ]      
+        ]
+
+        if self.track_messages:
+            self.expire_messages()
+            for name, histogram in sorted(self.histograms.items()):
+                if not histogram.count:
+                    continue
+                metrics.append(MetricObject('%s.mean' % name, histogram.mean()))
+                for percentile in self.percentiles:
+                    metrics.append(MetricObject('%s.%sth_percentile' % (name, number_name(percentile)),
+                        histogram.percentile(percentile)))
+            metrics += [
+                MetricObject("messagesCompleted", self.completed, "Messages"),
+                MetricObject("messagesInFlight", len(self.messages), "Messages"),
+                MetricObject("messagesExpired", self.expired, "Messages"),
+            ]
+        return metrics
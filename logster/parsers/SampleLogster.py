@@ -4,6 +4,22 @@
 ###  For example:
 ###  sudo ./logster --dry-run --output=ganglia SampleLogster /var/log/httpd/access_log
 ###
+###  With --top-k it also reports the most requested paths, most active clients and so on, which
+###  requires the log to be in Common or Combined Log Format:
+###  sudo ./logster --output=stdout SampleLogster /var/log/httpd/access_log --parser-options '--top-k 10 --top-fields path,client,agent'
+###
+###  --unique-fields counts distinct values, e.g. unique visitors and URLs:
+###  sudo ./logster --output=stdout SampleLogster /var/log/httpd/access_log --parser-options '--unique-fields client,path'
+###
+###  --histogram-fields reports percentiles of the response size and, if the LogFormat ends with %D,
+###  the response time in microseconds:
+###  sudo ./logster --output=stdout SampleLogster /var/log/httpd/access_log --parser-options '--histogram-fields bytes,response_time'
+###
+###  Lines are split into fields by --log-format (see access_log_helper.LogFormat), by default the
+###  Combined Log Format optionally followed by %D, which also reads Common Log Format lines. Give
+###  the LogFormat of the server if it logs something else, quoted within the parser options:
+###  sudo ./logster --output=stdout SampleLogster /var/log/httpd/access_log --parser-options '--log-format "%v %h %l %u %t \"%r\" %>s %b" --top-k 10 --top-fields vhost'
+###
 ###
 ###  Copyright 2011, Etsy, Inc.
 ###
@@ -23,56 +39,85 @@
 ###  along with Logster. If not, see <http://www.gnu.org/licenses/>.
 ###
 
-import time
-import re
+import sys
+import shlex
+import optparse
 
+from logster.parsers import access_log_helper
 from logster.logster_helper import MetricObject, LogsterParser
-from logster.logster_helper import LogsterParsingException
+from logster.logster_helper import UNMATCHED, PARSE_ERROR
 
 class SampleLogster(LogsterParser):
 
+    # Fields of an access log line that can be reported on, if the log
+    # format has them.
+    fields = ('client', 'user', 'vhost', 'method', 'path', 'query', 'protocol', 'referer', 'agent')
+    numeric_fields = ('bytes', 'response_time')
+
+    partial_state_attributes = ('http_1xx', 'http_2xx', 'http_3xx', 'http_4xx', 'http_5xx',
+        'field_stats')
+
     def __init__(self, option_string=None):
         '''Initialize any data structures or variables needed for keeping track
         of the tasty bits we find in the log we are parsing.'''
+
+        if option_string:
+            # Log formats have spaces and quotes in them.
+            options = shlex.split(option_string)
+        else:
+            options = []
+
+        optparser = optparse.OptionParser()
+        optparser.add_option('--log-format', dest='log_format', default='combined_time',
+                            help='Apache LogFormat of the log, or one of common, combined, combined_time '
+                            '(combined, then %D if logged) or vhost_combined (default: "combined_time")')
+        access_log_helper.add_options(optparser, self.fields, 'path,client', self.numeric_fields)
+
+        opts, args = optparser.parse_args(args=options)
+
+        self.field_stats = access_log_helper.FieldStats(opts, self.fields, optparser, self.numeric_fields)
+
         self.http_1xx = 0
         self.http_2xx = 0
         self.http_3xx = 0
         self.http_4xx = 0
         self.http_5xx = 0
-        
-        # Regular expression for matching lines we are interested in, and capturing
-        # fields from the line (in this case, http_status_code).
-        self.reg = re.compile('.*HTTP/1.\d\" (?P<http_status_code>\d{3}) .*')
 
+        # Split out the status code, and any fields reported on.
+        self.names = ['http_status_code'] + self.field_stats.fields
+        try:
+            self.log_format = access_log_helper.LogFormat(opts.log_format, self.names)
+        except ValueError:
+            optparser.error(str(sys.exc_info()[1]))
+        self.record_fields = self.field_stats.enabled()
 
     def parse_line(self, line):
         '''This function should digest the contents of one line at a time, updating
         object's state variables. Takes a single argument, the line to be parsed.'''
 
-        try:
-            # Apply regular expression to each line and extract interesting bits.
-            regMatch = self.reg.match(line)
-
-            if regMatch:
-                linebits = regMatch.groupdict()
-                status = int(linebits['http_status_code'])
-
-                if (status < 200):
-                    self.http_1xx += 1
-                elif (status < 300):
-                    self.http_2xx += 1
-                elif (status < 400):
-                    self.http_3xx += 1
-                elif (status < 500):
-                    self.http_4xx += 1
-                else:
-                    self.http_5xx += 1
+        # Split the line into the fields of the log format.
+        values = self.log_format.parse(line)
+        status = values[0]
+        if status is None or len(status) != 3 or not status.isdigit():
+            return UNMATCHED
 
+        try:
+            # Three digit codes compare as their numbers do.
+            if (status < '200'):
+                self.http_1xx += 1
+            elif (status < '300'):
+                self.http_2xx += 1
+            elif (status < '400'):
+                self.http_3xx += 1
+            elif (status < '500'):
+                self.http_4xx += 1
             else:
-                raise LogsterParsingException, "regmatch failed to match"
+                self.http_5xx += 1
 
-        except Exception, e:
-            raise LogsterParsingException, "regmatch or contents failed with %s" % e
+            if self.record_fields:
+                self.field_stats.record(dict(zip(self.names, values)))
+        except Exception:
+            return PARSE_ERROR
 
 
     def get_state(self, duration):
@@ -87,4 +132,4 @@ class SampleLogster(LogsterParser):
             MetricObject("http_3xx", (self.http_3xx / self.duration), "Responses per sec"),
             MetricObject("http_4xx", (self.http_4xx / self.duration), "Responses per sec"),
             MetricObject("http_5xx", (self.http_5xx / self.duration), "Responses per sec"),
-        ]
+        ] + self.field_stats.get_metrics(self.duration)
@@ -4,6 +4,20 @@
 ###  For example:
 ###  sudo ./logster --dry-run --output=ganglia SquidLogster /var/log/squid/access.log
 ###
+###  With --top-k it also reports the most requested URLs and most active clients:
+###  sudo ./logster --output=stdout SquidLogster /var/log/squid/access.log --parser-options '--top-k 10'
+###
+###  --unique-fields counts distinct values, e.g. unique clients and URLs:
+###  sudo ./logster --output=stdout SquidLogster /var/log/squid/access.log --parser-options '--unique-fields client,url'
+###
+###  --histogram-fields reports percentiles of the response size in bytes and the elapsed time in ms:
+###  sudo ./logster --output=stdout SquidLogster /var/log/squid/access.log --parser-options '--histogram-fields bytes,elapsed'
+###
+###  Lines are split into fields by --log-format (see access_log_helper.LogFormat), by default the
+###  native Squid format. Give the logformat of the access_log if it is something else, quoted within
+###  the parser options, or "common" for Squid's common format:
+###  sudo ./logster --output=stdout SquidLogster /var/log/squid/access.log --parser-options '--log-format "%ts.%03tu %6tr %>a %Ss/%03>Hs %<st %rm %ru"'
+###
 ###
 ###  Copyright 2011, Etsy, Inc.
 ###
@@ -23,17 +37,43 @@
 ###  along with Logster. If not, see <http://www.gnu.org/licenses/>.
 ###
 
-import time
-import re
+import sys
+import shlex
+import optparse
 
+from logster.parsers import access_log_helper
 from logster.logster_helper import MetricObject, LogsterParser
-from logster.logster_helper import LogsterParsingException
+from logster.logster_helper import UNMATCHED, PARSE_ERROR
 
 class SquidLogster(LogsterParser):
 
+    # Fields of a Squid access.log line that can be reported on, if the log
+    # format has them.
+    fields = ('client', 'method', 'url', 'user', 'hierarchy', 'peer', 'type')
+    numeric_fields = ('elapsed', 'bytes')
+
+    partial_state_attributes = ('size_transferred', 'squid_codes',
+        'http_1xx', 'http_2xx', 'http_3xx', 'http_4xx', 'http_5xx', 'field_stats')
+
     def __init__(self, option_string=None):
         '''Initialize any data structures or variables needed for keeping track
         of the tasty bits we find in the log we are parsing.'''
+
+        if option_string:
+            # Log formats have spaces and quotes in them.
+            options = shlex.split(option_string)
+        else:
+            options = []
+
+        optparser = optparse.OptionParser()
+        optparser.add_option('--log-format', dest='log_format', default='squid',
+                            help='Squid logformat of the access log, or squid or common (default: "squid")')
+        access_log_helper.add_options(optparser, self.fields, 'url,client', self.numeric_fields)
+
+        opts, args = optparser.parse_args(args=options)
+
+        self.field_stats = access_log_helper.FieldStats(opts, self.fields, optparser, self.numeric_fields)
+
         self.size_transferred = 0
         self.squid_codes = {
                 'TCP_MISS': 0,
@@ -48,48 +88,52 @@ class SquidLogster(LogsterParser):
         self.http_4xx = 0
         self.http_5xx = 0
 
-        # Regular expression for matching lines we are interested in, and capturing
-        # fields from the line (in this case, http_status_code, size and squid_code).
-        self.reg = re.compile('^[0-9.]+ +(?P<size>[0-9]+) .*(?P<squid_code>(TCP|UDP|NONE)_[A-Z_]+)/(?P<http_status_code>\d{3}) .*')
+        # Split out the status code, squid code and size, and any fields
+        # reported on.
+        self.names = ['http_status_code', 'squid_code', 'bytes']
+        self.names += [name for name in self.field_stats.fields if name not in self.names]
+        try:
+            self.log_format = access_log_helper.LogFormat(opts.log_format, self.names, 'squid')
+        except ValueError:
+            optparser.error(str(sys.exc_info()[1]))
+        self.record_fields = self.field_stats.enabled()
 
 
     def parse_line(self, line):
         '''This function should digest the contents of one line at a time, updating
         object's state variables. Takes a single argument, the line to be parsed.'''
 
+        # Split the line into the fields of the log format.
+        values = self.log_format.parse(line)
+        status, squid_code, size = values[:3]
+        if (status is None or len(status) != 3 or not status.isdigit()
+                or size is None or not size.isdigit()):
+            return UNMATCHED
+
         try:
-            # Apply regular expression to each line and extract interesting bits.
-            regMatch = self.reg.match(line)
-
-            if regMatch:
-                linebits = regMatch.groupdict()
-                status = int(linebits['http_status_code'])
-                squid_code = linebits['squid_code']
-                size = int(linebits['size'])
-
-                if (status < 200):
-                    self.http_1xx += 1
-                elif (status < 300):
-                    self.http_2xx += 1
-                elif (status < 400):
-                    self.http_3xx += 1
-                elif (status < 500):
-                    self.http_4xx += 1
-                else:
-                    self.http_5xx += 1
-
-                if self.squid_codes.has_key(squid_code):
-                    self.squid_codes[squid_code] += 1
-                else:
-                    self.squid_codes['OTHER'] += 1
-
-                self.size_transferred += size
+            # Three digit codes compare as their numbers do.
+            if (status < '200'):
+                self.http_1xx += 1
+            elif (status < '300'):
+                self.http_2xx += 1
+            elif (status < '400'):
+                self.http_3xx += 1
+            elif (status < '500'):
+                self.http_4xx += 1
+            else:
+                self.http_5xx += 1
 
+            if squid_code in self.squid_codes:
+                self.squid_codes[squid_code] += 1
             else:
-                raise LogsterParsingException, "regmatch failed to match"
+                self.squid_codes['OTHER'] += 1
+
+            self.size_transferred += int(size)
 
-        except Exception, e:
-            raise LogsterParsingException, "regmatch or contents failed with %s" % e
+            if self.record_fields:
+                self.field_stats.record(dict(zip(self.names, values)))
+        except Exception:
+            return PARSE_ERROR
 
 
     def get_state(self, duration):
@@ -108,5 +152,6 @@ class SquidLogster(LogsterParser):
         ]
         for squid_code in self.squid_codes:
             return_array.append(MetricObject("squid_" + squid_code, (self.squid_codes[squid_code]/self.duration), "Squid code per sec"))
+        return_array += self.field_stats.get_metrics(self.duration)
 
         return return_array
@@ -0,0 +1,347 @@
+###  A helper for the access log parsers (SampleLogster, SquidLogster) to report on the values of
+###  fields such as the request path or client address, beyond the fixed counters each parser keeps.
+###
+###  With --top-k N the N most frequent values of each of --top-fields are tracked in fixed memory
+###  (count-min sketch and heap, see stats_helper.TopK) and reported as
+###    top.<field>.<rank>.<value> <occurrences per sec>
+###  with the value made safe for use in a metric name.
+###
+###  With --unique-fields the number of distinct values of each field seen in the run, e.g. unique
+###  clients, is estimated with a HyperLogLog of a few KB (see stats_helper.HyperLogLog) and reported as
+###    unique.<field> <distinct values>
+###
+###  With --histogram-fields the distribution of numeric fields such as the response size or time is
+###  kept in a log-linear histogram of fixed size (see stats_helper.LogLinearHistogram) and reported as
+###    <field>.mean, <field>.<p>th_percentile for each of --percentiles, and
+###    <field>.le_<bound> <values up to bound> for each of --histogram-buckets, plus <field>.le_inf
+
+import re
+
+from logster.parsers import stats_helper
+from logster.logster_helper import MetricObject
+
+unsafe_characters = re.compile('[^A-Za-z0-9_-]+')
+
+
+def metric_safe(value, max_length=64):
+    """Turn a field value such as a URL into a single metric name component."""
+    return unsafe_characters.sub('_', value).strip('_')[:max_length] or '_'
+
+
+def add_options(optparser, fields, default_top_fields, numeric_fields=()):
+    """Add the options of FieldStats to a parser's option parser."""
+    optparser.add_option('--top-k', dest='top_k', type='int', default=0,
+                        help='Report the N most frequent values of each of --top-fields (default: 0, off)')
+    optparser.add_option('--top-fields', dest='top_fields', default=default_top_fields,
+                        help='Comma-separated fields to report the top values of, out of %s (default: "%s")'
+                        % (','.join(fields), default_top_fields))
+    optparser.add_option('--sketch-width', dest='sketch_width', type='int', default=2048,
+                        help='Counters per row of the count-min sketch used for --top-k (default: 2048)')
+    optparser.add_option('--sketch-depth', dest='sketch_depth', type='int', default=4,
+                        help='Rows of the count-min sketch used for --top-k (default: 4)')
+    optparser.add_option('--unique-fields', dest='unique_fields', default='',
+                        help='Comma-separated fields to count the distinct values of, out of %s (default: none)'
+                        % ','.join(fields))
+    optparser.add_option('--unique-error', dest='unique_error', type='float', default=0.02,
+                        help='Relative standard error of the --unique-fields counts (default: 0.02)')
+    if numeric_fields:
+        optparser.add_option('--histogram-fields', dest='histogram_fields', default='',
+                            help='Comma-separated numeric fields to report the distribution of, out of %s (default: none)'
+                            % ','.join(numeric_fields))
+        optparser.add_option('--percentiles', dest='percentiles', default='50,90,99',
+                            help='Comma-separated percentiles of --histogram-fields to report (default: "50,90,99")')
+        optparser.add_option('--histogram-buckets', dest='histogram_buckets', default='',
+                            help='Comma-separated bounds to report cumulative counts of --histogram-fields at (default: none)')
+
+
+def number_name(number):
+    """Format a number for use in a metric name, e.g. 0.5 as 0_5."""
+    return ('%g' % number).replace('.', '_')
+
+
+def split_fields(value, fields, optparser):
+    names = [name for name in value.split(',') if name]
+    for name in names:
+        if name not in fields:
+            optparser.error('unknown field %r, choose from %s' % (name, ','.join(fields)))
+    return names
+
+
+class FieldStats(object):
+    """Summaries of the values of access log fields, as chosen by the options
+    added with add_options."""
+
+    def __init__(self, opts, fields, optparser, numeric_fields=()):
+        self.top = {}
+        if opts.top_k > 0:
+            for name in split_fields(opts.top_fields, fields, optparser):
+                self.top[name] = stats_helper.TopK(opts.top_k, opts.sketch_width, opts.sketch_depth)
+        self.unique = {}
+        for name in split_fields(opts.unique_fields, fields, optparser):
+            self.unique[name] = stats_helper.HyperLogLog(opts.unique_error)
+        self.histograms = {}
+        if numeric_fields:
+            for name in split_fields(opts.histogram_fields, numeric_fields, optparser):
+                self.histograms[name] = stats_helper.LogLinearHistogram()
+            self.percentiles = [float(p) for p in opts.percentiles.split(',') if p]
+            self.buckets = [float(b) for b in opts.histogram_buckets.split(',') if b]
+        self.fields = list(set(self.top) | set(self.unique) | set(self.histograms))
+
+    def enabled(self):
+        return bool(self.fields)
+
+    def merge(self, other):
+        """Add the summaries of the same fields from another host or shard."""
+        for summaries, other_summaries in ((self.top, other.top),
+                (self.unique, other.unique), (self.histograms, other.histograms)):
+            for name, summary in summaries.items():
+                summary.merge(other_summaries[name])
+
+    def scale(self, factor):
+        """Scale the top counts and histograms up from a sample of the lines.
+        Distinct counts can't be scaled and are left as they are."""
+        for summary in list(self.top.values()) + list(self.histograms.values()):
+            summary.scale(factor)
+
+    def record(self, linebits):
+        """Record the fields of one matched line, a dict as from groupdict()."""
+        for name, top in self.top.items():
+            value = linebits[name]
+            if value is not None:
+                top.add(value)
+        for name, unique in self.unique.items():
+            value = linebits[name]
+            if value is not None:
+                unique.add(value)
+        for name, histogram in self.histograms.items():
+            value = linebits[name]
+            if value is not None and value.isdigit():
+                histogram.record(int(value))
+
+    def get_metrics(self, duration):
+        metrics = []
+        for name, top in sorted(self.top.items()):
+            for rank, (value, count) in enumerate(top.top()):
+                metrics.append(MetricObject('top.%s.%d.%s' % (name, rank + 1, metric_safe(value)),
+                    count / duration, 'Requests per sec'))
+        for name, unique in sorted(self.unique.items()):
+            metrics.append(MetricObject('unique.%s' % name, int(round(unique.cardinality())),
+                'Distinct values'))
+        for name, histogram in sorted(self.histograms.items()):
+            if not histogram.count:
+                continue
+            metrics.append(MetricObject('%s.mean' % name, histogram.mean()))
+            for percentile in self.percentiles:
+                metrics.append(MetricObject('%s.%sth_percentile' % (name, number_name(percentile)),
+                    histogram.percentile(percentile)))
+            for bound, count in histogram.cumulative_counts(self.buckets):
+                metrics.append(MetricObject('%s.le_%s' % (name, number_name(bound)), count))
+            if self.buckets:
+                metrics.append(MetricObject('%s.le_inf' % name, histogram.count))
+        return metrics
+
+
+
+# The field of each Apache LogFormat directive, by its letter, or for
+# %{Header}i by the header and letter.
+APACHE_FIELDS = {
+    'h': 'client', 'a': 'client', 'l': 'ident', 'u': 'user', 't': 'time', 'r': 'request',
+    's': 'http_status_code', 'b': 'bytes', 'B': 'bytes', 'O': 'bytes', 'D': 'response_time',
+    'm': 'method', 'U': 'path', 'q': 'query', 'H': 'protocol', 'v': 'vhost', 'V': 'vhost',
+    'p': 'port', 'referer i': 'referer', 'user-agent i': 'agent',
+}
+APACHE_DIRECTIVE = re.compile(r'%(?:[<>]|!?\d+(?:,\d+)*)*(?:\{(?P<argument>[^}]*)\})?(?P<code>[a-zA-Z%])')
+APACHE_FORMATS = {
+    'common': '%h %l %u %t "%r" %>s %b',
+    'combined': '%h %l %u %t "%r" %>s %b "%{Referer}i" "%{User-agent}i"',
+    'combined_time': '%h %l %u %t "%r" %>s %b "%{Referer}i" "%{User-agent}i" %D',
+    'vhost_combined': '%v:%p %h %l %u %t "%r" %>s %O "%{Referer}i" "%{User-Agent}i"',
+}
+
+# The field of each Squid logformat code.
+SQUID_FIELDS = {
+    'ts': 'time', 'tl': 'time', 'tg': 'time', 'tr': 'elapsed', '>a': 'client', 'Ss': 'squid_code',
+    'Hs': 'http_status_code', '>Hs': 'http_status_code', 'st': 'bytes', '<st': 'bytes',
+    'rm': 'method', 'ru': 'url', 'rp': 'path', 'rv': 'protocol', 'un': 'user', 'ue': 'user',
+    'ul': 'user', 'ui': 'ident', 'Sh': 'hierarchy', '<a': 'peer', 'mt': 'type',
+    'referer >h': 'referer', 'user-agent >h': 'agent',
+}
+SQUID_DIRECTIVE = re.compile(r'%[-\[#\'"/]*\d*(?:\.\d+)?(?:\{(?P<argument>[^}]*)\})?'
+    r'(?P<code>[<>]?(?:ts|tu|tl|tg|tr|Ss|Sh|Hs|st|rm|ru|rp|rv|un|ue|ul|ui|us|mt|la|lp|[aAph%]))')
+SQUID_FORMATS = {
+    'squid': '%ts.%03tu %6tr %>a %Ss/%03>Hs %<st %rm %ru %[un %Sh/%<a %mt',
+    'common': '%>a %[ui %[un [%tl] "%rm %ru HTTP/%rv" %>Hs %<st %Ss:%Sh',
+}
+
+# For each dialect: the pattern of a directive, the fields of the directives,
+# the named formats, and the directives of times logged with a space in them,
+# such as [10/Oct/2000:13:55:36 -0700].
+DIALECTS = {
+    'apache': (APACHE_DIRECTIVE, APACHE_FIELDS, APACHE_FORMATS, ('t',)),
+    'squid': (SQUID_DIRECTIVE, SQUID_FIELDS, SQUID_FORMATS, ('tl', 'tg')),
+}
+
+# The fields %r, the request line, is split into for formats that don't
+# log them on their own.
+REQUEST_FIELDS = ('method', 'path', 'query', 'protocol')
+
+
+def split_escaped(line, maxsplit):
+    """Split line at the double quotes not escaped with a backslash."""
+    escaped = line.replace('\\\\', '\0').replace('\\"', '\1')
+    return [part.replace('\1', '\\"').replace('\0', '\\\\')
+        for part in escaped.split('"', maxsplit)]
+
+
+def split_request(request):
+    """Return the method, path, query and protocol of a request line."""
+    pieces = request is not None and request.split(' ') or ()
+    if len(pieces) < 2:
+        return (None, None, None, None)
+    path, question, query = pieces[1].partition('?')
+    return (pieces[0], path, question and query or None, len(pieces) > 2 and pieces[2] or None)
+
+
+def locate_fields(format, directive, fields, spaced):
+    """
+    Return where each field of a format is found in a line: the index of the
+    part of the line split at double quotes; the index and number of the
+    tokens of that part split at whitespace (None and 1 for a quoted part,
+    which is one value); and, when those hold more than one field, how to
+    pick the field out, as a separator to split them at or a pattern to
+    match, and the index of the field in the result.
+    """
+    locations = {}
+    for part, segment in enumerate(format.split('"')):
+        if part % 2:
+            texts = [segment]
+        else:
+            texts = segment.split()
+        token = 0
+        for text in texts:
+            pieces = []
+            span = 1
+            start = 0
+            for match in directive.finditer(text):
+                code, argument = match.group('code', 'argument')
+                if code in spaced and (argument is None or ' ' in argument):
+                    span += 1
+                if argument is not None:
+                    code = '%s %s' % (argument.lower(), code)
+                pieces.append((text[start:match.start()], fields.get(code)))
+                start = match.end()
+            tail = text[start:]
+
+            if part % 2:
+                position, span = None, 1
+            else:
+                position = token
+                token += span
+
+            if len(pieces) == 1 and not pieces[0][0] and not tail:
+                separator = pattern = None
+            elif len(pieces) == 2 and not pieces[0][0] and pieces[1][0] and not tail:
+                separator, pattern = pieces[1][0], None
+            else:
+                regex = ''.join(['%s(.*?)' % re.escape(literal) for literal, name in pieces])
+                separator, pattern = None, re.compile(regex + re.escape(tail) + '$')
+            for group, (literal, name) in enumerate(pieces):
+                if name is not None and name not in locations:
+                    locations[name] = (part, position, span, separator, pattern, group)
+    return locations
+
+
+def compile_parser(names, locations, quoted):
+    """
+    Write and compile a function returning the values of names from a line,
+    making only the splits needed for them, each once, so that a line costs
+    a handful of string method calls.
+    """
+    namespace = {'split_escaped': split_escaped, 'split_request': split_request}
+    located = [locations.get(name) or locations['request'] for name in names]
+
+    source = ['def parse(line):']
+    if quoted:
+        maxsplit = max([location[0] for location in located]) + 1
+        source += [
+            "    if '\\\\' in line:",
+            "        parts = split_escaped(line, %d)" % maxsplit,
+            "    else:",
+            "        parts = line.split('\"', %d)" % maxsplit,
+            "    size = len(parts)",
+        ]
+    token_splits = {}
+    for part, token, span, separator, pattern, group in located:
+        if token is not None:
+            token_splits[part] = max(token_splits.get(part, 0), token + span)
+    for part, count in sorted(token_splits.items()):
+        if quoted:
+            source.append("    tokens_%d = parts[%d].split(None, %d) if size > %d else ()"
+                % (part, part, count, part))
+        else:
+            source.append("    tokens_%d = line.split(None, %d)" % (part, count))
+
+    values = []
+    written = set()
+    for name, (part, token, span, separator, pattern, group) in zip(names, located):
+        if token is None:
+            value, condition = 'parts[%d]' % part, 'size > %d' % part
+        elif span == 1:
+            value, condition = 'tokens_%d[%d]' % (part, token), 'len(tokens_%d) > %d' % (part, token)
+        else:
+            value = "' '.join(tokens_%d[%d:%d])" % (part, token, token + span)
+            condition = 'len(tokens_%d) > %d' % (part, token + span - 1)
+
+        # Values holding several fields, and the request line, are split up
+        # once into a variable of their own.
+        variable = '%s_%s_%s' % (name in locations and 'pieces' or 'request', part, token)
+        if (separator is not None or pattern is not None or name not in locations) and variable not in written:
+            written.add(variable)
+            if name not in locations:
+                source.append("    %s = split_request(%s if %s else None)" % (variable, value, condition))
+            elif separator is not None:
+                source.append("    %s = %s.split(%r, 1) if %s else ()" % (variable, value, separator, condition))
+            else:
+                namespace['pattern_%s_%s' % (part, token)] = pattern
+                source.append("    %s = pattern_%s_%s.match(%s) if %s else None"
+                    % (variable, part, token, value, condition))
+
+        if name not in locations:
+            values.append('%s[%d]' % (variable, REQUEST_FIELDS.index(name)))
+        elif separator is not None:
+            values.append('%s[%d] if len(%s) > %d else None' % (variable, group, variable, group))
+        elif pattern is not None:
+            values.append('%s and %s.group(%d)' % (variable, variable, group + 1))
+        else:
+            values.append('%s if %s else None' % (value, condition))
+    source.append('    return [%s]' % ',\n        '.join(values))
+
+    exec(compile('\n'.join(source), '<log format>', 'exec'), namespace)
+    return namespace['parse']
+
+
+class LogFormat(object):
+    """
+    Splits access log lines into fields by their layout, given as an Apache
+    LogFormat or Squid logformat, or the name of a common one, without
+    regular expressions. The line is split at double quotes, and the parts
+    outside quotes at runs of whitespace, which puts each field at a fixed
+    position. Only the splits needed for the fields asked for are made, and
+    double quotes escaped with a backslash don't split the line.
+
+    parse(line) returns the values of names in the line, each None if the
+    line is too short to have it, as when a %D at the end of the format
+    isn't logged. Fields that aren't in the line at all, such as the status
+    of a line of garbage, come out None too; the caller decides what makes a
+    line unmatched.
+    """
+
+    def __init__(self, format, names, dialect='apache'):
+        directive, fields, formats, spaced = DIALECTS[dialect]
+        self.format = formats.get(format, format)
+        self.names = list(names)
+        locations = locate_fields(self.format, directive, fields, spaced)
+        for name in self.names:
+            if name not in locations and not (name in REQUEST_FIELDS and 'request' in locations):
+                raise ValueError("The log format %r has no %s field" % (self.format, name))
+        self.parse = compile_parser(self.names, locations, '"' in self.format)
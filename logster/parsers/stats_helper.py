@@ -3,6 +3,24 @@
 ###  A helper to assist with the calculation of statistical functions. This has probably been done better elsewhere but I wanted an easy import.
 ###
 ###  Percentiles are calculated with linear interpolation between points.
+###
+###  Also holds the fixed-memory structures parsers can use to summarise streams with too many distinct
+###  values to keep exactly: space-saving heavy hitters, count-min sketch backed top-k, HyperLogLog
+###  distinct counts, log-linear histograms for percentiles of unbounded numbers of values, sliding
+###  windows of those histograms, and counters of the most recently seen keys.
+
+import math
+import heapq
+import struct
+import hashlib
+
+from array import array
+from collections import OrderedDict
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 def find_median(numbers):
     return find_percentile(numbers,50)
@@ -10,6 +28,11 @@ def find_median(numbers):
 
 def find_percentile(numbers,percentile):
     numbers.sort()
+    return sorted_percentile(numbers, percentile)
+
+
+def sorted_percentile(numbers,percentile):
+    """find_percentile of numbers that are already sorted."""
     if len(numbers) == 0:
         return None
     if len(numbers) == 1:
@@ -27,3 +50,516 @@ def find_mean(numbers):
         return None
     else:
         return sum(numbers,0.0) / len(numbers)
+
+
+class SpaceSaving(object):
+    """
+    Keeps count of at most capacity distinct keys using the space-saving
+    algorithm (Metwally et al.). When a new key arrives and the table is full
+    the key with the lowest count is evicted, and the newcomer inherits that
+    count as its possible overestimate. Keys seen more often than
+    total/capacity times are never evicted, so the heavy hitters stay exact.
+    Keys are kept in buckets by count, making every offer O(1).
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        self.buckets = {}
+        self.min_count = 0
+
+    def __len__(self):
+        return len(self.counts)
+
+    def __contains__(self, key):
+        return key in self.counts
+
+    def _add(self, key, count):
+        self.counts[key] = count
+        bucket = self.buckets.get(count)
+        if bucket is None:
+            bucket = self.buckets[count] = set()
+        bucket.add(key)
+
+    def _remove(self, key):
+        count = self.counts.pop(key)
+        bucket = self.buckets[count]
+        bucket.discard(key)
+        if not bucket:
+            del self.buckets[count]
+            if count == self.min_count:
+                self.min_count = count + 1
+        return count
+
+    def offer(self, key):
+        """Count one occurrence of key. Returns the key evicted to make room
+        for it, or None."""
+        count = self.counts.get(key)
+        if count is not None:
+            self._remove(key)
+            self._add(key, count + 1)
+            return None
+
+        evicted = None
+        error = 0
+        if len(self.counts) >= self.capacity:
+            evicted = next(iter(self.buckets[self.min_count]))
+            error = self._remove(evicted)
+            del self.errors[evicted]
+        self.errors[key] = error
+        self._add(key, error + 1)
+        if not error or error + 1 < self.min_count:
+            self.min_count = error + 1
+        return evicted
+
+    def merge(self, other):
+        """Add the counts of another SpaceSaving, keeping the capacity most
+        frequent keys. Returns the keys that were dropped."""
+        counts = dict(self.counts)
+        errors = dict(self.errors)
+        for key, count in other.counts.items():
+            counts[key] = counts.get(key, 0) + count
+            errors[key] = errors.get(key, 0) + other.errors[key]
+        ranked = sorted(counts, key=lambda key: counts[key], reverse=True)
+        self.counts, self.errors, self.buckets = {}, {}, {}
+        for key in ranked[:self.capacity]:
+            self.errors[key] = errors[key]
+            self._add(key, counts[key])
+        self.min_count = self.buckets and min(self.buckets) or 0
+        return ranked[self.capacity:]
+
+    def top(self, k=None):
+        """Return (key, count, error) for the k most frequent keys."""
+        items = sorted(self.counts.items(), key=lambda item: item[1], reverse=True)
+        return [(key, count, self.errors[key]) for key, count in items[:k]]
+
+
+class LRUCounter(object):
+    """
+    Counts occurrences of at most capacity distinct keys. When a new key
+    arrives and the table is full, the key seen least recently is dropped,
+    so keys that keep occurring are counted from their first occurrence
+    while one-offs are forgotten. Cheaper per add than SpaceSaving, for keys
+    that come in bursts such as the exceptions of an outage.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = OrderedDict()
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self.counts)
+
+    def add(self, key, count=1):
+        """Count key, returning the key it displaced, if any."""
+        counts = self.counts
+        if key in counts:
+            # Re-inserting moves the key to the most recent end.
+            counts[key] = counts.pop(key) + count
+            return None
+        counts[key] = count
+        if len(counts) > self.capacity:
+            self.dropped += 1
+            return counts.popitem(last=False)[0]
+        return None
+
+    def merge(self, other):
+        """Add the counts of another LRUCounter, as if its keys were seen
+        after this one's."""
+        for key, count in other.counts.items():
+            self.add(key, count)
+        self.dropped += other.dropped
+
+    def scale(self, factor):
+        for key, count in self.counts.items():
+            self.counts[key] = count * factor
+
+    def items(self):
+        return list(self.counts.items())
+
+
+def hash_pair(key):
+    """Return two 64 bit hashes of key, the same on every host."""
+    if not isinstance(key, bytes):
+        key = key.encode('utf-8')
+    return struct.unpack('<QQ', hashlib.md5(key).digest())
+
+
+def key_hashes(key, depth, width):
+    """Return depth hashes of key in range(width), derived from one md5 digest
+    by double hashing."""
+    h1, h2 = hash_pair(key)
+    return [(h1 + i * h2) % width for i in range(depth)]
+
+
+class CountMinSketch(object):
+    """
+    Approximate counts of any number of distinct keys in width * depth
+    counters. Estimates never undercount, and overcount by at most
+    e/width of the total with probability 1 - exp(-depth).
+    """
+
+    def __init__(self, width=2048, depth=4):
+        self.width = width
+        self.depth = depth
+        self.table = array('l', [0]) * (width * depth)
+
+    def add(self, key, count=1):
+        """Count key and return its new estimate."""
+        table = self.table
+        estimate = None
+        for row, column in enumerate(key_hashes(key, self.depth, self.width)):
+            index = row * self.width + column
+            table[index] += count
+            if estimate is None or table[index] < estimate:
+                estimate = table[index]
+        return estimate
+
+    def estimate(self, key):
+        return min([self.table[row * self.width + column]
+            for row, column in enumerate(key_hashes(key, self.depth, self.width))])
+
+    def merge(self, other):
+        """Add the counts of a sketch of the same dimensions."""
+        if (self.width, self.depth) != (other.width, other.depth):
+            raise ValueError("Cannot merge sketches of different dimensions")
+        table = self.table
+        for index, count in enumerate(other.table):
+            table[index] += count
+
+    def scale(self, factor):
+        """Multiply every count by factor, e.g. to estimate the counts of a
+        whole stream from a sample of it."""
+        self.table = array('l', [int(round(count * factor)) for count in self.table])
+
+
+class TopK(object):
+    """
+    The k most frequent keys of a stream, in fixed memory: counts come from a
+    count-min sketch and the current top k keys are kept in a min-heap.
+    """
+
+    def __init__(self, k, width=2048, depth=4):
+        self.k = k
+        self.sketch = CountMinSketch(width, depth)
+        self.candidates = {}
+        self.heap = []
+
+    def _lowest(self):
+        """Return the heap's lowest (estimate, key), refreshing entries whose
+        estimate went up since they were pushed."""
+        heap = self.heap
+        while True:
+            estimate, key = heap[0]
+            current = self.candidates[key]
+            if current == estimate:
+                return estimate, key
+            heapq.heapreplace(heap, (current, key))
+
+    def add(self, key, count=1):
+        estimate = self.sketch.add(key, count)
+        candidates = self.candidates
+        if key in candidates:
+            candidates[key] = estimate
+        elif len(candidates) < self.k:
+            candidates[key] = estimate
+            heapq.heappush(self.heap, (estimate, key))
+        elif estimate > self.heap[0][0]:
+            lowest, lowest_key = self._lowest()
+            if estimate > lowest:
+                heapq.heapreplace(self.heap, (estimate, key))
+                del candidates[lowest_key]
+                candidates[key] = estimate
+
+    def merge(self, other):
+        """Fold in a TopK built with the same sketch dimensions."""
+        self.sketch.merge(other.sketch)
+        keys = set(self.candidates) | set(other.candidates)
+        estimates = sorted([(self.sketch.estimate(key), key) for key in keys], reverse=True)
+        self.candidates = dict((key, estimate) for estimate, key in estimates[:self.k])
+        self.heap = [(estimate, key) for key, estimate in self.candidates.items()]
+        heapq.heapify(self.heap)
+
+    def scale(self, factor):
+        self.sketch.scale(factor)
+        self.candidates = dict((key, self.sketch.estimate(key)) for key in self.candidates)
+        self.heap = [(estimate, key) for key, estimate in self.candidates.items()]
+        heapq.heapify(self.heap)
+
+    def top(self):
+        """Return [(key, estimate)] with the most frequent key first."""
+        return sorted(self.candidates.items(), key=lambda item: (-item[1], item[0]))
+
+
+class HyperLogLog(object):
+    """
+    Estimates the number of distinct keys seen with a relative standard error
+    of error_rate, in 2**precision one byte registers where
+    precision = log2((1.04 / error_rate) ** 2), e.g. 4KB for 2%. Sketches with
+    the same error rate from different shards or hosts can be merged.
+    """
+
+    def __init__(self, error_rate=0.02):
+        self.precision = min(16, max(4, int(math.ceil(math.log((1.04 / error_rate) ** 2, 2)))))
+        self.registers = array('B', [0]) * (1 << self.precision)
+
+    def add(self, key):
+        rest_bits = 64 - self.precision
+        h = hash_pair(key)[0]
+        index = h >> rest_bits
+        rank = rest_bits - (h & ((1 << rest_bits) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        if self.precision != other.precision:
+            raise ValueError("Cannot merge HyperLogLogs of different precision")
+        registers = self.registers
+        for index, rank in enumerate(other.registers):
+            if rank > registers[index]:
+                registers[index] = rank
+
+    def cardinality(self):
+        m = len(self.registers)
+        alpha = {16: 0.673, 32: 0.697, 64: 0.709}.get(m, 0.7213 / (1 + 1.079 / m))
+        estimate = alpha * m * m / sum([2.0 ** -rank for rank in self.registers])
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # Small range correction: linear counting of the empty registers.
+            estimate = m * math.log(float(m) / zeros)
+        return estimate
+
+
+class ExactValues(object):
+    """
+    Keeps every value recorded, for exact percentiles. Values are kept as
+    doubles in an array, 8 bytes each rather than a float object in a list,
+    and sorted once for all the percentiles asked for, with NumPy if it is
+    installed. Percentiles are the same as find_percentile's.
+    """
+
+    def __init__(self):
+        self.values = array('d')
+        # Values are only recorded at the end, so the array is still sorted
+        # while it has as many values as when it was last sorted.
+        self.sorted_length = 0
+
+    def __len__(self):
+        return len(self.values)
+
+    def record(self, value):
+        self.values.append(value)
+
+    def merge(self, other):
+        self.values.extend(other.values)
+
+    def sort(self):
+        if len(self.values) == self.sorted_length:
+            return
+        if numpy is not None:
+            values = numpy.sort(numpy.frombuffer(self.values, dtype=numpy.float64))
+            self.values = array('d', values.tobytes())
+        else:
+            self.values = array('d', sorted(self.values))
+        self.sorted_length = len(self.values)
+
+    def mean(self):
+        if not self.values:
+            return None
+        if numpy is not None:
+            return float(numpy.frombuffer(self.values, dtype=numpy.float64).mean())
+        return sum(self.values, 0.0) / len(self.values)
+
+    def percentile(self, percentile):
+        self.sort()
+        return sorted_percentile(self.values, percentile)
+
+    def percentiles(self, percentiles):
+        """Return each of percentiles, sorting the values once."""
+        self.sort()
+        return [sorted_percentile(self.values, percentile) for percentile in percentiles]
+
+
+class LogLinearHistogram(object):
+    """
+    HDR-style histogram of non-negative values in a fixed array of counters.
+    Each power of two between lowest and highest is split into sub_buckets
+    linear buckets, so values are kept to a relative precision of
+    1/sub_buckets (about 3% with the default 32) whatever their magnitude.
+    Values below lowest share the first bucket and values above highest the
+    last. Recording is O(1), and histograms with the same layout can be
+    merged, e.g. to get percentiles across hosts.
+    """
+
+    def __init__(self, lowest=1.0 / 1024, highest=2.0 ** 40, sub_buckets=32):
+        self.lowest = lowest
+        self.highest = highest
+        self.sub_buckets = sub_buckets
+        self.min_exponent = math.frexp(lowest)[1]
+        self.max_exponent = math.frexp(highest)[1]
+        self.counts = array('d', [0]) * ((self.max_exponent - self.min_exponent + 1) * sub_buckets + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def __len__(self):
+        return int(round(self.count))
+
+    def layout(self):
+        return (self.lowest, self.highest, self.sub_buckets)
+
+    def index(self, value):
+        """Return the bucket a value is counted in; bucket 0 is for values
+        below lowest."""
+        if value < self.lowest:
+            return 0
+        mantissa, exponent = math.frexp(value)
+        if exponent > self.max_exponent:
+            return len(self.counts) - 1
+        return ((exponent - self.min_exponent) * self.sub_buckets
+            + int((mantissa - 0.5) * 2 * self.sub_buckets) + 1)
+
+    def bounds(self, index):
+        """Return the (lower, upper) values of a bucket."""
+        if index == 0:
+            return 0.0, self.lowest
+        exponent, sub_bucket = divmod(index - 1, self.sub_buckets)
+        lower = math.ldexp(0.5 + sub_bucket / (2.0 * self.sub_buckets), exponent + self.min_exponent)
+        upper = math.ldexp(0.5 + (sub_bucket + 1) / (2.0 * self.sub_buckets), exponent + self.min_exponent)
+        return lower, upper
+
+    def record(self, value, count=1):
+        self.counts[self.index(value)] += count
+        self.count += count
+        self.total += value * count
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        """Add the values of a histogram with the same layout."""
+        if self.layout() != other.layout():
+            raise ValueError("Cannot merge histograms with different layouts")
+        counts = self.counts
+        for index, count in enumerate(other.counts):
+            if count:
+                counts[index] += count
+        self.count += other.count
+        self.total += other.total
+        for value in (other.min, other.max):
+            if value is not None:
+                if self.min is None or value < self.min:
+                    self.min = value
+                if self.max is None or value > self.max:
+                    self.max = value
+
+    def scale(self, factor):
+        """Multiply the count of every bucket by factor, e.g. to estimate the
+        counts of a whole stream from a sample of it. The distribution, and
+        so the mean and percentiles, stay the same."""
+        counts = self.counts
+        for index, count in enumerate(counts):
+            if count:
+                counts[index] = count * factor
+        self.count *= factor
+        self.total *= factor
+
+    def mean(self):
+        if not self.count:
+            return None
+        return self.total / self.count
+
+    def percentile(self, percentile):
+        """Return the value below which percentile % of the values fall, to
+        the precision of the buckets."""
+        if not self.count:
+            return None
+        if percentile <= 0:
+            return self.min
+        if percentile >= 100:
+            return self.max
+        rank = percentile / 100.0 * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                lower, upper = self.bounds(index)
+                return min(max((lower + upper) / 2, self.min), self.max)
+        return self.max
+
+    def percentiles(self, percentiles):
+        return [self.percentile(percentile) for percentile in percentiles]
+
+    def cumulative_counts(self, bounds):
+        """Return [(bound, count of values <= bound)], to the precision of the
+        buckets, as for Prometheus style le buckets."""
+        cumulative = []
+        for bound in sorted(bounds):
+            last = self.index(bound)
+            cumulative.append((bound, sum(self.counts[:last + 1])))
+        return cumulative
+
+
+class SlidingWindow(object):
+    """
+    The values recorded over the last window seconds, for percentiles over a
+    longer span than one run. Histograms added are merged into a ring of at
+    most slots time slots, each kept as its non-empty buckets only, so the
+    memory used is bounded by slots whatever the number of values.
+    """
+
+    def __init__(self, window, slots=60, layout=None):
+        self.window = window
+        self.width = max(window // slots, 1)
+        self.slots = {}
+        self.layout = layout or LogLinearHistogram().layout()
+
+    def __len__(self):
+        return len(self.slots)
+
+    def add(self, histogram, now):
+        """Merge a histogram of the values seen up to now."""
+        if histogram.layout() != self.layout:
+            raise ValueError("Cannot add histograms with different layouts")
+        slot = int(now // self.width)
+        self.expire(now)
+        if not histogram.count:
+            return
+        # [count, total, min, max, {bucket index: count}]
+        entry = self.slots.get(slot)
+        if entry is None:
+            entry = self.slots[slot] = [0, 0.0, histogram.min, histogram.max, {}]
+        buckets = entry[4]
+        for index, bucket_count in enumerate(histogram.counts):
+            if bucket_count:
+                buckets[index] = buckets.get(index, 0) + bucket_count
+        entry[0] += histogram.count
+        entry[1] += histogram.total
+        entry[2] = min(entry[2], histogram.min)
+        entry[3] = max(entry[3], histogram.max)
+
+    def expire(self, now):
+        """Drop the slots that have slid out of the window."""
+        oldest = int(now // self.width) - self.window // self.width + 1
+        for slot in [slot for slot in self.slots if slot < oldest]:
+            del self.slots[slot]
+
+    def histogram(self, now):
+        """Return a LogLinearHistogram of the values in the window ending now."""
+        self.expire(now)
+        merged = LogLinearHistogram(*self.layout)
+        for count, total, lowest, highest, buckets in self.slots.values():
+            for index, bucket_count in buckets.items():
+                merged.counts[index] += bucket_count
+            merged.count += count
+            merged.total += total
+            if merged.min is None or lowest < merged.min:
+                merged.min = lowest
+            if merged.max is None or highest > merged.max:
+                merged.max = highest
+        return merged
+
@@ -0,0 +1,128 @@
+###
+###  Serialises the partial state of a parser (counters, histograms, sketches; see
+###  LogsterParser.get_partial_state) to JSON, so that it can be sent to logster-aggregate and merged
+###  with the state of the same parser on other hosts.
+###
+###  Only plain data and the classes registered here can be decoded, so a message from the network
+###  can't be used to create arbitrary objects. Parsers with their own summary classes can add them
+###  with register().
+###
+###
+###  Copyright 2011, Etsy, Inc.
+###
+###  This file is part of Logster.
+###
+###  Logster is free software: you can redistribute it and/or modify
+###  it under the terms of the GNU General Public License as published by
+###  the Free Software Foundation, either version 3 of the License, or
+###  (at your option) any later version.
+###
+###  Logster is distributed in the hope that it will be useful,
+###  but WITHOUT ANY WARRANTY; without even the implied warranty of
+###  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+###  GNU General Public License for more details.
+###
+###  You should have received a copy of the GNU General Public License
+###  along with Logster. If not, see <http://www.gnu.org/licenses/>.
+###
+
+import json
+
+from array import array
+from collections import OrderedDict
+
+from logster.parsers import stats_helper, access_log_helper
+
+try:
+    number_types = (bool, int, long, float)
+except NameError:
+    number_types = (bool, int, float)
+text_types = (str, type(u''))
+
+serializable = {}
+
+# The most zeros an array may have beyond the values encoded, which is
+# well above the size of the sketches and histograms of stats_helper.
+max_array_zeros = 1 << 20
+
+
+def register(cls):
+    """Allow instances of cls to be encoded and decoded by their attributes."""
+    serializable[cls.__name__] = cls
+    return cls
+
+for cls in (stats_helper.SpaceSaving, stats_helper.CountMinSketch, stats_helper.TopK,
+        stats_helper.HyperLogLog, stats_helper.ExactValues, stats_helper.LogLinearHistogram,
+        stats_helper.LRUCounter, stats_helper.SlidingWindow, access_log_helper.FieldStats):
+    register(cls)
+
+
+def encode(value):
+    """Turn value into something json can dump."""
+    if value is None or isinstance(value, number_types + text_types):
+        return value
+    if isinstance(value, bytes):
+        return {'__bytes__': value.decode('latin-1')}
+    if isinstance(value, list):
+        return [encode(item) for item in value]
+    if isinstance(value, tuple):
+        return {'__tuple__': [encode(item) for item in value]}
+    if isinstance(value, (set, frozenset)):
+        return {'__set__': [encode(item) for item in value]}
+    if isinstance(value, OrderedDict):
+        return {'__ordered__': [[encode(key), encode(item)] for key, item in value.items()]}
+    if isinstance(value, dict):
+        if all([isinstance(key, text_types) and not key.startswith('__') for key in value]):
+            return dict((key, encode(item)) for key, item in value.items())
+        return {'__dict__': [[encode(key), encode(item)] for key, item in value.items()]}
+    if isinstance(value, array):
+        # Sketches and histograms are mostly zeros.
+        return {'__array__': value.typecode, 'size': len(value),
+            'nonzero': [[index, item] for index, item in enumerate(value) if item]}
+    name = value.__class__.__name__
+    if serializable.get(name) is value.__class__:
+        return {'__object__': name, 'attributes': encode(value.__dict__)}
+    raise TypeError("Cannot encode %r in a partial state" % value)
+
+
+def decode(value):
+    """Rebuild what encode was given from what json loaded."""
+    if isinstance(value, list):
+        return [decode(item) for item in value]
+    if not isinstance(value, dict):
+        return value
+    if '__tuple__' in value:
+        return tuple([decode(item) for item in value['__tuple__']])
+    if '__set__' in value:
+        return set([decode(item) for item in value['__set__']])
+    if '__ordered__' in value:
+        return OrderedDict((decode(key), decode(item)) for key, item in value['__ordered__'])
+    if '__dict__' in value:
+        return dict((decode(key), decode(item)) for key, item in value['__dict__'])
+    if '__bytes__' in value:
+        return value['__bytes__'].encode('latin-1')
+    if '__array__' in value:
+        typecode = str(value['__array__'])
+        size = value['size']
+        # The size comes from the network: don't let a message ask for more
+        # memory than the values it carries, bar the zeros of a sketch.
+        if not isinstance(size, int) or not 0 <= size - len(value['nonzero']) <= max_array_zeros:
+            raise ValueError("Invalid size %r of an array with %d values" % (size, len(value['nonzero'])))
+        decoded = array(typecode, [0]) * size
+        for index, item in value['nonzero']:
+            decoded[index] = item
+        return decoded
+    if '__object__' in value:
+        cls = serializable[value['__object__']]
+        decoded = cls.__new__(cls)
+        decoded.__dict__.update(decode(value['attributes']))
+        return decoded
+    return dict((key, decode(item)) for key, item in value.items())
+
+
+def dumps(state):
+    return json.dumps(encode(state), separators=(',', ':'))
+
+
+def loads(text):
+    return decode(json.loads(text))
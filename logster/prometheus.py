@@ -0,0 +1,139 @@
+###
+###  Writes metrics to a text file for the textfile collector of the Prometheus node_exporter, in the
+###  OpenMetrics text format. Every job, a parser and log file pair, writes its series with a
+###  logster_job label into the same file; a run replaces the series of its own job and keeps those
+###  of the others. The file is replaced with an atomic rename, so the collector never reads it half
+###  written.
+###
+###
+###  Copyright 2011, Etsy, Inc.
+###
+###  This file is part of Logster.
+###
+###  Logster is free software: you can redistribute it and/or modify
+###  it under the terms of the GNU General Public License as published by
+###  the Free Software Foundation, either version 3 of the License, or
+###  (at your option) any later version.
+###
+###  Logster is distributed in the hope that it will be useful,
+###  but WITHOUT ANY WARRANTY; without even the implied warranty of
+###  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+###  GNU General Public License for more details.
+###
+###  You should have received a copy of the GNU General Public License
+###  along with Logster. If not, see <http://www.gnu.org/licenses/>.
+###
+
+import os
+import re
+import fcntl
+import tempfile
+
+unsafe_characters = re.compile(r'[^a-zA-Z0-9_:]')
+sample_line = re.compile(r'^(?P<name>[a-zA-Z_:][a-zA-Z0-9_:]*)\{logster_job="(?P<job>(?:[^"\\]|\\.)*)"\} (?P<value>\S+)$')
+
+
+def metric_name(name):
+    """Turn a metric name such as http.2xx into a valid Prometheus name."""
+    name = unsafe_characters.sub('_', name)
+    if name[:1].isdigit():
+        name = '_' + name
+    return name
+
+
+def escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_value(value):
+    value = float(value)
+    if value != value:
+        return 'NaN'
+    if value in (float('inf'), float('-inf')):
+        return value > 0 and '+Inf' or '-Inf'
+    return repr(value)
+
+
+def read_textfile(path):
+    """
+    Read the series of a file written by write_textfile, as a dict of
+    metric families by name, each a dict with the 'help' text and the
+    'samples' by escaped job name.
+    """
+    families = {}
+    try:
+        f = open(path)
+    except IOError:
+        return families
+    try:
+        for line in f:
+            line = line.rstrip('\n')
+            if line.startswith('# HELP '):
+                name, help = (line[7:].split(' ', 1) + [''])[:2]
+                families.setdefault(name, {'help': '', 'samples': {}})['help'] = help
+                continue
+            match = sample_line.match(line)
+            if match:
+                family = families.setdefault(match.group('name'), {'help': '', 'samples': {}})
+                family['samples'][match.group('job')] = match.group('value')
+    finally:
+        f.close()
+    return families
+
+
+def render(families):
+    lines = []
+    for name in sorted(families):
+        family = families[name]
+        if family['help']:
+            lines.append('# HELP %s %s' % (name, family['help']))
+        lines.append('# TYPE %s gauge' % name)
+        for job in sorted(family['samples']):
+            lines.append('%s{logster_job="%s"} %s' % (name, job, family['samples'][job]))
+    lines.append('# EOF')
+    return '\n'.join(lines) + '\n'
+
+
+def add_metrics(families, job, metrics):
+    """Replace the series of job in families with metrics."""
+    job = escape(job)
+    for family in families.values():
+        family['samples'].pop(job, None)
+    for metric in metrics:
+        if metric.value is None:
+            continue
+        family = families.setdefault(metric_name(metric.name), {'help': '', 'samples': {}})
+        if metric.units and not family['help']:
+            family['help'] = metric.units.replace('\\', '\\\\').replace('\n', '\\n')
+        family['samples'][job] = format_value(metric.value)
+    for name in [name for name, family in families.items() if not family['samples']]:
+        del families[name]
+    return families
+
+
+def write_textfile(path, job, metrics):
+    """Merge the metrics of job into the file at path, atomically."""
+    directory, filename = os.path.split(os.path.abspath(path))
+    # Runs of other jobs update the same file; hold a lock from reading
+    # their series to replacing the file.
+    lock = open(os.path.join(directory, '.%s.lock' % filename), 'a')
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        text = render(add_metrics(read_textfile(path), job, metrics))
+        fd, temp_path = tempfile.mkstemp(prefix='.%s.' % filename, dir=directory)
+        try:
+            f = os.fdopen(fd, 'w')
+            try:
+                f.write(text)
+                f.flush()
+                os.fsync(f.fileno())
+            finally:
+                f.close()
+            # mkstemp creates the file readable by its owner only.
+            os.chmod(temp_path, 420) # 0644
+            os.rename(temp_path, path)
+        except:
+            os.unlink(temp_path)
+            raise
+    finally:
+        lock.close()
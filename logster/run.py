@@ -48,14 +48,15 @@ import sys
 import re
 import optparse
 import stat
+import pickle
 import logging.handlers
-import fcntl
 import socket
 import traceback
 import contextlib
 
 from time import time
-from math import floor
+from math import floor, ceil, sqrt
+from collections import OrderedDict
 
 try:
     import importlib
@@ -63,10 +64,17 @@ except ImportError:
     pass # Python 2.6
 
 # Local dependencies
-from logster.logster_helper import LogsterParsingException, LockingError
+from logster import graphite
+from logster import partial_state
+from logster import prometheus
+from logster.logster_helper import MetricObject, LogsterParsingException, LockingError
+from logster.logster_helper import UNMATCHED, PARSE_ERROR
+from logster.state_store import StateStore
+from logster.tailer import LogTail
 
 # Globals
 gmetric = "/usr/bin/gmetric"
+STATE_STORE_NAME = "logster.db"
 
 logger = logging.getLogger('logster')
 
@@ -74,33 +82,82 @@ def get_args():
     "Parse command-line options"
 
     # defaults
-    logtail = "/usr/sbin/logtail2"
     state_dir = "/var/run"
+    lease_timeout = 3600
+    checkpoint_size = 64
+    checkpoint_interval = 60
+    log_failures = 10
+    sample_rate = 1.0
+    heartbeat = 0
 
     cmdline = optparse.OptionParser(usage="usage: %prog [options] parser logfile",
         description="Tail a log file and filter each line to generate metrics that can be sent to common monitoring packages.")
-    cmdline.add_option('--logtail', action='store', default=logtail,
-                        help='Specify location of logtail.  Default %s' % logtail)
+    # logtail is no longer used; the option is accepted for existing crontabs.
+    cmdline.add_option('--logtail', action='store', help=optparse.SUPPRESS_HELP)
+    cmdline.add_option('--parser-help', action='store_true',
+                        help='Print usage and options for the selected parser')
+    cmdline.add_option('--parser-options', action='store',
+                        help='Options to pass to the logster parser such as "-o VALUE --option2 VALUE". These are parser-specific and passed directly to the parser.')
+    cmdline.add_option('--state-dir', '-s', action='store', default=state_dir,
+                        help='Where to store the state of all jobs.  Default location %s' % state_dir)
+    cmdline.add_option('--lease-timeout', action='store', type='int', default=lease_timeout,
+                        help='Seconds after which the lock held by a run that never finished is taken over.  Default %default')
+    cmdline.add_option('--checkpoint-size', action='store', type='int', default=checkpoint_size,
+                        help='Save the progress of a run every this many MB read, so a killed run can be resumed.  0 disables.  Default %default')
+    cmdline.add_option('--checkpoint-interval', action='store', type='int', default=checkpoint_interval,
+                        help='Save the progress of a run every this many seconds.  0 disables.  Default %default')
+    cmdline.add_option('--log-failures', action='store', type='int', default=log_failures,
+                        help='Log the first this many lines per run that the parser did not match or failed on, with --debug.  Default %default')
+    cmdline.add_option('--sample-rate', action='store', type='float', default=sample_rate,
+                        help='Parse only this fraction of the lines, evenly spread, and scale the counts up to match.  Default %default')
+    cmdline.add_option('--max-lines', action='store', type='int', default=0,
+                        help='Parse at most about this many lines per run, sampling the rest as for --sample-rate when the log grows faster.  0 disables.  Default %default')
+    cmdline.add_option('--parse-cache', action='store', type='int', default=0,
+                        help='Remember how the parser classified this many distinct lines, ignoring their timestamps, so repeated lines are not parsed again.  For parsers that support it, such as Log4jLogster and ErrorLogLogster.  0 disables.  Default %default')
+    cmdline.add_option('--cache-prefix', action='store',
+                        help='Regular expression matching the start of each line, such as its timestamp, to ignore for --parse-cache.  Defaults to one chosen by the parser.')
+    cmdline.add_option('--heartbeat', action='store', type='int', default=heartbeat,
+                        help='Send a metric whose value has not changed since it was last sent to Graphite, Ganglia or stdout only once this many seconds have passed.  0 sends every value.  Default %default')
+    add_common_options(cmdline)
+    options, arguments = cmdline.parse_args()
+
+    if not 0 < options.sample_rate <= 1:
+        cmdline.error("--sample-rate must be more than 0 and at most 1.")
+
+    if options.parser_help:
+        options.parser_options = '-h'
+
+    if (len(arguments) != 2):
+        cmdline.print_help()
+        cmdline.error("Supply at least two arguments: parser and logfile.")
+    check_common_options(cmdline, options)
+
+    class_name, log_file = arguments
+    return class_name, log_file, options
+
+
+def add_common_options(cmdline):
+    """Add the output and logging options shared by logster and logster-aggregate."""
     cmdline.add_option('--metric-prefix', '-p', action='store',
                         help='Add prefix to all published metrics. This is for people that may multiple instances of same service on same host.',
                         default='')
     cmdline.add_option('--metric-suffix', '-x', action='store',
                         help='Add suffix to all published metrics. This is for people that may add suffix at the end of their metrics.',
                         default=None)
-    cmdline.add_option('--parser-help', action='store_true',
-                        help='Print usage and options for the selected parser')
-    cmdline.add_option('--parser-options', action='store',
-                        help='Options to pass to the logster parser such as "-o VALUE --option2 VALUE". These are parser-specific and passed directly to the parser.')
     cmdline.add_option('--gmetric-options', action='store',
                         help='Options to pass to gmetric such as "-d 180 -c /etc/ganglia/gmond.conf" (default). These are passed directly to gmetric.',
                         default='-d 180 -c /etc/ganglia/gmond.conf')
     cmdline.add_option('--graphite-host', action='store',
-                        help='Hostname and port for Graphite collector, e.g. graphite.example.com:2003')
-    cmdline.add_option('--state-dir', '-s', action='store', default=state_dir,
-                        help='Where to store the logtail state file.  Default location %s' % state_dir)
+                        help='Hostname and port for Graphite collector, e.g. graphite.example.com:2003, or a comma-separated list of host:port[:instance] to shard metrics across with the consistent-hash ring of carbon-relay')
+    cmdline.add_option('--aggregate-host', action='store',
+                        help='Hostname and port of logster-aggregate, e.g. aggregate.example.com:5140')
+    cmdline.add_option('--prometheus-dir', action='store',
+                        help='Directory of the node_exporter textfile collector to write metrics to')
+    cmdline.add_option('--prometheus-file', action='store', default='logster.prom',
+                        help='Name of the file in --prometheus-dir that the metrics of all jobs are written to.  Default %default')
     cmdline.add_option('--output', '-o', action='append',
-                       choices=('graphite', 'ganglia', 'stdout'),
-                       help="Where to send metrics (can specify multiple times). Choices are 'graphite', 'ganglia', or 'stdout'.")
+                       choices=('graphite', 'ganglia', 'stdout', 'prometheus', 'aggregate'),
+                       help="Where to send metrics (can specify multiple times). Choices are 'graphite', 'ganglia', 'stdout', 'prometheus', or 'aggregate' to send the parser state to logster-aggregate.")
     cmdline.add_option('--stdout-separator', action='store', default="_", dest="stdout_separator",
                         help='Seperator between prefix/suffix and name for stdout. Default is \"%default\".')
     cmdline.add_option('--dry-run', '-d', action='store_true', default=False,
@@ -109,23 +166,26 @@ def get_args():
                         help='Provide more verbose logging for debugging.')
     cmdline.add_option('--log', default="/var/log/logster",
                        help="directory to which to log (or 'stderr')")
-    options, arguments = cmdline.parse_args()
 
-    if options.parser_help:
-        options.parser_options = '-h'
 
-    if (len(arguments) != 2):
-        cmdline.print_help()
-        cmdline.error("Supply at least two arguments: parser and logfile.")
+def check_common_options(cmdline, options):
     if not options.output:
         cmdline.print_help()
         cmdline.error("Supply where the data should be sent with -o (or --output).")
     if 'graphite' in options.output and not options.graphite_host:
         cmdline.print_help()
         cmdline.error("You must supply --graphite-host when using 'graphite' as an output type.")
-
-    class_name, log_file = arguments
-    return class_name, log_file, options
+    if options.graphite_host:
+        try:
+            graphite.parse_destinations(options.graphite_host)
+        except ValueError:
+            cmdline.error(str(sys.exc_info()[1]))
+    if 'prometheus' in options.output and not options.prometheus_dir:
+        cmdline.print_help()
+        cmdline.error("You must supply --prometheus-dir when using 'prometheus' as an output type.")
+    if 'aggregate' in options.output and not options.aggregate_host:
+        cmdline.print_help()
+        cmdline.error("You must supply --aggregate-host when using 'aggregate' as an output type.")
 
 
 def setup_logging(options):
@@ -161,15 +221,68 @@ def lineno():
     return inspect.currentframe().f_back.f_lineno
 
 
-def submit_stats(parser, duration, options):
-    metrics = parser.get_state(duration)
-
+def submit_stats(parser, duration, options, parse_stats=None, job=None, change_filter=None):
+    if 'aggregate' in options.output:
+        submit_partial_state(parser, duration, options)
+    if set(options.output) - set(['aggregate']):
+        metrics = parser.get_state(duration)
+        if parse_stats is not None:
+            metrics = metrics + parse_stats.get_metrics()
+        submit_metrics(metrics, options, job, change_filter)
+
+def submit_metrics(metrics, options, job=None, change_filter=None):
+    if 'prometheus' in options.output:
+        submit_prometheus(metrics, options, job)
+    # The textfile above holds the latest value of every series, so only
+    # the outputs that send points are filtered.
+    if change_filter is not None:
+        metrics = change_filter.filter(metrics)
     if 'ganglia' in options.output:
         submit_ganglia(metrics, options)
     if 'graphite' in options.output:
         submit_graphite(metrics, options)
     if 'stdout' in options.output:
         submit_stdout(metrics, options)
+    if change_filter is not None:
+        change_filter.commit()
+
+
+class ChangeFilter(object):
+    """
+    Drops the metrics of a job whose value is the same as the last one sent,
+    unless that was heartbeat or more seconds ago, and reports the number
+    dropped as logster.points_suppressed. The last values are kept in the
+    state store and only recorded once the metrics have been sent.
+    """
+
+    def __init__(self, store, job, heartbeat):
+        self.store = store
+        self.job = job
+        self.heartbeat = heartbeat
+        self.sent = []
+
+    def filter(self, metrics, now=None):
+        if now is None:
+            now = time()
+        self.now = now
+        last = self.store.get_sent_values(self.job)
+        send = []
+        self.sent = []
+        for metric in metrics:
+            value = repr(metric.value)
+            last_value, last_sent = last.get(metric.name, (None, None))
+            if value == last_value and now - last_sent < self.heartbeat:
+                continue
+            send.append(metric)
+            self.sent.append((metric.name, value, now))
+        suppressed = len(metrics) - len(send)
+        logger.debug("Suppressed %d unchanged metrics" % suppressed)
+        send.append(MetricObject('logster.points_suppressed', suppressed, 'Points'))
+        return send
+
+    def commit(self):
+        """Record the values sent, forgetting metrics no longer reported."""
+        self.store.save_sent_values(self.job, self.sent, self.now - self.heartbeat)
 
 def submit_stdout(metrics, options):
     for metric in metrics:
@@ -179,6 +292,23 @@ def submit_stdout(metrics, options):
             metric.name = metric.name + options.stdout_separator + options.metric_suffix
         sys.stdout.write("%s %s\n" % (metric.name, metric.value))
 
+def submit_prometheus(metrics, options, job):
+    names = []
+    for metric in metrics:
+        name = metric.name
+        if (options.metric_prefix != ""):
+            name = options.metric_prefix + "_" + name
+        if (options.metric_suffix is not None):
+            name = name + "_" + options.metric_suffix
+        names.append(MetricObject(name, metric.value, metric.units))
+
+    path = os.path.join(options.prometheus_dir, options.prometheus_file)
+    logger.debug("Writing %d Prometheus metrics to %s" % (len(names), path))
+    if (not options.dry_run):
+        prometheus.write_textfile(path, job or '', names)
+    else:
+        sys.stdout.write(prometheus.render(prometheus.add_metrics({}, job or '', names)))
+
 def submit_ganglia(metrics, options):
     for metric in metrics:
 
@@ -197,15 +327,17 @@ def submit_ganglia(metrics, options):
             sys.stdout.write("%s\n" % gmetric_cmd)
 
 
-def submit_graphite(metrics, options):
-    if (re.match("^[\w\.\-]+\:\d+$", options.graphite_host) == None):
-        raise Exception("Invalid host:port found for Graphite: '%s'" % options.graphite_host)
+# The Graphite client of each --graphite-host, so that logster-listen and
+# logster-aggregate keep their connections open from one interval to the next.
+graphite_clients = {}
 
-    if (not options.dry_run):
-        host = options.graphite_host.split(':')
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        s.connect((host[0], int(host[1])))
+def submit_graphite(metrics, options):
+    client = graphite_clients.get(options.graphite_host)
+    if client is None:
+        client = graphite.GraphiteClient(graphite.parse_destinations(options.graphite_host))
+        graphite_clients[options.graphite_host] = client
 
+    lines = []
     for metric in metrics:
 
         if (options.metric_prefix != ""):
@@ -215,74 +347,352 @@ def submit_graphite(metrics, options):
 
         metric_string = "%s %s %s" % (metric.name, metric.value, metric.timestamp)
         logger.debug("Submitting Graphite metric: %s" % metric_string)
-
-        if (not options.dry_run):
-            s.send("%s\n" % metric_string)
-        else:
-            sys.stdout.write("%s %s\n" % (options.graphite_host,
-                metric_string))
+        lines.append((metric.name, "%s\n" % metric_string))
 
     if (not options.dry_run):
-        s.close()
+        client.send(lines)
+    else:
+        for name, line in lines:
+            sys.stdout.write("%s:%d %s" % (client.addresses[client.ring.get_node(name)] + (line,)))
 
 
-def start_locking(lockfile_name):
-    """ Acquire a lock via a provided lockfile filename. """
-    if os.path.exists(lockfile_name):
-        raise LockingError("Lock file already exists.")
+def close_graphite_clients():
+    """Close the connections to Graphite, once the metrics are sent."""
+    for client in graphite_clients.values():
+        client.close()
+    graphite_clients.clear()
 
-    f = open(lockfile_name, 'w')
 
-    try:
-        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
-        f.write("%s" % os.getpid())
-    except IOError:
-        # Would be better to also check the pid in the lock file and remove the
-        # lock file if that pid no longer exists in the process table.
-        raise LockingError("Cannot acquire logster lock (%s)" % lockfile_name)
+def submit_partial_state(parser, duration, options):
+    """
+    Send what the parser has accumulated, rather than the metrics derived
+    from it, to logster-aggregate to be combined with other hosts.
+    """
+    message = partial_state.dumps({
+        'parser': '%s:%s' % (parser.__class__.__module__, parser.__class__.__name__),
+        'parser_options': options.parser_options,
+        'duration': duration,
+        'timestamp': time(),
+        'host': socket.gethostname(),
+        'state': exclude(parser.get_partial_state(), parser.persistent_state_attributes),
+    })
+    logger.debug("Submitting partial state of %d bytes" % len(message))
 
-    logger.debug("Locking successful")
-    return f
+    if (not options.dry_run):
+        host, port = parse_address(options.aggregate_host)
+        s = socket.create_connection((host, port))
+        try:
+            s.sendall((message + '\n').encode('utf-8'))
+        finally:
+            s.close()
+    else:
+        sys.stdout.write("%s %s\n" % (options.aggregate_host, message))
 
 
-def end_locking(lockfile_fd, lockfile_name):
-    """ Release a lock via a provided file descriptor. """
-    try:
-        fcntl.flock(lockfile_fd, fcntl.LOCK_UN | fcntl.LOCK_NB)
-    except IOError:
-        raise LockingError("Cannot release logster lock (%s)" % lockfile_name)
+def exclude(state, names):
+    """Leave the attributes carried over between runs out of a partial state."""
+    return dict((name, value) for name, value in state.items() if name not in names)
 
-    try:
-        os.unlink(lockfile_name)
-    except OSError:
-        raise LockingError("Cannot unlink %s" % lockfile_name)
 
-    logger.debug("Unlocking successful")
-    return
+def parse_address(address):
+    """Split a host:port string."""
+    if (re.match(r"^[\w\.\-]+\:\d+$", address) == None):
+        raise Exception("Invalid host:port found: '%s'" % address)
+    host, port = address.split(':')
+    return host, int(port)
 
 
 @contextlib.contextmanager
-def lock_context(lockfile_name):
+def lease_context(store, job, ttl):
     """
-    Check for lock file so multiple copies of the same parser aren't run
+    Hold the lease on a job so multiple copies of the same parser aren't run
     simultaneously, as will happen if the log parsing takes more time than the
     cron period, which is likely on the first run if the logfile is huge.
     """
     try:
-        lockfile = start_locking(lockfile_name)
+        store.acquire_lease(job, ttl)
     except LockingError:
-        logger.warning("Failed to get lock. Is another instance of logster running?")
+        e = sys.exc_info()[1]
+        logger.warning("Failed to get lease (%s). Is another instance of logster running?" % e)
         raise SystemExit(1)
+    logger.debug("Lease acquired")
     try:
-        yield lockfile
+        yield
     finally:
-        end_locking(lockfile, lockfile_name)
+        store.release_lease(job)
+        logger.debug("Lease released")
 
-        # try to remove the lockfile one last time, but it's a valid state that it's already been removed.
+
+class Checkpointer(object):
+    """
+    Saves the read position and parser state of a run every so many bytes
+    or seconds, so that a run that is killed while working through a large
+    backlog resumes from there instead of starting over.
+    """
+
+    # Lines parsed between checks, to keep the per-line cost down.
+    check_every = 1024
+
+    def __init__(self, store, job, parser, input, options):
+        self.store = store
+        self.job = job
+        self.parser = parser
+        self.input = input
+        self.options = options
+        self.size = options.checkpoint_size * 1024 * 1024
+        self.interval = options.checkpoint_interval
+        self.last_position = input.position
+        self.last_time = time()
+
+    def due(self):
+        if self.size and self.input.position - self.last_position >= self.size:
+            return True
+        return bool(self.interval) and time() - self.last_time >= self.interval
+
+    def save(self, counts=None):
+        """Save a checkpoint, along with the counts of ParseStats so far."""
+        position, fingerprint = self.input.checkpoint()
+        state = self.parser.get_partial_state()
+        state.update(self.parser.get_persistent_state() or {})
         try:
-            end_locking(lockfile, lockfile_name)
-        except Exception:
-            pass
+            self.store.save_checkpoint(self.job, position, fingerprint,
+                self.options.parser_options, state, counts)
+        except (pickle.PicklingError, TypeError, AttributeError):
+            # A parser holding e.g. a function can't be checkpointed, but
+            # can still run to the end.
+            e = sys.exc_info()[1]
+            logger.warning("Checkpoints disabled for this run, as the state of the parser can't be pickled: %s" % e)
+            self.size = self.interval = 0
+            return
+        # A run that is still making progress keeps its lease.
+        self.store.acquire_lease(self.job, self.options.lease_timeout)
+        self.last_position = self.input.position
+        self.last_time = time()
+        logger.debug("Checkpoint saved at position %s" % position)
+
+
+class ParseStats(object):
+    """
+    Counts the lines of a run that the parser didn't match or failed on,
+    logging only the first few of them, and reports the counts as the
+    logster.lines.matched, .unmatched and .errors metrics, along with those
+    of the ParseCache if there is one.
+    """
+
+    def __init__(self, log_failures):
+        self.log_failures = log_failures
+        self.lines = 0
+        self.parsed = 0
+        self.unmatched = 0
+        self.errors = 0
+        self.cache = None
+
+    # The counts saved with a checkpoint, so that a resumed run reports, and
+    # scales a sample by, the lines of the whole run.
+    count_attributes = ('lines', 'parsed', 'unmatched', 'errors')
+
+    def get_counts(self):
+        return dict((name, getattr(self, name)) for name in self.count_attributes)
+
+    def set_counts(self, counts):
+        for name in self.count_attributes:
+            setattr(self, name, counts.get(name, 0))
+
+    def record(self, result, line, error=None):
+        """Count a line for which parse_line returned result, or raised error."""
+        if result == UNMATCHED:
+            self.unmatched += 1
+            kind = "Unmatched"
+        elif result == PARSE_ERROR:
+            self.errors += 1
+            kind = "Failed to parse"
+        else:
+            return
+        if self.unmatched + self.errors <= self.log_failures:
+            if error is not None:
+                kind = "%s (%s)" % (kind, error)
+            logger.debug("%s line: %r" % (kind, line))
+
+    def get_metrics(self):
+        matched = self.parsed - self.unmatched - self.errors
+        cache_metrics = []
+        if self.cache is not None:
+            cache_metrics = self.cache.get_metrics()
+        if self.parsed == self.lines:
+            return [
+                MetricObject('logster.lines.matched', matched, 'Lines'),
+                MetricObject('logster.lines.unmatched', self.unmatched, 'Lines'),
+                MetricObject('logster.lines.errors', self.errors, 'Lines'),
+            ] + cache_metrics
+
+        # Only a sample of the lines was parsed. The relative standard
+        # error of a count scaled up from n sampled lines at rate p is
+        # sqrt((1 - p) / n); report it for the count of matched lines.
+        rate = self.parsed and float(self.parsed) / self.lines
+        factor = rate and 1 / rate
+        error = sqrt((1 - rate) / max(matched, 1))
+        return [
+            MetricObject('logster.lines.matched', matched * factor, 'Lines'),
+            MetricObject('logster.lines.unmatched', self.unmatched * factor, 'Lines'),
+            MetricObject('logster.lines.errors', self.errors * factor, 'Lines'),
+            MetricObject('logster.sample_rate', rate, 'Lines parsed per line read'),
+            MetricObject('logster.sample_error', error, 'Relative standard error'),
+        ] + cache_metrics
+
+
+class ParseCache(object):
+    """
+    Remembers how the parser classified the last lines it saw, keyed by the
+    rest of the line after cache_prefix, so that a line repeating one seen
+    before but for its timestamp is counted without running the parser's
+    regular expressions again. At most size classifications are kept; the
+    one used least recently is evicted first. Lines the prefix doesn't
+    match, such as the continuation lines of a stack trace, are classified
+    as usual and counted apart as bypassed, so that misses only count the
+    lines the cache could have served.
+    """
+
+    def __init__(self, parser, size, prefix=None):
+        if prefix is None:
+            prefix = parser.cache_prefix
+        if parser.binary and not isinstance(prefix, bytes):
+            prefix = prefix.encode('utf-8')
+        self.prefix = re.compile(prefix)
+        self.size = size
+        self.classify_line = parser.classify_line
+        self.count_line = parser.count_line
+        self.classifications = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bypassed = 0
+
+    def parse_line(self, line):
+        match = self.prefix.match(line)
+        if match is None:
+            self.bypassed += 1
+            return self.count_line(self.classify_line(line))
+        rest = line[match.end():]
+        classifications = self.classifications
+        if rest in classifications:
+            self.hits += 1
+            # Re-inserting moves the line to the most recent end.
+            classification = classifications[rest] = classifications.pop(rest)
+        else:
+            self.misses += 1
+            classification = classifications[rest] = self.classify_line(line)
+            if len(classifications) > self.size:
+                classifications.popitem(last=False)
+                self.evictions += 1
+        return self.count_line(classification)
+
+    def get_metrics(self):
+        return [
+            MetricObject('logster.parse_cache.hits', self.hits, 'Lines'),
+            MetricObject('logster.parse_cache.misses', self.misses, 'Lines'),
+            MetricObject('logster.parse_cache.evictions', self.evictions, 'Lines'),
+            MetricObject('logster.parse_cache.bypassed', self.bypassed, 'Lines'),
+        ]
+
+
+class Sampler(object):
+    """
+    Chooses which lines of a run to parse: one in every 1 / --sample-rate.
+    With --max-lines the share is lowered further whenever there are more
+    lines left to read than are left to parse, estimated from the size of
+    the lines so far, so that the time a run takes stays flat when the log
+    grows faster than it can be parsed.
+    """
+
+    def __init__(self, input, options):
+        self.input = input
+        self.max_lines = options.max_lines
+        self.fixed = max(1, int(round(1 / options.sample_rate)))
+        self.every = self.fixed
+
+    def adjust(self, lines, parsed):
+        """Return how many lines to read per line parsed from now on."""
+        bytes_read = self.input.bytes_read()
+        if self.max_lines and bytes_read:
+            lines_left = self.input.bytes_left() * float(lines) / bytes_read
+            parses_left = max(self.max_lines - parsed, 1)
+            self.every = max(self.fixed, int(ceil(lines_left / parses_left)))
+        return self.every
+
+
+def scale_sample(parser, lines, parsed):
+    """Scale the counts of a parser that parsed a sample of the lines up to
+    estimate those of all lines."""
+    if not parsed:
+        return
+    try:
+        parser.scale_partial_state(float(lines) / parsed)
+    except NotImplementedError:
+        e = sys.exc_info()[1]
+        logger.warning("Sending counts of the sampled lines only: %s" % e)
+
+
+def restore_parser_state(store, job, parser, options):
+    """Restore the state the last run of a job carried over to this one."""
+    try:
+        saved = store.get_parser_state(job)
+    except Exception:
+        e = sys.exc_info()[1]
+        logger.warning("Ignoring unreadable parser state: %s" % e)
+        return
+    if saved is None:
+        return
+    if saved['parser_options'] != options.parser_options:
+        logger.info("Ignoring parser state saved with different parser options")
+        return
+    parser.set_persistent_state(saved['state'])
+
+
+def resume_checkpoint(store, job, parser, options):
+    """
+    Restore the parser state of an unfinished run and return the position
+    and fingerprint to continue reading from, and the counts of ParseStats
+    up to there, or None to start afresh.
+    """
+    try:
+        checkpoint = store.get_checkpoint(job)
+    except Exception:
+        e = sys.exc_info()[1]
+        logger.warning("Ignoring unreadable checkpoint: %s" % e)
+        return None
+    if checkpoint is None:
+        return None
+    if checkpoint['parser_options'] != options.parser_options:
+        logger.info("Ignoring checkpoint taken with different parser options")
+        return None
+    parser.set_partial_state(checkpoint['parser_state'])
+    logger.info("Resuming from checkpoint at position %s" % checkpoint['position'])
+    return checkpoint['position'], checkpoint['fingerprint'], checkpoint['counts']
+
+
+def job_name(class_name, log_file):
+    """ The key a parser/logfile pair is stored under in the state store. """
+    return '%s%s' % (class_name, log_file.replace('/', '-'))
+
+
+def legacy_state(options, job):
+    """
+    Read the offset and last-run time from a logtail state file left behind
+    by an older logster, so upgrading doesn't skip or re-read any lines.
+    """
+    state_file = '%s/logtail-%s.state' % (options.state_dir, job)
+    try:
+        f = open(state_file)
+        try:
+            position = int(f.read().split()[1])
+        finally:
+            f.close()
+        last_run = os.stat(state_file)[stat.ST_MTIME]
+    except (IOError, OSError, IndexError, ValueError):
+        return None
+    logger.info("Importing offset from legacy state file %s" % state_file)
+    return {'position': position, 'fingerprint': None, 'last_run': last_run}
+
 
 def import_module(module_name):
     if 'importlib' not in globals():
@@ -290,18 +700,29 @@ def import_module(module_name):
         return __import__(module_name, fromlist=['__name__'])
     return importlib.import_module(module_name)
 
-def load_parser(class_name, *args, **kwargs):
+def parser_class(class_name):
     """
-    Given a class name, find the parser by that name. Module may be specified
-    if prefixed by ':'. By default, the module will be
+    Given a class name, find the parser class by that name. Module may be
+    specified if prefixed by ':'. By default, the module will be
     'logster.parsers.{class_name}'.
     """
     module, sep, class_name = class_name.rpartition(':')
     module = module or 'logster.parsers.%(class_name)s' % vars()
+    return getattr(import_module(module), class_name)
+
 
-    # Import the module and instantiate the indicated class.
-    module = import_module(module)
-    return getattr(module, class_name)(*args, **kwargs)
+def load_parser(class_name, *args, **kwargs):
+    """
+    Given a class name, find the parser by that name, as parser_class does,
+    and instantiate it.
+    """
+    return parser_class(class_name)(*args, **kwargs)
+
+
+def terminate(signum, frame):
+    """Stop on SIGTERM as on an interrupt, so that the daemons send what
+    they have before exiting."""
+    raise SystemExit(0)
 
 
 def main():
@@ -310,79 +731,114 @@ def main():
     class_name, log_file, options = get_args()
     setup_logging(options)
 
-    dirsafe_logfile = log_file.replace('/','-')
-    logtail_state_file = '%s/logtail-%s%s.state' % (options.state_dir, class_name, dirsafe_logfile)
-    logtail_lock_file = '%s/logtail-%s%s.lock' % (options.state_dir, class_name, dirsafe_logfile)
-    shell_tail = "%s -f %s -o %s" % (options.logtail, log_file, logtail_state_file)
+    job = job_name(class_name, log_file)
+    store_file = os.path.join(options.state_dir, STATE_STORE_NAME)
 
     logger.info("Executing parser %s on logfile %s" % (class_name, log_file))
-    logger.debug("Using state file %s" % logtail_state_file)
+    logger.debug("Using state store %s" % store_file)
 
     parser = load_parser(class_name, option_string=options.parser_options)
+    store = StateStore(store_file)
 
-    with lock_context(logtail_lock_file):
+    with lease_context(store, job, options.lease_timeout):
 
         # Get input to parse.
         try:
 
-            # Read the age of the state file to see how long it's been since we last
-            # ran. Replace the state file if it has gone missing. While we are her,
-            # touch the state file to reset the time in case logtail doesn't
-            # find any new lines (and thus won't update the statefile).
-            try:
-                state_file_age = os.stat(logtail_state_file)[stat.ST_MTIME]
-
-                # Calculate now() - state file age to determine check duration.
-                duration = floor(time()) - floor(state_file_age)
-                logger.debug("Setting duration to %s seconds." % duration)
-
-            except OSError:
-                logger.info('Writing new state file and exiting. (Was either first run, or state file went missing.)')
-                input = os.popen(shell_tail)
-                retval = input.close()
-                if (retval != 256):
-                    logger.warning('%s returned bad exit code %s' % (shell_tail, retval))
+            # The time since the last committed run is the duration the
+            # metrics cover. If the job has no state yet, skip the existing
+            # contents of the log and start counting from now.
+            state = store.get_job(job) or legacy_state(options, job)
+            if state is None:
+                logger.info('Recording new state and exiting. (Was either first run, or state went missing.)')
+                tail = LogTail(log_file)
+                tail.seek_to_end()
+                store.commit_job(job, tail.position, tail.fingerprint, floor(script_start_time))
                 sys.exit(0)
 
-            # Open a pipe to read input from logtail.
-            input = os.popen(shell_tail)
+            # Calculate now() - last run to determine check duration.
+            duration = floor(time()) - floor(state['last_run'])
+            logger.debug("Setting duration to %s seconds." % duration)
+
+            if parser.persistent_state_attributes:
+                restore_parser_state(store, job, parser, options)
+            position, fingerprint, counts = (resume_checkpoint(store, job, parser, options)
+                or (state['position'], state['fingerprint'], {}))
+            input = LogTail(log_file, position, fingerprint, binary=parser.binary)
+            checkpointer = Checkpointer(store, job, parser, input, options)
 
         except Exception:
             e = sys.exc_info()[1]
-            # note - there is no exception when logtail doesn't exist.
-            # I don't know when this exception will ever actually be triggered.
             sys.stdout.write(
-                "Failed to run %s to get log data (line %s): %s\n" %
-                (shell_tail, lineno(), e))
+                "Failed to read %s to get log data (line %s): %s\n" %
+                (log_file, lineno(), e))
             sys.exit(1)
 
         # Parse each line from input, then send all stats to their collectors.
         try:
+            parse_line = parser.parse_line
+            parse_stats = ParseStats(options.log_failures)
+            parse_stats.set_counts(counts)
+            # The lines of a resumed run include those before the checkpoint.
+            lines = resumed_lines = parse_stats.lines
+            parsed = resumed_parsed = parse_stats.parsed
+            if options.parse_cache > 0:
+                if parser.cache_prefix is None:
+                    logger.warning("%s does not support --parse-cache, parsing every line" % class_name)
+                else:
+                    parse_stats.cache = ParseCache(parser, options.parse_cache, options.cache_prefix)
+                    parse_line = parse_stats.cache.parse_line
+            sampler = Sampler(input, options)
+            every = sampler.every
             for line in input:
-                try:
-                    parser.parse_line(line)
-                except LogsterParsingException:
-                    e = sys.exc_info()[1]
-                    # This should only catch recoverable exceptions (of which there
-                    # aren't any at the moment).
-                    logger.debug("Parsing exception caught at %s: %s" % (lineno(), e))
-
-            submit_stats(parser, duration, options)
+                lines += 1
+                if not lines % every:
+                    parsed += 1
+                    try:
+                        result = parse_line(line)
+                        if result is not None:
+                            parse_stats.record(result, line)
+                    except LogsterParsingException:
+                        parse_stats.record(PARSE_ERROR, line, sys.exc_info()[1])
+
+                if not lines % checkpointer.check_every:
+                    if checkpointer.due():
+                        parse_stats.lines, parse_stats.parsed = lines, parsed
+                        checkpointer.save(parse_stats.get_counts())
+                    every = sampler.adjust(lines - resumed_lines, parsed - resumed_parsed)
+
+            parse_stats.lines = lines
+            parse_stats.parsed = parsed
+            if parse_stats.errors:
+                logger.info("Failed to parse %d of %d lines" % (parse_stats.errors, parsed))
+            if parsed < lines:
+                logger.info("Parsed a sample of %d of %d lines" % (parsed, lines))
+                scale_sample(parser, lines, parsed)
+
+            change_filter = None
+            if options.heartbeat > 0:
+                change_filter = ChangeFilter(store, job, options.heartbeat)
+            submit_stats(parser, duration, options, parse_stats, job, change_filter)
 
         except Exception:
             e = sys.exc_info()[1]
             sys.stdout.write("Exception caught at %s: %s\n" % (lineno(), e))
             traceback.print_exc()
             sys.exit(1)
+        finally:
+            close_graphite_clients()
+
+        # Only now that the metrics are sent is the offset moved forward, so a
+        # failed submission is retried with the same lines on the next run.
+        # The run is recorded at the startup time of the script so that the
+        # cron interval is not thrown off by parsing a large number of log
+        # entries.
+        store.commit_job(job, input.position, input.fingerprint, floor(script_start_time),
+            options.parser_options, parser.get_persistent_state())
 
         # Log the execution time
         exec_time = round(time() - script_start_time, 1)
         logger.info("Total execution time: %s seconds." % exec_time)
 
-        # Set mtime and atime for the state file to the startup time of the script
-        # so that the cron interval is not thrown off by parsing a large number of
-        # log entries.
-        os.utime(logtail_state_file, (floor(script_start_time), floor(script_start_time)))
-
 if __name__ == '__main__':
     main()
@@ -0,0 +1,231 @@
+###
+###  A single SQLite database in the state directory holds the read offset,
+###  file fingerprint, last-run timestamp and lock lease of every
+###  parser/logfile job, replacing the per-job logtail state and lock files,
+###  along with checkpoints of unfinished runs, the state parsers carry
+###  over from one run to the next and the last value sent of each metric.
+###
+###
+###  Copyright 2011, Etsy, Inc.
+###
+###  This file is part of Logster.
+###
+###  Logster is free software: you can redistribute it and/or modify
+###  it under the terms of the GNU General Public License as published by
+###  the Free Software Foundation, either version 3 of the License, or
+###  (at your option) any later version.
+###
+###  Logster is distributed in the hope that it will be useful,
+###  but WITHOUT ANY WARRANTY; without even the implied warranty of
+###  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+###  GNU General Public License for more details.
+###
+###  You should have received a copy of the GNU General Public License
+###  along with Logster. If not, see <http://www.gnu.org/licenses/>.
+###
+
+from __future__ import with_statement
+
+import os
+import sys
+import errno
+import socket
+import pickle
+import sqlite3
+import contextlib
+
+from time import time
+
+from logster.logster_helper import LockingError
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    fingerprint TEXT,
+    last_run REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS leases (
+    job TEXT PRIMARY KEY,
+    host TEXT NOT NULL,
+    pid INTEGER NOT NULL,
+    expires REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS checkpoints (
+    job TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    fingerprint TEXT,
+    parser_options TEXT,
+    parser_state BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS parser_states (
+    job TEXT PRIMARY KEY,
+    parser_options TEXT,
+    state BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sent_values (
+    job TEXT NOT NULL,
+    name TEXT NOT NULL,
+    value TEXT,
+    sent REAL NOT NULL,
+    PRIMARY KEY (job, name)
+);
+"""
+
+
+def pid_exists(pid):
+    """Return True if a process with the given pid is running on this host."""
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        e = sys.exc_info()[1]
+        return e.errno == errno.EPERM
+    return True
+
+
+class StateStore(object):
+    """Transactional store of the state of all logster jobs."""
+
+    def __init__(self, path, timeout=30):
+        self.path = path
+        self.host = socket.gethostname()
+        self.pid = os.getpid()
+        # Autocommit mode; transactions are opened explicitly so that the
+        # read-check-write of a lease happens under a single write lock.
+        self.db = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Run the enclosed statements in one write transaction."""
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            yield self.db
+        except:
+            self.db.execute('ROLLBACK')
+            raise
+        self.db.execute('COMMIT')
+
+    def get_job(self, job):
+        """
+        Return a dict with the committed 'position', 'fingerprint' and
+        'last_run' of a job, or None if the job has never been committed.
+        """
+        row = self.db.execute(
+            'SELECT position, fingerprint, last_run FROM jobs WHERE job = ?',
+            (job,)).fetchone()
+        if row is None:
+            return None
+        return {'position': row[0], 'fingerprint': row[1], 'last_run': row[2]}
+
+    def commit_job(self, job, position, fingerprint, last_run, parser_options=None, parser_state=None):
+        """
+        Record how far a job has read, once its metrics have been sent. Any
+        checkpoint taken during the run is dropped. If given, the picklable
+        state the parser carries over to the next run is saved along with
+        the position it was reached at.
+        """
+        with self.transaction() as db:
+            db.execute(
+                'INSERT OR REPLACE INTO jobs (job, position, fingerprint, last_run) '
+                'VALUES (?, ?, ?, ?)', (job, position, fingerprint, last_run))
+            db.execute('DELETE FROM checkpoints WHERE job = ?', (job,))
+            if parser_state is not None:
+                db.execute(
+                    'INSERT OR REPLACE INTO parser_states (job, parser_options, state) '
+                    'VALUES (?, ?, ?)',
+                    (job, parser_options, sqlite3.Binary(pickle.dumps(parser_state, 2))))
+
+    def get_parser_state(self, job):
+        """
+        Return a dict with the 'parser_options' and unpickled 'state' that the
+        last committed run of a job carried over, or None.
+        """
+        row = self.db.execute(
+            'SELECT parser_options, state FROM parser_states WHERE job = ?',
+            (job,)).fetchone()
+        if row is None:
+            return None
+        return {'parser_options': row[0], 'state': pickle.loads(bytes(row[1]))}
+
+    def save_checkpoint(self, job, position, fingerprint, parser_options, parser_state, counts=None):
+        """
+        Record the progress of a run that hasn't finished yet: the position
+        in the file with the given fingerprint, the picklable state the
+        parser had accumulated up to that position, and a dict of the counts
+        of lines read and parsed so far.
+        """
+        blob = sqlite3.Binary(pickle.dumps((parser_state, counts or {}), 2))
+        with self.transaction() as db:
+            db.execute(
+                'INSERT OR REPLACE INTO checkpoints '
+                '(job, position, fingerprint, parser_options, parser_state) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (job, position, fingerprint, parser_options, blob))
+
+    def get_checkpoint(self, job):
+        """
+        Return a dict with the 'position', 'fingerprint', 'parser_options',
+        unpickled 'parser_state' and 'counts' of an unfinished run, or None.
+        """
+        row = self.db.execute(
+            'SELECT position, fingerprint, parser_options, parser_state '
+            'FROM checkpoints WHERE job = ?', (job,)).fetchone()
+        if row is None:
+            return None
+        saved = pickle.loads(bytes(row[3]))
+        # Checkpoints taken by earlier versions hold the parser state only.
+        if isinstance(saved, tuple):
+            parser_state, counts = saved
+        else:
+            parser_state, counts = saved, {}
+        return {'position': row[0], 'fingerprint': row[1],
+            'parser_options': row[2], 'parser_state': parser_state, 'counts': counts}
+
+    def get_sent_values(self, job):
+        """
+        Return {name: (value, sent)} with the value last sent of each metric
+        of a job and when it was sent.
+        """
+        rows = self.db.execute('SELECT name, value, sent FROM sent_values WHERE job = ?', (job,))
+        return dict((name, (value, sent)) for name, value, sent in rows)
+
+    def save_sent_values(self, job, values, expired):
+        """
+        Record the (name, value, sent) of each metric sent, and forget the
+        metrics of the job not sent since expired.
+        """
+        with self.transaction() as db:
+            db.executemany(
+                'INSERT OR REPLACE INTO sent_values (job, name, value, sent) '
+                'VALUES (?, ?, ?, ?)', [(job, name, value, sent) for name, value, sent in values])
+            db.execute('DELETE FROM sent_values WHERE job = ? AND sent < ?', (job, expired))
+
+    def acquire_lease(self, job, ttl):
+        """
+        Take the lease on a job for ttl seconds. A lease held by another
+        process is only taken over once it has expired, or if its holder ran
+        on this host and is no longer alive.
+        """
+        now = time()
+        with self.transaction() as db:
+            row = db.execute('SELECT host, pid, expires FROM leases WHERE job = ?',
+                (job,)).fetchone()
+            if row is not None:
+                host, pid, expires = row
+                held_by_us = (host, pid) == (self.host, self.pid)
+                stale = expires < now or (host == self.host and not pid_exists(pid))
+                if not held_by_us and not stale:
+                    raise LockingError("Lease on %s is held by pid %s on %s" % (job, pid, host))
+            db.execute(
+                'INSERT OR REPLACE INTO leases (job, host, pid, expires) '
+                'VALUES (?, ?, ?, ?)', (job, self.host, self.pid, now + ttl))
+
+    def release_lease(self, job):
+        """Give up the lease on a job, if this process holds it."""
+        with self.transaction() as db:
+            db.execute('DELETE FROM leases WHERE job = ? AND host = ? AND pid = ?',
+                (job, self.host, self.pid))
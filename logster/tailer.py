@@ -0,0 +1,150 @@
+###
+###  Reads the lines appended to a log file since the last committed offset.
+###  Rotation is detected with a fingerprint of the first bytes of the file,
+###  in which case the unread remainder of the rotated file is read first.
+###
+###
+###  Copyright 2011, Etsy, Inc.
+###
+###  This file is part of Logster.
+###
+###  Logster is free software: you can redistribute it and/or modify
+###  it under the terms of the GNU General Public License as published by
+###  the Free Software Foundation, either version 3 of the License, or
+###  (at your option) any later version.
+###
+###  Logster is distributed in the hope that it will be useful,
+###  but WITHOUT ANY WARRANTY; without even the implied warranty of
+###  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+###  GNU General Public License for more details.
+###
+###  You should have received a copy of the GNU General Public License
+###  along with Logster. If not, see <http://www.gnu.org/licenses/>.
+###
+
+import os
+import hashlib
+
+# Number of leading bytes of a log file used to recognise it after rotation.
+FINGERPRINT_SIZE = 1024
+
+# Suffixes tried, in order, when looking for the file a log was rotated to.
+ROTATED_SUFFIXES = ('.1', '.0')
+
+
+def file_fingerprint(path, size=FINGERPRINT_SIZE):
+    """
+    Return a fingerprint of the first bytes of a file, as '<length>:<sha1>'.
+    Files shorter than size are fingerprinted over their whole content.
+    """
+    f = open(path, 'rb')
+    try:
+        head = f.read(size)
+    finally:
+        f.close()
+    return '%d:%s' % (len(head), hashlib.sha1(head).hexdigest())
+
+
+def matches_fingerprint(path, fingerprint):
+    """Check whether path is the file a fingerprint was taken from."""
+    if fingerprint is None:
+        return True
+    length = int(fingerprint.split(':', 1)[0])
+    try:
+        return file_fingerprint(path, length) == fingerprint
+    except IOError:
+        return False
+
+
+class LogTail(object):
+    """
+    Iterate over the complete lines written to a log file after position.
+    A trailing line without a newline is left for the next run. After
+    iterating, position and fingerprint describe where the next run should
+    start. Lines are decoded as UTF-8 unless binary is set, in which case
+    they are yielded as the bytes read.
+    """
+
+    def __init__(self, path, position=0, fingerprint=None, binary=False):
+        self.path = path
+        self.position = position
+        self.fingerprint = fingerprint
+        self.reading = path
+        self.start = position
+        self.finished = 0
+        if binary:
+            self.decode = lambda line: line
+        else:
+            self.decode = decode
+
+    def seek_to_end(self):
+        """Skip everything currently in the log."""
+        self.position = os.path.getsize(self.path)
+        self.fingerprint = file_fingerprint(self.path)
+
+    def rotated_file(self):
+        """Return the file the log was rotated to, if it can be found."""
+        for suffix in ROTATED_SUFFIXES:
+            candidate = self.path + suffix
+            if os.path.exists(candidate) and matches_fingerprint(candidate, self.fingerprint):
+                return candidate
+        return None
+
+    def read_lines(self, path, position):
+        """Yield complete lines of path from position, tracking self.position."""
+        f = open(path, 'rb')
+        try:
+            f.seek(position)
+            self.reading = path
+            self.position = self.start = position
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                self.position += len(line)
+                yield line
+        finally:
+            f.close()
+            self.finished += self.position - position
+            self.start = self.position
+
+    def __iter__(self):
+        size = os.path.getsize(self.path)
+        if matches_fingerprint(self.path, self.fingerprint) and size >= self.position:
+            lines = self.read_lines(self.path, self.position)
+        else:
+            rotated = self.rotated_file()
+            if rotated is not None:
+                for line in self.read_lines(rotated, self.position):
+                    yield self.decode(line)
+            lines = self.read_lines(self.path, 0)
+
+        decode = self.decode
+        for line in lines:
+            yield decode(line)
+        self.fingerprint = file_fingerprint(self.path)
+
+    def bytes_read(self):
+        """Return the number of bytes read so far, in all files."""
+        return self.finished + self.position - self.start
+
+    def bytes_left(self):
+        """Return the number of bytes there are still to read."""
+        left = os.path.getsize(self.reading) - self.position
+        if self.reading != self.path:
+            left += os.path.getsize(self.path)
+        return max(left, 0)
+
+    def checkpoint(self):
+        """
+        Return the position and fingerprint to resume from after the last
+        line yielded, which may still be in the rotated file.
+        """
+        return self.position, file_fingerprint(self.reading)
+
+
+if str is bytes:
+    def decode(line):
+        return line
+else:
+    def decode(line):
+        return line.decode('utf-8', 'replace')
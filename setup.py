@@ -18,7 +18,9 @@ setup(
     ],
     zip_safe=False,
     scripts=[
-        'bin/logster'
+        'bin/logster',
+        'bin/logster-aggregate',
+        'bin/logster-listen'
     ],
     license='GPL3',
 )
@@ -0,0 +1,84 @@
+import optparse
+import threading
+from time import time, sleep
+import unittest
+
+import logster.run
+from logster.aggregate import Aggregator, AggregateServer
+from logster.parsers.ErrorLogLogster import ErrorLogLogster
+from logster.parsers.MetricLogster import MetricLogster
+
+
+class TestAggregate(unittest.TestCase):
+
+    def setUp(self):
+        self.submitted = []
+        self.aggregator = Aggregator(60, 0, lambda metrics, job: self.submitted.append(metrics))
+        self.server = AggregateServer(('127.0.0.1', 0), self.aggregator)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def send(self, parser, duration, parser_options=None):
+        options = optparse.Values({'parser_options': parser_options, 'dry_run': False, 'output': ['aggregate'],
+            'aggregate_host': '127.0.0.1:%d' % self.server.server_address[1]})
+        logster.run.submit_stats(parser, duration, options)
+
+    def wait_for(self, hosts):
+        for i in range(100):
+            groups = list(self.aggregator.groups.values())
+            if groups and len(groups[0]['hosts']) and groups[0]['parser'].error == hosts:
+                return
+            sleep(0.02)
+        self.fail("Partial states were not received")
+
+    def test_merges_hosts(self):
+        for errors in (1, 3):
+            parser = ErrorLogLogster()
+            for i in range(errors):
+                parser.parse_line(b'[Wed Oct 11 14:32:52 2000] [error] oops\n')
+            self.send(parser, 10)
+        self.wait_for(4)
+
+        self.aggregator.flush(time())
+        self.assertEqual(self.submitted, [])
+        self.aggregator.flush(time() + 120)
+        metrics = dict((m.name, m.value) for m in self.submitted[0])
+        self.assertEqual(metrics['error'], 4)
+        self.assertEqual(self.aggregator.groups, {})
+
+    def test_parser_not_allowed(self):
+        message = {'parser': 'os:system', 'parser_options': None, 'timestamp': 0,
+            'duration': 60, 'state': {}}
+        self.assertRaises(ValueError, self.aggregator.add, message)
+
+    def test_not_a_parser(self):
+        """
+        Only parser classes are loaded, even from the bundled package
+        """
+        message = {'parser': 'logster.parsers.stats_helper:TopK', 'parser_options': None,
+            'timestamp': 0, 'duration': 60, 'state': {}}
+        self.assertRaises(ValueError, self.aggregator.add, message)
+        aggregator = Aggregator(60, 0, None, parsers=['logster.parsers.stats_helper:TopK'])
+        self.assertRaises(ValueError, aggregator.add, message)
+        self.assertEqual(aggregator.groups, {})
+
+    def test_invalid_parser_options(self):
+        """
+        A message with parser options the parser rejects is dropped, and the
+        server goes on receiving
+        """
+        for parser_options in ('-h', '--no-such-option'):
+            message = {'parser': 'logster.parsers.MetricLogster:MetricLogster',
+                'parser_options': parser_options, 'timestamp': 0, 'duration': 60, 'state': {}}
+            self.assertRaises(ValueError, self.aggregator.add, message)
+        self.send(MetricLogster(), 10, '--no-such-option')
+        parser = ErrorLogLogster()
+        parser.parse_line(b'[Wed Oct 11 14:32:52 2000] [error] oops\n')
+        self.send(parser, 10)
+        self.wait_for(1)
+        self.assertEqual(len(self.aggregator.groups), 1)
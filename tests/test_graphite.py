@@ -0,0 +1,120 @@
+import socket
+import optparse
+import unittest
+
+import logster.run
+from logster import graphite
+from logster.logster_helper import MetricObject
+
+
+class TestConsistentHashRing(unittest.TestCase):
+
+    nodes = [('127.0.0.1', 'cache0'), ('127.0.0.1', 'cache1'), ('127.0.0.1', 'cache2')]
+
+    def test_ring_position(self):
+        """
+        Positions are those of carbon's ring
+        """
+        ring = graphite.ConsistentHashRing(self.nodes)
+        self.assertEqual(ring.compute_ring_position('hosts.worker1.cpu'), 64833)
+        self.assertEqual(ring.compute_ring_position('hosts.worker2.cpu'), 38509)
+        self.assertEqual(len(ring.ring), 300)
+        self.assertEqual(len(set([position for position, node in ring.ring])), 300)
+
+    def test_get_nodes(self):
+        ring = graphite.ConsistentHashRing(self.nodes)
+        counts = dict((node, 0) for node in self.nodes)
+        for i in range(3000):
+            name = 'hosts.worker%d.cpu' % i
+            nodes = list(ring.get_nodes(name))
+            self.assertEqual(sorted(nodes), self.nodes)
+            self.assertEqual(nodes[0], ring.get_node(name))
+            counts[nodes[0]] += 1
+        for count in counts.values():
+            self.assertTrue(600 < count < 1400, counts)
+
+    def test_parse_destinations(self):
+        self.assertEqual(graphite.parse_destinations('graphite.example.com:2003'),
+            [('graphite.example.com', 2003, None)])
+        self.assertEqual(graphite.parse_destinations('a:2003, b:2103:cache1'),
+            [('a', 2003, None), ('b', 2103, 'cache1')])
+        self.assertRaises(ValueError, graphite.parse_destinations, 'graphite.example.com')
+        self.assertRaises(ValueError, graphite.parse_destinations, 'a:2003,a:2103')
+
+
+class TestGraphiteClient(unittest.TestCase):
+
+    def setUp(self):
+        self.servers = []
+        for i in range(2):
+            server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            server.bind(('127.0.0.1', 0))
+            server.listen(5)
+            server.settimeout(5)
+            self.servers.append(server)
+
+    def tearDown(self):
+        for server in self.servers:
+            server.close()
+
+    def received(self, server):
+        connection = server.accept()[0]
+        data = b''
+        while True:
+            chunk = connection.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+        connection.close()
+        return data.decode('utf-8').splitlines()
+
+    def metrics(self, count):
+        return [('metric%d' % i, 'metric%d %d 1700000000\n' % (i, i)) for i in range(count)]
+
+    def test_send(self):
+        destinations = [('127.0.0.1', server.getsockname()[1], 'cache%d' % i)
+            for i, server in enumerate(self.servers)]
+        client = graphite.GraphiteClient(destinations)
+        client.send(self.metrics(50))
+        client.send(self.metrics(50))
+        self.assertEqual(len(client.connections), 2)
+        client.close()
+        for i, server in enumerate(self.servers):
+            lines = self.received(server)
+            self.assertTrue(lines)
+            for line in lines:
+                name = line.split()[0]
+                self.assertEqual(client.ring.get_node(name), ('127.0.0.1', 'cache%d' % i))
+            self.assertEqual(len(lines) % 2, 0)
+
+    def test_failover(self):
+        """
+        The metrics of a destination that is down go to the next one on the ring
+        """
+        port = self.servers[1].getsockname()[1]
+        self.servers[1].close()
+        client = graphite.GraphiteClient([('127.0.0.1', self.servers[0].getsockname()[1], 'cache0'),
+            ('127.0.0.1', port, 'cache1')])
+        client.send(self.metrics(50))
+        client.close()
+        self.assertEqual(len(self.received(self.servers[0])), 50)
+
+    def test_all_down(self):
+        port = self.servers[0].getsockname()[1]
+        self.servers[0].close()
+        client = graphite.GraphiteClient([('127.0.0.1', port, None)])
+        self.assertRaises(IOError, client.send, self.metrics(1))
+
+    def test_submit_graphite(self):
+        """
+        The connections of submit_graphite are kept until closed, which
+        sends what was written
+        """
+        options = optparse.Values({'graphite_host': '127.0.0.1:%d' % self.servers[0].getsockname()[1],
+            'metric_prefix': '', 'metric_suffix': None, 'dry_run': False})
+        logster.run.submit_graphite([MetricObject('a', 1, timestamp=1700000000)], options)
+        logster.run.submit_graphite([MetricObject('b', 2, timestamp=1700000000)], options)
+        self.assertEqual(len(logster.run.graphite_clients), 1)
+        logster.run.close_graphite_clients()
+        self.assertEqual(logster.run.graphite_clients, {})
+        self.assertEqual(self.received(self.servers[0]), ['a 1 1700000000', 'b 2 1700000000'])
@@ -0,0 +1,159 @@
+import os
+import sys
+import shutil
+import signal
+import socket
+import subprocess
+import optparse
+import tempfile
+import unittest
+
+from time import sleep
+
+from logster.listen import Listener, StreamSource, syslog_line, flush
+from logster.parsers.PostfixLogster import PostfixLogster
+from logster.run import ParseStats
+
+
+class TestListener(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'logster.sock')
+        self.listener = Listener(['udp://127.0.0.1:0', 'tcp://127.0.0.1:0', 'unix://' + self.path],
+            buffer_size=1024, batch_size=2)
+        self.senders = []
+
+    def tearDown(self):
+        for sender in self.senders:
+            sender.close()
+        self.listener.close()
+        shutil.rmtree(self.directory)
+
+    def sender(self, family, type):
+        sender = socket.socket(family, type)
+        self.senders.append(sender)
+        return sender
+
+    def receive(self, count):
+        messages = []
+        for i in range(50):
+            messages += self.listener.receive(0.1)
+            if len(messages) >= count:
+                break
+        return messages
+
+    def test_datagrams(self):
+        udp = self.sender(socket.AF_INET, socket.SOCK_DGRAM)
+        address = self.listener.sources[0].sock.getsockname()
+        for i in range(3):
+            udp.sendto(b'<13>udp ' + str(i).encode('ascii'), address)
+        unix = self.sender(socket.AF_UNIX, socket.SOCK_DGRAM)
+        unix.sendto(b'<13>unix', self.path)
+        self.assertEqual(sorted(self.receive(4)), [b'<13>udp 0', b'<13>udp 1', b'<13>udp 2', b'<13>unix'])
+
+    def test_stream(self):
+        tcp = self.sender(socket.AF_INET, socket.SOCK_STREAM)
+        tcp.connect(self.listener.servers[0].getsockname())
+        tcp.sendall(b'<13>one\n<13>two\n9 <13>three13 <13>four\nfour')
+        self.assertEqual(self.receive(4), [b'<13>one', b'<13>two', b'<13>three', b'<13>four\nfour'])
+        tcp.close()
+        for i in range(50):
+            if len(self.listener.sources) == 2:
+                break
+            self.listener.receive(0.1)
+        self.assertEqual(len(self.listener.sources), 2)
+
+
+class TestListen(unittest.TestCase):
+
+    def test_unix_path(self):
+        """
+        A socket left at the --listen path is replaced, but no other file
+        """
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'logster.sock')
+            stale = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            stale.bind(path)
+            stale.close()
+            Listener(['unix://' + path]).close()
+
+            path = os.path.join(directory, 'logster.conf')
+            open(path, 'w').close()
+            self.assertRaises(socket.error, Listener, ['unix://' + path])
+            self.assertTrue(os.path.isfile(path))
+        finally:
+            shutil.rmtree(directory)
+
+    def run_listen(self, parser, messages):
+        """Run logster-listen with the parser, send it the messages and stop
+        it with SIGTERM, returning its exit status and output."""
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'logster.sock')
+        env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        process = subprocess.Popen([sys.executable, '-m', 'logster.listen', '--listen', 'unix://' + path,
+            '--interval', '600', '--output', 'stdout', '--log', 'stderr', parser],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
+        try:
+            self.assertTrue(b'Listening' in process.stderr.readline())
+            sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            for message in messages:
+                sender.sendto(message, path)
+            sender.close()
+            # Give the messages time to be parsed before it is stopped.
+            sleep(0.2)
+            process.send_signal(signal.SIGTERM)
+            output = process.communicate()[0]
+        finally:
+            if process.returncode is None:
+                process.kill()
+            shutil.rmtree(directory)
+        return process.returncode, output
+
+    def test_terminate(self):
+        """
+        The metrics of the interval so far are sent on SIGTERM
+        """
+        status, output = self.run_listen('ErrorLogLogster', [b'<11>[Wed Oct 11 14:32:52 2000] [error] oops'])
+        self.assertEqual(status, 0)
+        self.assertTrue(b'logster.lines.matched 1' in output, output)
+
+    def test_parser_exception(self):
+        """
+        A message the parser raises an exception on is counted as an error,
+        and the messages after it are still parsed
+        """
+        status, output = self.run_listen('MetricLogster', [b'<14>METRIC_COUNT metric=a value=1.2.3',
+            b'<14>METRIC_COUNT metric=b value=2'])
+        self.assertEqual(status, 0)
+        self.assertTrue(b'logster.lines.errors 1' in output, output)
+        self.assertTrue(b'logster.lines.matched 1' in output, output)
+
+    def test_partial_frames(self):
+        """
+        Messages split across reads are put together
+        """
+        source = StreamSource(None, 1024)
+        source.pending += b'<13>on'
+        self.assertEqual(source.frames(), [])
+        source.pending += b'e\n8 <13>tw'
+        self.assertEqual(source.frames(), [b'<13>one'])
+        source.pending += b'o\n\n'
+        self.assertEqual(source.frames(), [b'<13>two\n'])
+
+    def test_syslog_line(self):
+        self.assertEqual(syslog_line(b'<13>Oct 11 22:14:15 host app: hello'),
+            b'Oct 11 22:14:15 host app: hello\n')
+        self.assertEqual(syslog_line(b'hello\n'), b'hello\n')
+
+    def test_flush(self):
+        """
+        A new parser is used for each interval, with the persistent state
+        """
+        options = optparse.Values({'parser_options': '--track-messages', 'output': []})
+        parser = PostfixLogster(options.parser_options)
+        parser.parse_line('Oct 11 22:14:15 mail postfix/cleanup[123]: 3F8A81B2C4: message-id=<x@example.com>\n')
+        new_parser = flush('PostfixLogster', parser, ParseStats(0), 60, options, 'job')
+        self.assertTrue(new_parser is not parser)
+        self.assertEqual(list(new_parser.messages), ['3F8A81B2C4'])
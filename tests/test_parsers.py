@@ -0,0 +1,453 @@
+import json
+import unittest
+
+from logster.parsers import JsonLogster as json_logster
+from logster.parsers.ErrorLogLogster import ErrorLogLogster
+from logster.parsers.JsonLogster import JsonLogster
+from logster.parsers.Log4jLogster import Log4jLogster
+from logster.parsers.MetricLogster import MetricLogster
+from logster.parsers.PostfixLogster import PostfixLogster
+from logster.parsers.SampleLogster import SampleLogster
+from logster.parsers.SquidLogster import SquidLogster
+from logster.parsers.access_log_helper import LogFormat
+from logster.logster_helper import UNMATCHED, PARSE_ERROR
+
+
+class TestErrorLogLogster(unittest.TestCase):
+
+    def test_levels(self):
+        parser = ErrorLogLogster()
+        parser.parse_line(b'[Wed Oct 11 14:32:52 2000] [error] [client 127.0.0.1] oops\n')
+        parser.parse_line(b'[Wed Oct 11 14:32:53 2000] [warn] caf\xe9\n')
+        parser.parse_line(b'[Wed Oct 11 14:32:54 2000] [debug] x\n')
+        self.assertEqual(parser.parse_line(b'not an error log line\n'), UNMATCHED)
+        metrics = dict((m.name, m.value) for m in parser.get_state(10))
+        self.assertEqual(metrics['error'], 1)
+        self.assertEqual(metrics['warn'], 1)
+        self.assertEqual(metrics['other'], 1)
+
+
+class TestLog4jLogster(unittest.TestCase):
+
+    trace = [
+        '2011-10-11_14:32:52.123 ERROR [main] Request failed\n',
+        'java.lang.IllegalStateException: not ready\n',
+        '\tat com.example.Server.handle(Server.java:42)\n',
+        'Caused by: java.io.IOException: Broken pipe\n',
+        '\tat java.net.SocketOutputStream.write(SocketOutputStream.java:153)\n',
+        '\t... 12 more\n',
+        '2011-10-11_14:32:53.001 INFO [main] Retrying\n',
+        '2011-10-11_14:32:54.001 WARN [main] Slow\n',
+    ]
+
+    def test_levels(self):
+        parser = Log4jLogster()
+        results = [parser.parse_line(line) for line in self.trace]
+        self.assertEqual(results.count(UNMATCHED), 6)
+        metrics = dict((m.name, m.value) for m in parser.get_state(2))
+        self.assertEqual(metrics, {'WARN': 0.5, 'ERROR': 0.5, 'FATAL': 0})
+
+    def test_exceptions(self):
+        parser = Log4jLogster('--exceptions 2')
+        for line in self.trace * 2:
+            parser.parse_line(line)
+        parser.parse_line('javax.servlet.ServletException\n')
+        metrics = dict((m.name, m.value) for m in parser.get_state(1))
+        self.assertEqual(metrics['causes.java_io_IOException'], 2)
+        self.assertEqual(metrics['exceptions.javax_servlet_ServletException'], 1)
+        # The least recently seen class made room for the last one.
+        self.assertFalse('exceptions.java_lang_IllegalStateException' in metrics)
+        self.assertEqual(metrics['logster.exception_classes_dropped'], 1)
+
+
+class TestMetricLogster(unittest.TestCase):
+
+    def metrics(self, parser, duration=1):
+        return dict((m.name, m.value) for m in parser.get_state(duration))
+
+    def test_counts_and_times(self):
+        parser = MetricLogster('--percentiles 50')
+        parser.parse_line('METRIC_COUNT metric=hits value=2\n')
+        parser.parse_line('METRIC_COUNT metric=hits value=1\n')
+        parser.parse_line('METRIC_TIME metric=load value=10ms\n')
+        parser.parse_line('METRIC_TIME metric=load value=20ms\n')
+        metrics = self.metrics(parser)
+        self.assertEqual(metrics['hits'], 3)
+        self.assertEqual(metrics['load.mean'], 15)
+        self.assertEqual(metrics['load.50th_percentile'], 15)
+        self.assertFalse('logster.metric_names_dropped' in metrics)
+
+    def test_histogram(self):
+        parser = MetricLogster('--histogram --percentiles 90')
+        for value in range(1, 101):
+            parser.parse_line('METRIC_TIME metric=load value=%dms\n' % value)
+        metrics = self.metrics(parser)
+        self.assertEqual(metrics['load.mean'], 50.5)
+        self.assertAlmostEqual(metrics['load.90th_percentile'], 90, delta=2)
+
+    def test_persistent_state(self):
+        """
+        Parser state is only carried over between runs with --windows
+        """
+        self.assertEqual(MetricLogster().get_persistent_state(), None)
+        self.assertEqual(JsonLogster('--timer t').get_persistent_state(), None)
+        self.assertEqual(MetricLogster('--windows 5m').get_persistent_state(), {'windows': {}})
+
+    def test_windows(self):
+        """
+        Percentiles over a window cover the values of earlier runs too
+        """
+        first = MetricLogster('--windows 5m,1h')
+        first.parse_line('METRIC_TIME metric=load value=10ms\n')
+        metrics = dict((m.name, m.value) for m in first.window_metrics(1000))
+        self.assertEqual(metrics['load.5m.mean'], 10)
+
+        second = MetricLogster('--windows 5m,1h')
+        second.set_persistent_state(first.get_persistent_state())
+        second.parse_line('METRIC_TIME metric=load value=30ms\n')
+        metrics = dict((m.name, m.value) for m in second.window_metrics(1400))
+        self.assertEqual(metrics['load.5m.mean'], 30)
+        self.assertEqual(metrics['load.1h.mean'], 20)
+        self.assertAlmostEqual(metrics['load.1h.median'], 10, delta=0.5)
+
+        # A time no longer logged is dropped once out of every window.
+        third = MetricLogster('--windows 5m,1h')
+        third.set_persistent_state(second.get_persistent_state())
+        self.assertEqual(third.window_metrics(1400 + 3600), [])
+        self.assertEqual(third.windows, {})
+
+    def test_max_metrics(self):
+        """
+        Names beyond the cap are folded into 'other'
+        """
+        parser = MetricLogster('--max-metrics 2')
+        for i in range(10):
+            parser.parse_line('METRIC_COUNT metric=hits value=1\n')
+            parser.parse_line('METRIC_COUNT metric=hits value=1\n')
+            parser.parse_line('METRIC_COUNT metric=request.%d value=1\n' % i)
+        parser.parse_line('METRIC_TIME metric=load value=10ms\n')
+        metrics = self.metrics(parser)
+        self.assertEqual(metrics['hits'], 20)
+        self.assertEqual(metrics['other'], 10)
+        self.assertEqual(metrics['load.mean'], 10)
+        self.assertEqual(metrics['logster.metric_names_dropped'], 10)
+
+
+class TestJsonLogster(unittest.TestCase):
+
+    lines = [
+        b'{"status": 200, "method": "GET", "bytes": 100, "upstream": {"latency": 10}}\n',
+        b'{"status": 200, "method": "POST", "bytes": "300", "upstream": {"latency": 30}}\n',
+        b'Oct 11 22:14:15 gw api: {"status": 503, "method": "GET", "upstream": {"latency": 50}}\n',
+        b'{"status": 200, "path": "/health", "bytes": 1}\n',
+    ]
+
+    def metrics(self, parser):
+        for line in self.lines:
+            parser.parse_line(line)
+        return dict((m.name, m.value) for m in parser.get_state(1))
+
+    def test_fields(self):
+        parser = JsonLogster('--counter bytes --timer upstream.latency:ms --dimension status --percentiles 50 --skip /health')
+        metrics = self.metrics(parser)
+        self.assertEqual(metrics['lines'], 3)
+        self.assertEqual(metrics['lines.status.200'], 2)
+        self.assertEqual(metrics['lines.status.503'], 1)
+        self.assertEqual(metrics['bytes'], 400)
+        self.assertEqual(metrics['bytes.status.200'], 400)
+        self.assertFalse('bytes.status.503' in metrics)
+        self.assertEqual(metrics['upstream.latency.mean'], 30)
+        self.assertEqual(metrics['upstream.latency.status.200.median'], 20)
+        self.assertEqual(metrics['upstream.latency.status.503.median'], 50)
+        self.assertEqual(parser.times['upstream.latency']['unit'], 'ms')
+
+    def test_require(self):
+        parser = JsonLogster('--require \'"method": "GET"\' --lines-name requests --dimension method')
+        self.assertEqual(parser.parse_line(self.lines[1]), UNMATCHED)
+        metrics = self.metrics(parser)
+        self.assertEqual(metrics, {'requests': 2, 'requests.method.GET': 2})
+
+    def test_paths(self):
+        parser = JsonLogster('--timer backends.1.latency,backends.5.latency')
+        parser.parse_line(b'{"backends": [{"latency": 1}, {"latency": 2}]}\n')
+        parser.parse_line(b'{"backends": {"1": {"latency": 4}}}\n')
+        parser.parse_line(b'{"backends": 3}\n')
+        self.assertEqual(list(parser.times), ['backends.1.latency'])
+        self.assertEqual(parser.times['backends.1.latency']['values'].mean(), 3)
+        parser = JsonLogster('--timer backends.0.latency')
+        parser.parse_line(b'{"backends": [{"latency": 1}, {"latency": 2}]}\n')
+        self.assertEqual(parser.times['backends.0.latency']['values'].mean(), 1)
+
+    def test_errors(self):
+        parser = JsonLogster('--counter bytes')
+        self.assertEqual(parser.parse_line(b'starting up\n'), UNMATCHED)
+        self.assertEqual(parser.parse_line(b'{"bytes": 1\n'), PARSE_ERROR)
+        self.assertEqual(parser.parse_line(b'{"bytes": "many"}\n'), PARSE_ERROR)
+        self.assertEqual(parser.parse_line(b'{"bytes": 2}\n'), None)
+        self.assertEqual(parser.counts, {'lines': 2, 'bytes': 2})
+
+    def test_non_finite(self):
+        """
+        NaN and infinities are parse errors, with either decoder
+        """
+        loads = json_logster.loads
+        for decoder in (loads, json.loads):
+            json_logster.loads = decoder
+            try:
+                parser = JsonLogster('--counter bytes --timer time --histogram')
+                for value in (b'"nan"', b'"inf"', b'"-Infinity"', b'NaN', b'Infinity', b'1e400'):
+                    self.assertEqual(parser.parse_line(b'{"time": %s}\n' % value), PARSE_ERROR)
+                    self.assertEqual(parser.parse_line(b'{"bytes": %s}\n' % value), PARSE_ERROR)
+                self.assertEqual(parser.parse_line(b'{"time": 1, "bytes": 2}\n'), None)
+            finally:
+                json_logster.loads = loads
+            metrics = dict((m.name, m.value) for m in parser.get_state(1))
+            self.assertEqual(metrics['time.mean'], 1)
+            self.assertEqual(metrics['bytes'], 2)
+
+    def test_dimension_types(self):
+        """
+        Values of a dimension that are equal but of different types are told apart
+        """
+        parser = JsonLogster('--dimension d')
+        for value in (b'true', b'1', b'1.0', b'"1"'):
+            parser.parse_line(b'{"d": %s}\n' % value)
+        self.assertEqual(parser.counts['lines.d.True'], 1)
+        self.assertEqual(parser.counts['lines.d.1'], 2)
+        self.assertEqual(parser.counts['lines.d.1_0'], 1)
+
+    def test_json_module(self):
+        """
+        Lines are decoded the same with the json module as with a faster decoder
+        """
+        loads = json_logster.loads
+        json_logster.loads = json.loads
+        try:
+            metrics = self.metrics(JsonLogster('--counter bytes --dimension method'))
+        finally:
+            json_logster.loads = loads
+        self.assertEqual(metrics, self.metrics(JsonLogster('--counter bytes --dimension method')))
+        self.assertEqual(metrics['bytes.method.POST'], 300)
+
+    def test_max_metrics(self):
+        """
+        Dimensions with many values are folded into "other"
+        """
+        parser = JsonLogster('--dimension id --max-metrics 3')
+        for i in range(10):
+            parser.parse_line(b'{"id": %d}\n' % i)
+        metrics = dict((m.name, m.value) for m in parser.get_state(1))
+        self.assertEqual(metrics['lines'], 10)
+        self.assertEqual(metrics.pop('logster.metric_names_dropped'), 8)
+        self.assertEqual(len(metrics), 4)
+        self.assertTrue('other' in metrics)
+        self.assertEqual(sum(metrics.values()), 20)
+
+
+class TestPostfixLogster(unittest.TestCase):
+
+    prefix = 'Oct 11 14:32:52 mail postfix/%s[123]: '
+    lines = [
+        ('cleanup', '4F1E21C0A2: message-id=<1@example.com>'),
+        ('qmgr', '4F1E21C0A2: from=<a@example.com>, size=2048, nrcpt=2 (queue active)'),
+        ('smtp', '4F1E21C0A2: to=<b@example.net>, relay=mx.example.net[203.0.113.5]:25, '
+            'delay=1.5, delays=0.1/0/0.4/1, dsn=2.0.0, status=sent (250 ok)'),
+        ('smtp', '4F1E21C0A2: to=<c@example.org>, relay=none, delay=30, '
+            'delays=0.1/0/30/0, dsn=4.4.1, status=deferred (connection timed out)'),
+    ]
+    retry = [
+        ('smtp', '4F1E21C0A2: to=<c@example.org>, relay=mx.example.org[198.51.100.7]:25, '
+            'delay=400, delays=399/0/0.5/0.5, dsn=2.0.0, status=sent (250 ok)'),
+        ('qmgr', '4F1E21C0A2: removed'),
+    ]
+
+    def parse(self, parser, lines):
+        return [parser.parse_line(self.prefix % daemon + text + '\n') for daemon, text in lines]
+
+    def metrics(self, parser):
+        return dict((m.name, m.value) for m in parser.get_state(10))
+
+    def test_counts(self):
+        parser = PostfixLogster()
+        self.assertEqual(self.parse(parser, self.lines), [UNMATCHED, UNMATCHED, None, None])
+        metrics = self.metrics(parser)
+        self.assertEqual(metrics['numSent'], 1)
+        self.assertEqual(metrics['pctDeferred'], 50)
+        self.assertEqual(metrics['avgDelay'], 1.5)
+
+    def test_bad_delay(self):
+        bad = [('smtp', '4F1E21C0A2: to=<b@example.net>, relay=none, delay=1.2.3, dsn=2.0.0, status=sent (250 ok)')]
+        self.assertEqual(self.parse(PostfixLogster(), bad), [PARSE_ERROR])
+        self.assertEqual(self.parse(PostfixLogster('--track-messages'), bad), [PARSE_ERROR])
+        bad = [('smtp', '4F1E21C0A2: to=<b@example.net>, relay=none, delay=abc, dsn=2.0.0, status=sent (250 ok)')]
+        self.assertEqual(self.parse(PostfixLogster(), bad), [PARSE_ERROR])
+
+    def test_persistent_state(self):
+        """
+        Queued messages are only carried over between runs with --track-messages
+        """
+        self.assertEqual(PostfixLogster().get_persistent_state(), None)
+        self.assertEqual(PostfixLogster('--track-messages').get_persistent_state(), {'messages': {}})
+
+    def test_message_across_runs(self):
+        """
+        A message still queued at the end of a run is completed by the next
+        """
+        first = PostfixLogster('--track-messages')
+        self.parse(first, self.lines)
+        metrics = self.metrics(first)
+        self.assertEqual(metrics['messagesInFlight'], 1)
+        self.assertEqual(metrics['messagesCompleted'], 0)
+
+        second = PostfixLogster('--track-messages')
+        second.set_persistent_state(first.get_persistent_state())
+        self.parse(second, self.retry)
+        metrics = self.metrics(second)
+        self.assertEqual(metrics['messagesInFlight'], 0)
+        self.assertEqual(metrics['messagesCompleted'], 1)
+        self.assertAlmostEqual(metrics['messageDelay.50th_percentile'], 400, delta=400 * 0.05)
+        self.assertAlmostEqual(metrics['messageSize.mean'], 2048)
+        self.assertEqual(metrics['messageRecipients.mean'], 2)
+        self.assertAlmostEqual(metrics['deliveryDelay.mean'], 400, delta=400 * 0.05)
+
+    def test_bounded(self):
+        parser = PostfixLogster('--track-messages --max-messages 2 --message-ttl 60')
+        for queue_id in ('A1B2C3', 'A1B2C4', 'A1B2C5'):
+            parser.parse_line(self.prefix % 'cleanup' + queue_id + ': message-id=<x>\n')
+        self.assertEqual(list(parser.messages), ['A1B2C4', 'A1B2C5'])
+        parser.messages['A1B2C4'][0] -= 120
+        metrics = self.metrics(parser)
+        self.assertEqual(metrics['messagesInFlight'], 1)
+        self.assertEqual(metrics['messagesExpired'], 2)
+
+
+class TestSampleLogster(unittest.TestCase):
+
+    line = ('%s - - [10/Oct/2000:13:55:36 -0700] "GET %s HTTP/1.0" %d 2326 '
+        '"http://www.example.com/start.html" "Mozilla/4.08 [en] (Win98; I ;Nav)"\n')
+
+    def test_status(self):
+        parser = SampleLogster()
+        parser.parse_line(self.line % ('127.0.0.1', '/', 200))
+        parser.parse_line(self.line % ('127.0.0.1', '/missing', 404))
+        metrics = dict((m.name, m.value) for m in parser.get_state(1))
+        self.assertEqual(metrics['http_2xx'], 1)
+        self.assertEqual(metrics['http_4xx'], 1)
+
+    def test_top_k(self):
+        parser = SampleLogster('--top-k 1 --top-fields path,client')
+        parser.parse_line(self.line % ('10.0.0.1', '/index.html?q=1', 200))
+        parser.parse_line(self.line % ('10.0.0.2', '/index.html', 200))
+        parser.parse_line(self.line % ('10.0.0.2', '/favicon.ico', 404))
+        metrics = dict((m.name, m.value) for m in parser.get_state(1))
+        self.assertEqual(metrics['top.path.1.index_html'], 2)
+        self.assertEqual(metrics['top.client.1.10_0_0_2'], 2)
+        self.assertEqual(metrics['http_2xx'], 2)
+
+    def test_response_time_histogram(self):
+        parser = SampleLogster('--histogram-fields bytes,response_time --percentiles 100')
+        parser.parse_line(self.line.rstrip() % ('10.0.0.1', '/', 200) + ' 1500\n')
+        parser.parse_line(self.line.rstrip() % ('10.0.0.1', '/', 200) + ' 2500\n')
+        metrics = dict((m.name, m.value) for m in parser.get_state(1))
+        self.assertEqual(metrics['response_time.mean'], 2000)
+        self.assertEqual(metrics['response_time.100th_percentile'], 2500)
+        self.assertEqual(metrics['bytes.mean'], 2326)
+
+    def test_log_format(self):
+        parser = SampleLogster('--log-format "%v %h %l %u %t \\"%r\\" %>s %b" --top-k 1 --top-fields vhost,method')
+        parser.parse_line('www.example.com 10.0.0.1 - - [10/Oct/2000:13:55:36 -0700] "POST /login HTTP/1.1" 302 0\n')
+        self.assertEqual(parser.parse_line('www.example.com 10.0.0.1 - -\n'), UNMATCHED)
+        metrics = dict((m.name, m.value) for m in parser.get_state(1))
+        self.assertEqual(metrics['top.vhost.1.www_example_com'], 1)
+        self.assertEqual(metrics['top.method.1.POST'], 1)
+        self.assertEqual(metrics['http_3xx'], 1)
+        self.assertEqual(metrics['http_2xx'], 0)
+
+
+class TestSquidLogster(unittest.TestCase):
+
+    line = ('1286536309.586    921 %s TCP_MISS/200 507 GET %s - '
+        'DIRECT/203.0.113.7 text/html\n')
+
+    def test_top_k(self):
+        parser = SquidLogster('--top-k 2')
+        parser.parse_line(self.line % ('192.168.0.68', 'http://www.example.com/'))
+        parser.parse_line(self.line % ('192.168.0.68', 'http://www.example.com/'))
+        parser.parse_line(self.line % ('192.168.0.69', 'http://www.example.org/'))
+        metrics = dict((m.name, m.value) for m in parser.get_state(1))
+        self.assertEqual(metrics['top.url.1.http_www_example_com'], 2)
+        self.assertEqual(metrics['top.url.2.http_www_example_org'], 1)
+        self.assertEqual(metrics['top.client.1.192_168_0_68'], 2)
+        self.assertEqual(metrics['squid_TCP_MISS'], 3)
+
+    def test_unique(self):
+        parser = SquidLogster('--unique-fields client,url')
+        parser.parse_line(self.line % ('192.168.0.68', 'http://www.example.com/'))
+        parser.parse_line(self.line % ('192.168.0.68', 'http://www.example.org/'))
+        parser.parse_line(self.line % ('192.168.0.69', 'http://www.example.org/'))
+        parser.parse_line(self.line % ('192.168.0.70', 'http://www.example.org/'))
+        metrics = dict((m.name, m.value) for m in parser.get_state(1))
+        self.assertEqual(metrics['unique.client'], 3)
+        self.assertEqual(metrics['unique.url'], 2)
+
+    def test_histograms(self):
+        parser = SquidLogster('--histogram-fields bytes,elapsed --percentiles 50 --histogram-buckets 1000')
+        parser.parse_line(self.line % ('192.168.0.68', 'http://www.example.com/'))
+        parser.parse_line(self.line.replace(' 507 ', ' 2000 ') % ('192.168.0.68', 'http://www.example.com/'))
+        metrics = dict((m.name, m.value) for m in parser.get_state(1))
+        self.assertEqual(metrics['bytes.mean'], 1253.5)
+        self.assertEqual(metrics['bytes.le_1000'], 1)
+        self.assertEqual(metrics['bytes.le_inf'], 2)
+        self.assertEqual(metrics['elapsed.50th_percentile'], 921)
+        self.assertEqual(metrics['size'], 2507)
+
+    def test_codes(self):
+        parser = SquidLogster()
+        parser.parse_line(self.line % ('192.168.0.68', 'http://www.example.com/'))
+        parser.parse_line(self.line.replace('TCP_MISS/200', 'TAG_NONE/503') % ('192.168.0.68', 'error:invalid-request'))
+        self.assertEqual(parser.parse_line('1286536309.586 921 192.168.0.68 TCP_MISS/-\n'), UNMATCHED)
+        metrics = dict((m.name, m.value) for m in parser.get_state(1))
+        self.assertEqual(metrics['squid_TCP_MISS'], 1)
+        self.assertEqual(metrics['squid_OTHER'], 1)
+        self.assertEqual(metrics['http_5xx'], 1)
+
+
+class TestLogFormat(unittest.TestCase):
+
+    line = ('10.0.0.1 - frank [10/Oct/2000:13:55:36 -0700] "GET /search?q=logs HTTP/1.0" 200 2326 '
+        '"http://www.example.com/start.html" "Mozilla/4.08 [en] (Win98; I ;Nav)" 1500\n')
+
+    def test_combined(self):
+        names = ['client', 'user', 'time', 'method', 'path', 'query', 'protocol', 'http_status_code',
+            'bytes', 'referer', 'agent', 'response_time']
+        log_format = LogFormat('combined_time', names)
+        self.assertEqual(log_format.parse(self.line), ['10.0.0.1', 'frank', '[10/Oct/2000:13:55:36 -0700]',
+            'GET', '/search', 'q=logs', 'HTTP/1.0', '200', '2326', 'http://www.example.com/start.html',
+            'Mozilla/4.08 [en] (Win98; I ;Nav)', '1500'])
+
+    def test_short_lines(self):
+        """
+        Fields past the end of a line are None
+        """
+        log_format = LogFormat('combined_time', ['http_status_code', 'agent', 'response_time'])
+        self.assertEqual(log_format.parse(self.line.split(' "http')[0] + '\n'), ['200', None, None])
+        self.assertEqual(log_format.parse('garbage\n'), [None, None, None])
+
+    def test_escaped_quotes(self):
+        line = self.line.replace('Win98;', 'Win98; \\"quoted\\" \\\\;')
+        log_format = LogFormat('combined_time', ['agent', 'response_time'])
+        self.assertEqual(log_format.parse(line),
+            ['Mozilla/4.08 [en] (Win98; \\"quoted\\" \\\\; I ;Nav)', '1500'])
+
+    def test_squid(self):
+        log_format = LogFormat('squid', ['http_status_code', 'squid_code', 'elapsed', 'peer', 'type'], 'squid')
+        self.assertEqual(log_format.parse('1286536309.586    921 192.168.0.68 TCP_MISS/200 507 GET '
+            'http://www.example.com/ - DIRECT/203.0.113.7 text/html\n'),
+            ['200', 'TCP_MISS', '921', '203.0.113.7', 'text/html'])
+        log_format = LogFormat('common', ['time', 'url', 'protocol', 'hierarchy'], 'squid')
+        self.assertEqual(log_format.parse('192.168.0.68 - - [10/Oct/2000:13:55:36 -0700] '
+            '"GET http://www.example.com/ HTTP/1.1" 200 507 TCP_MISS:DIRECT\n'),
+            ['10/Oct/2000:13:55:36 -0700', 'http://www.example.com/', '1.1', 'DIRECT'])
+
+    def test_missing_field(self):
+        self.assertRaises(ValueError, LogFormat, 'common', ['agent'])
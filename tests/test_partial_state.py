@@ -0,0 +1,86 @@
+import unittest
+
+from logster import partial_state
+from logster.parsers import stats_helper
+from logster.parsers.Log4jLogster import Log4jLogster
+from logster.parsers.MetricLogster import MetricLogster
+from logster.parsers.SquidLogster import SquidLogster
+
+
+class TestPartialState(unittest.TestCase):
+
+    def roundtrip(self, value):
+        return partial_state.loads(partial_state.dumps(value))
+
+    def test_plain_values(self):
+        value = {'counts': {'a.b': 1.5}, 'codes': {200: 3}, 'keys': (True, 'x'), 'seen': set([1])}
+        self.assertEqual(self.roundtrip(value), value)
+
+    def test_histogram(self):
+        histogram = stats_helper.LogLinearHistogram()
+        for value in (1, 10, 100):
+            histogram.record(value)
+        decoded = self.roundtrip(histogram)
+        self.assertEqual(decoded.percentile(50), histogram.percentile(50))
+        self.assertEqual(decoded.counts, histogram.counts)
+        self.assertEqual(decoded.max, 100)
+
+    def test_unregistered_class(self):
+        self.assertRaises(TypeError, partial_state.dumps, {'parser': object()})
+        self.assertRaises(KeyError, partial_state.loads,
+            '{"__object__": "Popen", "attributes": {}}')
+
+    def test_array_size(self):
+        """
+        A message can't make the decoder allocate much more than it carries
+        """
+        sketch = stats_helper.CountMinSketch(2048, 4)
+        sketch.add('x')
+        self.assertEqual(self.roundtrip(sketch).table, sketch.table)
+        for size in (10 ** 10, -1, 1.5):
+            self.assertRaises(ValueError, partial_state.loads,
+                '{"__array__": "d", "size": %s, "nonzero": [[0, 1.0]]}' % size)
+
+    def test_merge_squid(self):
+        line = '1286536309.586    921 %s TCP_MISS/200 507 GET http://www.example.com/ - DIRECT/203.0.113.7 text/html\n'
+        options = '--unique-fields client --histogram-fields bytes'
+        hosts = [SquidLogster(options), SquidLogster(options)]
+        hosts[0].parse_line(line % '10.0.0.1')
+        hosts[1].parse_line(line % '10.0.0.2')
+        hosts[1].parse_line(line % '10.0.0.2')
+        merged = SquidLogster(options)
+        for host in hosts:
+            merged.merge_partial_state(self.roundtrip(host.get_partial_state()))
+        metrics = dict((m.name, m.value) for m in merged.get_state(1))
+        self.assertEqual(metrics['http_2xx'], 3)
+        self.assertEqual(metrics['squid_TCP_MISS'], 3)
+        self.assertEqual(metrics['unique.client'], 2)
+        self.assertEqual(metrics['bytes.mean'], 507)
+
+    def test_merge_metric_logster_with_cap(self):
+        hosts = [MetricLogster('--max-metrics 2'), MetricLogster('--max-metrics 2')]
+        for i in range(4):
+            hosts[0].parse_line('METRIC_COUNT metric=a value=1\n')
+        for i in range(3):
+            hosts[1].parse_line('METRIC_COUNT metric=b value=1\n')
+        for i in range(2):
+            hosts[1].parse_line('METRIC_TIME metric=c value=%d\n' % i)
+        hosts[0].parse_line('METRIC_COUNT metric=d value=1\n')
+        merged = MetricLogster('--max-metrics 2')
+        for host in hosts:
+            merged.merge_partial_state(self.roundtrip(host.get_partial_state()))
+        self.assertEqual(merged.counts, {'a': 4, 'b': 3, 'other': 1})
+        self.assertEqual(len(merged.times['other']['values']), 2)
+        self.assertEqual(merged.dropped_names, 2)
+
+    def test_merge_log4j_exceptions(self):
+        hosts = [Log4jLogster('--exceptions 10'), Log4jLogster('--exceptions 10')]
+        hosts[0].parse_line('java.lang.IllegalStateException: not ready\n')
+        hosts[1].parse_line('Caused by: java.io.IOException\n')
+        hosts[1].parse_line('java.lang.IllegalStateException: not ready\n')
+        merged = Log4jLogster('--exceptions 10')
+        for host in hosts:
+            merged.merge_partial_state(self.roundtrip(host.get_partial_state()))
+        self.assertEqual(merged.exceptions.items(),
+            [('causes.java.io.IOException', 1), ('exceptions.java.lang.IllegalStateException', 2)])
+
@@ -0,0 +1,50 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from logster import prometheus
+from logster.logster_helper import MetricObject
+
+
+class TestPrometheus(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'logster.prom')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def read(self):
+        f = open(self.path)
+        try:
+            return f.read()
+        finally:
+            f.close()
+
+    def test_metric_name(self):
+        self.assertEqual(prometheus.metric_name('top.path.1.index_html'), 'top_path_1_index_html')
+        self.assertEqual(prometheus.metric_name('2xx'), '_2xx')
+
+    def test_merges_jobs(self):
+        prometheus.write_textfile(self.path, 'SampleLogster-var-log-a',
+            [MetricObject('http_2xx', 2, 'Responses per sec'), MetricObject('http_5xx', 1)])
+        prometheus.write_textfile(self.path, 'SampleLogster-var-log-b',
+            [MetricObject('http_2xx', 0.5, 'Responses per sec')])
+        prometheus.write_textfile(self.path, 'SampleLogster-var-log-a',
+            [MetricObject('http_2xx', 3, 'Responses per sec'), MetricObject('load.mean', None)])
+        self.assertEqual(self.read(),
+            '# HELP http_2xx Responses per sec\n'
+            '# TYPE http_2xx gauge\n'
+            'http_2xx{logster_job="SampleLogster-var-log-a"} 3.0\n'
+            'http_2xx{logster_job="SampleLogster-var-log-b"} 0.5\n'
+            '# EOF\n')
+        self.assertEqual(sorted(os.listdir(self.directory)), ['.logster.prom.lock', 'logster.prom'])
+
+    def test_escaped_job(self):
+        job = 'MetricLogster --percentiles "90"'
+        prometheus.write_textfile(self.path, job, [MetricObject('hits', float('inf'))])
+        self.assertTrue('hits{logster_job="MetricLogster --percentiles \\"90\\""} +Inf\n' in self.read())
+        prometheus.write_textfile(self.path, job, [MetricObject('hits', 1)])
+        self.assertEqual(self.read().count('hits{'), 1)
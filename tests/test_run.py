@@ -1,6 +1,9 @@
+import optparse
 import unittest
 
 import logster.run
+from logster.logster_helper import LogsterParser, MetricObject, UNMATCHED
+from logster.state_store import StateStore
 
 class TestStatsHelper(unittest.TestCase):
 
@@ -26,3 +29,147 @@ class TestStatsHelper(unittest.TestCase):
         parser = logster.run.load_parser('MetricLogster',
             option_string='--percentiles 40,50')
         self.assertEqual(parser.percentiles, ['40', '50'])
+
+    def test_resume_checkpoint(self):
+        """
+        An unfinished run continues with the parser state it had reached
+        """
+        store = StateStore(':memory:')
+        options = optparse.Values({'parser_options': '-l WARN'})
+        parser = logster.run.load_parser('MetricLogster')
+        parser.counts['requests'] = 4.0
+        stats = logster.run.ParseStats(0)
+        stats.lines, stats.parsed, stats.unmatched = 1000, 100, 5
+        store.save_checkpoint('job', 100, '3:abc', '-l WARN', parser.get_partial_state(),
+            stats.get_counts())
+        parser = logster.run.load_parser('MetricLogster')
+        position, fingerprint, counts = logster.run.resume_checkpoint(store, 'job', parser, options)
+        self.assertEqual((position, fingerprint), (100, '3:abc'))
+        self.assertEqual(parser.counts, {'requests': 4.0})
+        # The counts before the checkpoint carry on, so a sample is scaled
+        # by the lines of the whole run.
+        stats = logster.run.ParseStats(0)
+        stats.set_counts(counts)
+        self.assertEqual((stats.lines, stats.parsed, stats.unmatched, stats.errors), (1000, 100, 5, 0))
+
+    def test_checkpoint_with_other_options_ignored(self):
+        store = StateStore(':memory:')
+        options = optparse.Values({'parser_options': '-l ERROR'})
+        store.save_checkpoint('job', 100, '3:abc', '-l WARN', {})
+        parser = logster.run.load_parser('MetricLogster')
+        self.assertEqual(logster.run.resume_checkpoint(store, 'job', parser, options), None)
+
+    def test_checkpoint_unpicklable(self):
+        """
+        A parser whose state can't be pickled runs on without checkpoints
+        """
+        class Input(object):
+            position = 2 * 1024 * 1024
+            def checkpoint(self):
+                return self.position, '3:abc'
+        store = StateStore(':memory:')
+        options = optparse.Values({'parser_options': None, 'checkpoint_size': 1,
+            'checkpoint_interval': 1, 'lease_timeout': 60})
+        parser = LogsterParser()
+        parser.callback = lambda line: None
+        checkpointer = logster.run.Checkpointer(store, 'job', parser, Input(), options)
+        checkpointer.last_position = 0
+        self.assertTrue(checkpointer.due())
+        checkpointer.save()
+        self.assertFalse(checkpointer.due())
+        self.assertEqual(store.get_checkpoint('job'), None)
+
+    def test_parse_stats(self):
+        """
+        Lines that aren't matched are counted, and only the first few logged
+        """
+        parser = logster.run.load_parser('SampleLogster')
+        stats = logster.run.ParseStats(log_failures=1)
+        lines = ['127.0.0.1 - - [10/Oct/2000:13:55:36 -0700] "GET / HTTP/1.0" 200 2326 "-" "-"\n',
+            'garbage\n', 'more garbage\n']
+        logged = []
+        logster.run.logger.debug, debug = logged.append, logster.run.logger.debug
+        try:
+            for line in lines:
+                stats.record(parser.parse_line(line), line)
+        finally:
+            logster.run.logger.debug = debug
+        stats.lines = stats.parsed = len(lines)
+        metrics = dict((m.name, m.value) for m in stats.get_metrics())
+        self.assertEqual(metrics, {'logster.lines.matched': 1,
+            'logster.lines.unmatched': 2, 'logster.lines.errors': 0})
+        self.assertEqual(len(logged), 1)
+
+    def test_sampled_parse_stats(self):
+        """
+        Counts of a sample are scaled up, with the sample rate and error
+        """
+        stats = logster.run.ParseStats(log_failures=0)
+        stats.lines, stats.parsed = 1000, 100
+        for i in range(10):
+            stats.record(UNMATCHED, 'garbage\n')
+        metrics = dict((m.name, m.value) for m in stats.get_metrics())
+        self.assertEqual(metrics['logster.lines.matched'], 900)
+        self.assertEqual(metrics['logster.lines.unmatched'], 100)
+        self.assertEqual(metrics['logster.sample_rate'], 0.1)
+        self.assertAlmostEqual(metrics['logster.sample_error'], 0.1)
+
+    def test_parse_cache(self):
+        """
+        Lines repeated but for the timestamp are counted from the cache
+        """
+        parser = logster.run.load_parser('Log4jLogster')
+        cache = logster.run.ParseCache(parser, 2)
+        lines = ['2011-01-01_12:00:%02d WARN Disk is full\n' % i for i in range(3)] + [
+            '2011-01-01_12:00:03 INFO Started\n',
+            '2011-01-01_12:00:04 ERROR Gave up\n',
+            '2011-01-01_12:00:05 WARN Disk is full\n',
+            '\tat com.example.Main.main(Main.java:1)\n']
+        results = [cache.parse_line(line) for line in lines]
+        self.assertEqual(results, [None, None, None, UNMATCHED, None, None, UNMATCHED])
+        self.assertEqual(parser.counts, {'WARN': 4, 'ERROR': 1, 'FATAL': 0})
+        metrics = dict((m.name, m.value) for m in cache.get_metrics())
+        self.assertEqual(metrics, {'logster.parse_cache.hits': 2,
+            'logster.parse_cache.misses': 4, 'logster.parse_cache.evictions': 2,
+            'logster.parse_cache.bypassed': 1})
+
+    def test_binary_parse_cache(self):
+        """
+        A --cache-prefix given as text works for binary parsers
+        """
+        parser = logster.run.load_parser('ErrorLogLogster')
+        cache = logster.run.ParseCache(parser, 10, r'\[[^]]+\] ')
+        for second in range(5):
+            line = '[Wed Oct 11 14:32:5%d 2000] [error] [client 127.0.0.1] denied\n' % second
+            cache.parse_line(line.encode('ascii'))
+        self.assertEqual(parser.error, 5)
+        self.assertEqual((cache.hits, cache.misses), (4, 1))
+
+    def test_scale_sample(self):
+        parser = logster.run.load_parser('SampleLogster', option_string='--histogram-fields bytes')
+        parser.parse_line('127.0.0.1 - - [10/Oct/2000:13:55:36 -0700] "GET / HTTP/1.0" 200 2326 "-" "-"\n')
+        logster.run.scale_sample(parser, 10, 1)
+        metrics = dict((m.name, m.value) for m in parser.get_state(1))
+        self.assertEqual(metrics['http_2xx'], 10)
+        self.assertEqual(metrics['bytes.mean'], 2326)
+
+    def test_change_filter(self):
+        """
+        Unchanged values are only sent again after the heartbeat
+        """
+        store = StateStore(':memory:')
+        def send(now, **values):
+            change_filter = logster.run.ChangeFilter(store, 'job', 300)
+            metrics = change_filter.filter([MetricObject(name, value) for name, value in sorted(values.items())], now)
+            change_filter.commit()
+            return dict((m.name, m.value) for m in metrics)
+        self.assertEqual(send(1000, crit=0, hits=5),
+            {'crit': 0, 'hits': 5, 'logster.points_suppressed': 0})
+        self.assertEqual(send(1060, crit=0, hits=6),
+            {'hits': 6, 'logster.points_suppressed': 1})
+        self.assertEqual(send(1300, crit=0, hits=6),
+            {'crit': 0, 'logster.points_suppressed': 1})
+        # A metric no longer reported is forgotten once the heartbeat passed.
+        send(1700, hits=6)
+        self.assertEqual(sorted(store.get_sent_values('job')), ['hits'])
+
@@ -0,0 +1,83 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from logster.logster_helper import LockingError
+from logster.state_store import StateStore
+
+
+class TestStateStore(unittest.TestCase):
+
+    def setUp(self):
+        self.state_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.state_dir, 'logster.db')
+        self.store = StateStore(self.path)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.state_dir)
+
+    def test_unknown_job(self):
+        self.assertEqual(self.store.get_job('SampleLogster-var-log-foo'), None)
+
+    def test_commit_job(self):
+        self.store.commit_job('job', 100, '3:abc', 1000.0)
+        self.store.commit_job('job', 200, '3:abc', 1060.0)
+        self.assertEqual(self.store.get_job('job'),
+            {'position': 200, 'fingerprint': '3:abc', 'last_run': 1060.0})
+
+    def test_parser_state(self):
+        self.assertEqual(self.store.get_parser_state('job'), None)
+        self.store.commit_job('job', 100, '3:abc', 1000.0, '--track-messages', {'messages': {'A1': 1}})
+        self.store.commit_job('job', 200, '3:abc', 1060.0)
+        self.assertEqual(self.store.get_parser_state('job'),
+            {'parser_options': '--track-messages', 'state': {'messages': {'A1': 1}}})
+
+    def test_lease_held_by_live_process(self):
+        """
+        A lease held by another running process can't be taken
+        """
+        other = StateStore(self.path)
+        other.pid = os.getppid()
+        other.acquire_lease('job', 60)
+        self.assertRaises(LockingError, self.store.acquire_lease, 'job', 60)
+        other.release_lease('job')
+        self.store.acquire_lease('job', 60)
+        other.close()
+
+    def test_lease_of_dead_process(self):
+        """
+        A crashed run doesn't block later runs
+        """
+        other = StateStore(self.path)
+        other.pid = 2 ** 22 + 1
+        other.acquire_lease('job', 60)
+        self.store.acquire_lease('job', 60)
+        other.close()
+
+    def test_expired_lease(self):
+        other = StateStore(self.path)
+        other.host = 'elsewhere.example.com'
+        other.acquire_lease('job', -1)
+        self.store.acquire_lease('job', 60)
+        other.close()
+
+    def test_release_only_own_lease(self):
+        other = StateStore(self.path)
+        other.pid = os.getppid()
+        other.acquire_lease('job', 60)
+        self.store.release_lease('job')
+        self.assertRaises(LockingError, self.store.acquire_lease, 'job', 60)
+        other.close()
+
+    def test_checkpoint(self):
+        self.store.save_checkpoint('job', 300, '3:abc', '-l WARN', {'WARN': 2}, {'lines': 10})
+        self.assertEqual(self.store.get_checkpoint('job'),
+            {'position': 300, 'fingerprint': '3:abc', 'parser_options': '-l WARN',
+             'parser_state': {'WARN': 2}, 'counts': {'lines': 10}})
+
+    def test_commit_drops_checkpoint(self):
+        self.store.save_checkpoint('job', 300, '3:abc', None, {})
+        self.store.commit_job('job', 400, '3:abc', 1000.0)
+        self.assertEqual(self.store.get_checkpoint('job'), None)
@@ -63,3 +63,153 @@ class TestStatsHelper(unittest.TestCase):
 
     def test_90th_1_to_15_noncontiguous(self):
         self.assertAlmostEqual(stats_helper.find_percentile([1,2,3,4,5,6,7,8,9,15],90), 9.6)
+
+    def test_space_saving_keeps_heavy_hitters(self):
+        top = stats_helper.SpaceSaving(3)
+        for i in range(100):
+            top.offer('hot')
+            top.offer('id%d' % i)
+        self.assertEqual(len(top), 3)
+        self.assertEqual(top.top(1), [('hot', 100, 0)])
+
+    def test_space_saving_evicts_least_frequent(self):
+        top = stats_helper.SpaceSaving(2)
+        self.assertEqual(top.offer('a'), None)
+        self.assertEqual(top.offer('a'), None)
+        self.assertEqual(top.offer('b'), None)
+        self.assertEqual(top.offer('c'), 'b')
+        self.assertEqual(top.top(), [('a', 2, 0), ('c', 2, 1)])
+
+    def test_count_min_never_undercounts(self):
+        sketch = stats_helper.CountMinSketch(16, 3)
+        for i in range(200):
+            sketch.add('key%d' % (i % 20))
+        for i in range(20):
+            self.assertTrue(sketch.estimate('key%d' % i) >= 10)
+
+    def test_top_k(self):
+        top = stats_helper.TopK(2, 1024, 4)
+        for key, count in (('a', 50), ('b', 30), ('c', 20)):
+            for i in range(count):
+                top.add(key)
+        for i in range(100):
+            top.add('once%d' % i)
+        self.assertEqual([key for key, count in top.top()], ['a', 'b'])
+
+    def test_top_k_merge(self):
+        one = stats_helper.TopK(2, 1024, 4)
+        other = stats_helper.TopK(2, 1024, 4)
+        for i in range(10):
+            one.add('a')
+            other.add('b')
+            other.add('b')
+        one.add('c')
+        one.merge(other)
+        self.assertEqual(one.top(), [('b', 20), ('a', 10)])
+
+    def test_hyperloglog(self):
+        unique = stats_helper.HyperLogLog(0.02)
+        for i in range(20000):
+            unique.add('client%d' % (i % 5000))
+        self.assertTrue(abs(unique.cardinality() - 5000) < 5000 * 0.06)
+        self.assertEqual(len(unique.registers), 4096)
+
+    def test_hyperloglog_merge(self):
+        one = stats_helper.HyperLogLog(0.02)
+        other = stats_helper.HyperLogLog(0.02)
+        for i in range(3000):
+            one.add('client%d' % i)
+            other.add('client%d' % (i + 1000))
+        one.merge(other)
+        self.assertTrue(abs(one.cardinality() - 4000) < 4000 * 0.06)
+
+    def test_histogram_percentiles(self):
+        histogram = stats_helper.LogLinearHistogram()
+        for value in range(1, 1001):
+            histogram.record(value)
+        self.assertEqual(histogram.mean(), 500.5)
+        self.assertEqual(histogram.percentile(100), 1000)
+        self.assertEqual(histogram.percentile(0), 1)
+        for percentile in (10, 50, 90, 99):
+            self.assertAlmostEqual(histogram.percentile(percentile) / (percentile * 10.0), 1, delta=0.03)
+
+    def test_histogram_merge(self):
+        one = stats_helper.LogLinearHistogram()
+        other = stats_helper.LogLinearHistogram()
+        for value in range(1, 501):
+            one.record(value)
+            other.record(value + 500)
+        one.merge(other)
+        self.assertEqual(one.count, 1000)
+        self.assertEqual((one.min, one.max), (1, 1000))
+        self.assertAlmostEqual(one.percentile(90) / 900.0, 1, delta=0.03)
+        self.assertRaises(ValueError, one.merge, stats_helper.LogLinearHistogram(sub_buckets=8))
+
+    def test_histogram_cumulative_counts(self):
+        histogram = stats_helper.LogLinearHistogram()
+        for value in (0, 5, 50, 500, 5000):
+            histogram.record(value)
+        self.assertEqual(histogram.cumulative_counts([100, 10]), [(10, 2), (100, 3)])
+
+    def test_lru_counter(self):
+        counter = stats_helper.LRUCounter(2)
+        self.assertEqual(counter.add('a'), None)
+        counter.add('b')
+        counter.add('a')
+        self.assertEqual(counter.add('c'), 'b')
+        self.assertEqual(counter.items(), [('a', 2), ('c', 1)])
+        other = stats_helper.LRUCounter(2)
+        other.add('a', 3)
+        counter.merge(other)
+        self.assertEqual(counter.items(), [('c', 1), ('a', 5)])
+        self.assertEqual(counter.dropped, 1)
+
+    def test_scale(self):
+        histogram = stats_helper.LogLinearHistogram()
+        for value in (1, 2, 4):
+            histogram.record(value)
+        histogram.scale(10)
+        self.assertEqual(len(histogram), 30)
+        self.assertEqual(histogram.mean(), 7.0 / 3)
+        self.assertEqual(histogram.cumulative_counts([2]), [(2, 20)])
+        top = stats_helper.TopK(1, 1024, 4)
+        top.add('a', 3)
+        top.scale(10)
+        self.assertEqual(top.top(), [('a', 30)])
+
+    def test_sliding_window(self):
+        window = stats_helper.SlidingWindow(300, slots=5)
+        for now, value in ((1000, 10), (1060, 20), (1250, 30)):
+            histogram = stats_helper.LogLinearHistogram()
+            histogram.record(value)
+            window.add(histogram, now)
+        self.assertEqual(len(window), 3)
+        merged = window.histogram(1250)
+        self.assertEqual((merged.count, merged.min, merged.max), (3, 10, 30))
+        # The slot of the first value slides out of the window.
+        merged = window.histogram(1310)
+        self.assertEqual((merged.count, merged.min, merged.mean()), (2, 20, 25))
+        self.assertEqual(len(window), 2)
+
+    def test_exact_values(self):
+        """
+        Percentiles are those of find_percentile, with or without NumPy
+        """
+        numbers = [(i * 7919) % 1009 / 7.0 for i in range(2000)]
+        numpy = stats_helper.numpy
+        try:
+            for stats_helper.numpy in set([numpy, None]):
+                values = stats_helper.ExactValues()
+                other = stats_helper.ExactValues()
+                for number in numbers[:1500]:
+                    values.record(number)
+                for number in numbers[1500:]:
+                    other.record(number)
+                self.assertEqual(values.percentile(50), stats_helper.find_percentile(numbers[:1500], 50))
+                values.merge(other)
+                self.assertEqual(values.percentiles([0, 33, 90, 99.9, 100]),
+                    [stats_helper.find_percentile(list(numbers), p) for p in (0, 33, 90, 99.9, 100)])
+                self.assertAlmostEqual(values.mean(), stats_helper.find_mean(numbers))
+        finally:
+            stats_helper.numpy = numpy
+
@@ -0,0 +1,98 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from logster.tailer import LogTail
+
+
+class TestLogTail(unittest.TestCase):
+
+    def setUp(self):
+        self.log_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.log_dir, 'access_log')
+
+    def tearDown(self):
+        shutil.rmtree(self.log_dir)
+
+    def write(self, data, path=None, mode='ab'):
+        f = open(path or self.path, mode)
+        f.write(data)
+        f.close()
+
+    def test_only_new_lines(self):
+        self.write(b'one\ntwo\n')
+        tail = LogTail(self.path)
+        tail.seek_to_end()
+        self.write(b'three\nfour\n')
+        tail = LogTail(self.path, tail.position, tail.fingerprint)
+        self.assertEqual(list(tail), ['three\n', 'four\n'])
+        self.assertEqual(tail.position, 19)
+
+    def test_partial_line_left_for_next_run(self):
+        self.write(b'one\ntw')
+        tail = LogTail(self.path)
+        self.assertEqual(list(tail), ['one\n'])
+        self.write(b'o\n')
+        tail = LogTail(self.path, tail.position, tail.fingerprint)
+        self.assertEqual(list(tail), ['two\n'])
+
+    def test_rotated(self):
+        """
+        The rest of the rotated file is read before the new log
+        """
+        self.write(b'one\n')
+        tail = LogTail(self.path)
+        list(tail)
+        self.write(b'two\n')
+        os.rename(self.path, self.path + '.1')
+        self.write(b'three\n')
+        tail = LogTail(self.path, tail.position, tail.fingerprint)
+        self.assertEqual(list(tail), ['two\n', 'three\n'])
+        self.assertEqual(tail.position, 6)
+        self.assertEqual(tail.bytes_read(), 10)
+
+    def test_bytes_left(self):
+        self.write(b'one\ntwo\n')
+        tail = LogTail(self.path)
+        lines = iter(tail)
+        next(lines)
+        self.assertEqual((tail.bytes_read(), tail.bytes_left()), (4, 4))
+
+    def test_truncated(self):
+        self.write(b'one\ntwo\n')
+        tail = LogTail(self.path)
+        list(tail)
+        self.write(b'three\n', mode='wb')
+        tail = LogTail(self.path, tail.position, tail.fingerprint)
+        self.assertEqual(list(tail), ['three\n'])
+
+    def test_legacy_offset_without_fingerprint(self):
+        self.write(b'one\ntwo\n')
+        tail = LogTail(self.path, 4)
+        self.assertEqual(list(tail), ['two\n'])
+
+    def test_checkpoint_in_rotated_file(self):
+        """
+        A checkpoint taken in the rotated file resumes in the rotated file
+        """
+        self.write(b'one\n')
+        tail = LogTail(self.path)
+        list(tail)
+        self.write(b'two\nthree\n')
+        os.rename(self.path, self.path + '.1')
+        self.write(b'four\n')
+        tail = LogTail(self.path, tail.position, tail.fingerprint)
+        lines = iter(tail)
+        self.assertEqual(next(lines), 'two\n')
+        position, fingerprint = tail.checkpoint()
+        tail = LogTail(self.path, position, fingerprint)
+        self.assertEqual(list(tail), ['three\n', 'four\n'])
+
+    def test_binary(self):
+        """
+        Binary parsers get the undecoded bytes, malformed UTF-8 included
+        """
+        self.write(b'caf\xe9\n')
+        self.assertEqual(list(LogTail(self.path, binary=True)), [b'caf\xe9\n'])
+        self.assertEqual(list(LogTail(self.path))[0][:3], 'caf')